@@ -1,28 +1,97 @@
 """
 Bootstrap Flask app + ثبت روت‌ها + CORS و Sentry
+
+    python app.py   سرور توسعهٔ Flask (تک‌پردازه)؛ برای production از serve.py استفاده کنید.
+
+تنظیمات Sentry (متغیر محیطی):
+    SENTRY_DSN                    آدرس DSN (خالی = غیرفعال)
+    SENTRY_TRACES_SAMPLE_RATE     نسبت درخواست‌های trace‌شده (پیش‌فرض 0.05)
+    SENTRY_PROFILES_SAMPLE_RATE   نسبت trace‌هایی که profile می‌شوند (پیش‌فرض 0)
+    SENTRY_ENVIRONMENT            نام محیط (مثلاً production)
 """
 import os
-from flask import Flask
+import time
+from flask import Flask, Response, g, request
 from flask_cors import CORS
-import sentry_sdk
 
+from backend import log, timing
+from backend.aio import current_tenant
+from backend.audio_handler import MAX_UPLOAD_BYTES
+from backend.metrics import http_duration, http_requests
 from backend.routes.chat_routes import bp_chat
 from backend.routes.audio_routes import bp_audio
+from backend.routes.batch_routes import bp_batch
+from backend.routes.errors import too_large_response
+from backend.routes.metrics_routes import bp_metrics
+
+log.configure()
+
+# بزرگ‌ترین بدنهٔ مجاز: فایل صوتی + سربار multipart (مرزها، هدرهای هر بخش، فیلدهای فرم)
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
 
 # ───────────────────────────── sentry
-sentry_sdk.init(
-    dsn="https://ef6083428e8791ad603a1d53b6a6666c@sentry.kloudify.net/53",
-    traces_sample_rate=1.0,
-)
+SENTRY_DEFAULT_DSN = "https://ef6083428e8791ad603a1d53b6a6666c@sentry.kloudify.net/53"
+
+
+def init_sentry() -> None:
+    """sentry_sdk فقط وقتی DSN داریم import می‌شود (خالی = غیرفعال، مثلاً هنگام بنچمارک).
+
+    در حالت چندپردازه‌ای باید پس از fork و در هر worker صدا زده شود (نخ ارسال Sentry از fork جان سالم به در نمی‌برد).
+    """
+    dsn = os.getenv("SENTRY_DSN", SENTRY_DEFAULT_DSN)
+    if not dsn:
+        return
+    import sentry_sdk
+    sentry_sdk.init(
+        dsn=dsn,
+        traces_sample_rate=float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", 0.05)),
+        profiles_sample_rate=float(os.getenv("SENTRY_PROFILES_SAMPLE_RATE", 0)),
+        environment=os.getenv("SENTRY_ENVIRONMENT"),
+    )
+
 
 # ───────────────────────────── flask
-def create_app() -> Flask:
+def create_app(with_sentry: bool = True) -> Flask:
+    """with_sentry=False: serve.py خودش Sentry را در هر worker راه‌اندازی می‌کند."""
+    if with_sentry:
+        init_sentry()
+
     app = Flask(__name__)
+    # بدون سقف، Werkzeug آپلودهای بزرگ multipart را پیش از بررسی MAX_UPLOAD_BYTES کامل روی دیسک/حافظه می‌ریزد
+    app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+    app.register_error_handler(413, too_large_response)
     CORS(app)
 
     # Register blueprints
     app.register_blueprint(bp_chat)
     app.register_blueprint(bp_audio)
+    app.register_blueprint(bp_batch)
+    app.register_blueprint(bp_metrics)
+
+    # زمان هر مرحله در هدر Server-Timing (برای بنچمارک و DevTools مرورگر) و در /metrics
+    @app.before_request
+    def _start_timing() -> None:
+        g.started = time.perf_counter()
+        timing.start_request()
+
+    @app.after_request
+    def _server_timing(response: Response) -> Response:
+        spans = timing.current()
+        if spans:
+            response.headers["Server-Timing"] = timing.server_timing_header(spans)
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        if endpoint not in ("/metrics", "/healthz"):
+            http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+            http_duration.observe(time.perf_counter() - g.get("started", time.perf_counter()), endpoint=endpoint)
+        return response
+
+    # tenant جاری روی نخ gthread می‌ماند؛ بدون reset به درخواست بعدیِ همان نخ می‌رسید.
+    # در پاسخ استریمی (stream_with_context) teardown پس از پایان استریم اجرا می‌شود.
+    @app.teardown_request
+    def _reset_tenant(_exc) -> None:
+        token = g.pop("tenant_token", None)
+        if token is not None:
+            current_tenant.reset(token)
 
     return app
 
@@ -31,4 +100,4 @@ def create_app() -> Flask:
 if __name__ == "__main__":
     app = create_app()
     port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    app.run(host="0.0.0.0", port=port, debug=os.getenv("FLASK_DEBUG") == "1")
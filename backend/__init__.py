@@ -2,11 +2,48 @@
 پکیج backend: همه‌چیزِ منطق بیزنسی و لایه API.
 
 اینجا یک نمونه Singleton از Core می‌سازیم تا در همهٔ روت‌ها
-و تست‌ها به‌سادگی در دسترس باشد.
+و تست‌ها به‌سادگی در دسترس باشد. bot و session_store با اولین دسترسی ساخته
+می‌شوند تا import یک زیرماژول سبک (مثلاً backend.audio_codec در پردازه‌های استخر
+decode) Core، کش پاسخ و نمایهٔ قوانین را نسازد.
 """
-from .core import Core
+import threading
 
-# نمونهٔ سراسری ربات
-bot = Core()
+from .metrics import registry
 
-__all__ = ["bot"]
+_lock = threading.Lock()
+
+
+def _collect_cache():
+    if bot.cache is None:
+        return
+    stats = bot.cache.stats()
+    yield "qy_answer_cache_lookups_total", {"result": "hit"}, stats["hits"]
+    yield "qy_answer_cache_lookups_total", {"result": "miss"}, stats["misses"]
+
+
+def _build() -> None:
+    global bot, session_store
+    from .core import Core
+    from .sessions import SessionStore
+
+    # نمونهٔ سراسری ربات
+    bot = Core()
+
+    # جلسه‌های گفت‌وگو (تاریخچه سمت سرور)
+    session_store = SessionStore()
+
+    registry.source("qy_answer_cache_lookups_total", "counter", "Answer cache lookups by result.", _collect_cache)
+    registry.source("qy_sessions", "gauge", "Conversation sessions held in memory.",
+                    lambda: [("qy_sessions", {}, len(session_store))])
+
+
+def __getattr__(name: str):
+    if name in ("bot", "session_store"):
+        with _lock:
+            if name not in globals():
+                _build()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ["bot", "session_store"]
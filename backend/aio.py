@@ -0,0 +1,200 @@
+"""
+aio – پل asyncio برای فراخوانی‌های upstream (OpenAI) از روت‌های sync Flask
+
+یک event loop پس‌زمینه در هر پردازه همهٔ فراخوانی‌های شبکه‌ای به OpenAI را
+به صورت async اجرا می‌کند (یک pool اتصال، بدون نخ اضافه برای هر فراخوانی). نخ
+درخواست (gthread) در تمام مدت فراخوانی — و در استریم SSE تا پایان استریم — منتظر
+نتیجه می‌ماند؛ پس هر پردازه حداکثر SERVE_THREADS گفت‌وگوی هم‌زمان دارد. پیش‌فرض
+SERVE_THREADS در serve.py برابر UPSTREAM_MAX_INFLIGHT + UPSTREAM_MAX_QUEUE (+ چند نخ
+برای بقیهٔ endpointها) است تا صف پر واقعاً به 503 برسد و درخواست‌ها بی‌صدا در
+backlog اتصال‌های gunicorn نمانند.
+
+تعداد فراخوانی‌های هم‌زمان با یک سقف سراسری محدود می‌شود و صف انتظار هم
+محدود است؛ وقتی صف پر باشد UpstreamBusy پرتاب می‌شود تا روت سریعاً 503 برگرداند.
+صف انتظار بین tenantها (current_tenant) وزن‌دار و منصفانه است (start-time fair queuing):
+tenantی که صف را پر کرده فقط سهم وزن خودش را می‌گیرد و بقیه پشت سرش نمی‌مانند.
+
+تنظیمات (متغیر محیطی):
+    UPSTREAM_MAX_INFLIGHT   حداکثر فراخوانی هم‌زمان به upstream (پیش‌فرض 64)
+    UPSTREAM_MAX_QUEUE      حداکثر درخواست منتظر در صف (پیش‌فرض 256)
+    UPSTREAM_RETRY_AFTER_S  مقدار هدر Retry-After در پاسخ 503 (پیش‌فرض 2)
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+from .metrics import registry
+
+T = TypeVar("T")
+
+UPSTREAM_MAX_INFLIGHT = int(os.getenv("UPSTREAM_MAX_INFLIGHT", 64))
+UPSTREAM_MAX_QUEUE = int(os.getenv("UPSTREAM_MAX_QUEUE", 256))
+UPSTREAM_RETRY_AFTER_S = int(os.getenv("UPSTREAM_RETRY_AFTER_S", 2))
+
+
+class UpstreamBusy(RuntimeError):
+    """Raised when the upstream wait queue is full; map to 503 + Retry-After."""
+
+    def __init__(self, retry_after: int = UPSTREAM_RETRY_AFTER_S):
+        super().__init__("سرویس در حال حاضر شلوغ است. لطفاً چند لحظه بعد دوباره تلاش کنید.")
+        self.retry_after = retry_after
+
+
+class RateLimited(RuntimeError):
+    """Raised when one tenant exceeds its own limits; map to 429 + Retry-After."""
+
+    def __init__(self, retry_after: int = UPSTREAM_RETRY_AFTER_S):
+        super().__init__("تعداد درخواست‌های این دامنه از سقف مجاز بیشتر است. لطفاً کمی بعد دوباره تلاش کنید.")
+        self.retry_after = retry_after
+
+
+# tenant درخواست جاری (شیئی با name، weight و max_queued)؛ روت‌ها مقداردهی می‌کنند
+current_tenant: contextvars.ContextVar = contextvars.ContextVar("upstream_tenant", default=None)
+
+
+# ───────────────────────────── limiter
+class UpstreamLimiter:
+    """Global cap on in-flight upstream calls with a bounded, weighted-fair wait queue.
+
+    A waiter's tag is max(virtual time, its tenant's last tag) + 1/weight; a freed
+    slot is handed to the lowest tag. Only used from the bridge loop, so no lock.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.reset()
+
+    def reset(self) -> None:
+        self.inflight = 0
+        self.waiting = 0
+        self._heap = []  # (tag, seq, tenant, future)
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._last_tag = {}
+        self._queued = {}
+
+    def queued(self, tenant: str) -> int:
+        return self._queued.get(tenant, 0)
+
+    async def _wait_turn(self, tenant) -> None:
+        name = getattr(tenant, "name", "")
+        max_queued = getattr(tenant, "max_queued", None)
+        if self.waiting >= self.max_queue:
+            raise UpstreamBusy()
+        if max_queued is not None and self.queued(name) >= max_queued:
+            raise tenant.reject_queued()
+
+        tag = max(self._vtime, self._last_tag.get(name, 0.0)) + 1.0 / getattr(tenant, "weight", 1.0)
+        self._last_tag[name] = tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._seq), name, future))
+        self.waiting += 1
+        self._queued[name] = self.queued(name) + 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # نوبت رسیده بود ولی فراخواننده لغو شد؛ slot به نفر بعد می‌رسد
+            raise
+        finally:
+            self.waiting -= 1
+            self._queued[name] -= 1
+
+    def _release(self) -> None:
+        while self._heap:
+            tag, _, _, future = heapq.heappop(self._heap)
+            if future.done():  # منتظرِ لغوشده
+                continue
+            self._vtime = tag
+            future.set_result(None)  # slot مستقیماً تحویل داده می‌شود؛ inflight ثابت می‌ماند
+            return
+        self.inflight -= 1
+
+    def try_slot(self) -> bool:
+        """slot بدون انتظار برای کار اختیاری (مثل hedge)؛ اگر سقف پر است یا کسی در صف است False.
+        slot گرفته‌شده با release() پس داده می‌شود."""
+        if self.inflight < self.max_inflight and not self.waiting:
+            self.inflight += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        self._release()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self.inflight < self.max_inflight:
+            self.inflight += 1
+        else:
+            await self._wait_turn(current_tenant.get())
+        try:
+            yield
+        finally:
+            self._release()
+
+
+limiter = UpstreamLimiter(UPSTREAM_MAX_INFLIGHT, UPSTREAM_MAX_QUEUE)
+registry.source("qy_upstream_slots", "gauge", "Upstream calls in flight or waiting for a slot.",
+                lambda: [("qy_upstream_slots", {"state": "inflight"}, limiter.inflight),
+                         ("qy_upstream_slots", {"state": "waiting"}, limiter.waiting)])
+
+
+# ───────────────────────────── bridge loop
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """event loop پس‌زمینه را (به ازای هر پردازه، پس از fork هم) برمی‌گرداند."""
+    global _loop, _loop_pid
+    if _loop is not None and _loop_pid == os.getpid():
+        return _loop
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="upstream-loop", daemon=True)
+            thread.start()
+            # پس از fork، صف و futureهای پردازهٔ والد قابل استفاده نیستند
+            limiter.reset()
+            _loop, _loop_pid = loop, os.getpid()
+    return _loop
+
+
+async def _in_context(ctx: contextvars.Context, awaitable: Awaitable[T]) -> T:
+    # contextvarهای نخ فراخواننده (مثلاً tenant جاری) در task هم دیده شوند
+    for var, value in ctx.items():
+        var.set(value)
+    return await awaitable
+
+
+def run(awaitable: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """اجرای یک coroutine روی loop پس‌زمینه و انتظار (sync) برای نتیجه."""
+    ctx = contextvars.copy_context()
+    future = asyncio.run_coroutine_threadsafe(_in_context(ctx, awaitable), get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iterate(agen: AsyncIterator[T]) -> Iterator[T]:
+    """تبدیل یک async generator به generator معمولی (برای پاسخ‌های استریمی Flask)."""
+    try:
+        while True:
+            try:
+                item = run(agen.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        # اگر کلاینت وسط استریم قطع شد، generator سمت upstream هم بسته شود
+        with contextlib.suppress(Exception):
+            run(agen.aclose())
@@ -0,0 +1,210 @@
+"""
+answer_cache – کش پاسخ پرسش‌های تکراری (بدون تاریخچه) جلوی Core.chat_with_gpt
+
+کلید کش = فرم یکسان‌شدهٔ پرسش + اثر انگشت پرامپت سیستمی و مدل؛
+با تغییر پرامپت، کلیدهای قبلی دیگر خوانده نمی‌شوند و کش پاک‌سازی می‌شود.
+زمان اولین دیدن هر اثر انگشت در خود بک‌اند ثبت می‌شود و هر پردازه فقط کلیدهای
+اثر انگشت‌های قدیمی‌تر از مال خودش را (یک بار) پاک می‌کند؛ در استقرار تدریجی روی
+redis مشترک، workerهای قدیم و جدید پاسخ‌های یکدیگر را پاک نمی‌کنند.
+
+تنظیمات (متغیر محیطی):
+    ANSWER_CACHE_BACKEND      memory (پیش‌فرض) | redis | off
+    ANSWER_CACHE_MAX_ENTRIES  حداکثر تعداد آیتم در بک‌اند حافظه (پیش‌فرض 2048)
+    ANSWER_CACHE_TTL_S        عمر هر پاسخ بر حسب ثانیه (پیش‌فرض 86400)
+    ANSWER_CACHE_REDIS_URL    آدرس redis برای اشتراک کش بین چند worker
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from .normalize import normalize_text
+
+log = logging.getLogger(__name__)
+
+
+_RETIRED = "retired"
+
+
+# ───────────────────────────── backends
+class MemoryBackend:
+    """LRU درون‌پردازه‌ای با انقضای TTL (thread-safe)."""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._registries: Dict[str, Dict[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl_s: int) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl_s)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def purge(self, prefix: str) -> int:
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            for k in keys:
+                del self._data[k]
+            return len(keys)
+
+    def register(self, registry: str, member: str) -> Dict[str, float]:
+        """زمان اولین دیدن member (اگر تازه باشد ثبت می‌شود)؛ همهٔ اعضای فعال → زمان."""
+        with self._lock:
+            members = self._registries.setdefault(registry, {})
+            members.setdefault(member, time.time())
+            return {m: seen for m, seen in members.items() if seen is not None}
+
+    def retire(self, registry: str, member: str) -> None:
+        """member دیگر در register برنمی‌گردد ولی ثبت دوباره‌اش هم زمان تازه نمی‌گیرد."""
+        with self._lock:
+            self._registries.setdefault(registry, {})[member] = None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RedisBackend:
+    """بک‌اند اشتراکی روی redis؛ چند worker/کانتینر از hit یکدیگر استفاده می‌کنند.
+
+    حذف بر اساس اندازه به سیاست maxmemory خود redis (مثلاً allkeys-lru) سپرده می‌شود.
+    اندازه فقط کلیدهای namespace همین کش را می‌شمارد (کش متن صوت هم در همین DB است).
+    """
+
+    def __init__(self, url: str, namespace: str = ""):
+        try:
+            import redis  # وابستگی اختیاری: pip install redis
+        except ImportError as e:
+            raise RuntimeError("برای ANSWER_CACHE_BACKEND=redis باید پکیج redis نصب باشد.") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self.namespace = namespace
+
+    def get(self, key: str) -> Optional[str]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: str, ttl_s: int) -> None:
+        self._client.set(key, value, ex=ttl_s)
+
+    def purge(self, prefix: str) -> int:
+        count = 0
+        for key in self._client.scan_iter(match=f"{prefix}*", count=500):
+            self._client.delete(key)
+            count += 1
+        return count
+
+    def register(self, registry: str, member: str) -> Dict[str, float]:
+        # زمان سرور redis (نه ساعت هر میزبان) تا ترتیب بین کانتینرها معتبر باشد
+        seconds, micros = self._client.time()
+        pipe = self._client.pipeline()
+        pipe.hsetnx(registry, member, f"{seconds}.{micros:06d}")
+        pipe.hgetall(registry)
+        _, members = pipe.execute()
+        return {m: float(seen) for m, seen in members.items() if seen != _RETIRED}
+
+    def retire(self, registry: str, member: str) -> None:
+        self._client.hset(registry, member, _RETIRED)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._client.scan_iter(match=f"{self.namespace}*", count=1000))
+
+
+# ───────────────────────────── cache
+class AnswerCache:
+    """کش پاسخ بر اساس پرسش یکسان‌شده، با شمارندهٔ hit/miss."""
+
+    NAMESPACE = "qy:answer:"
+    # بیرون از NAMESPACE تا purge() کامل و شمارش اندازه آن را نبینند
+    FINGERPRINTS = "qy:answer-fingerprints"
+
+    def __init__(self, backend, ttl_s: int = 86400):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional["AnswerCache"]:
+        kind = os.getenv("ANSWER_CACHE_BACKEND", "memory").lower()
+        ttl_s = int(os.getenv("ANSWER_CACHE_TTL_S", 86400))
+        if kind == "off":
+            return None
+        if kind == "redis":
+            url = os.getenv("ANSWER_CACHE_REDIS_URL", "redis://localhost:6379/0")
+            return cls(RedisBackend(url, cls.NAMESPACE), ttl_s)
+        max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 2048))
+        return cls(MemoryBackend(max_entries), ttl_s)
+
+    # ------------------------------------------------------------------
+    def _key(self, question: str, fingerprint: str) -> Optional[str]:
+        normalized = normalize_text(question)
+        if not normalized:
+            return None
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        return f"{self.NAMESPACE}{fingerprint}:{digest}"
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        """با اولین دیدن هر اثر انگشت در این پردازه، پاسخ‌های اثر انگشت‌های قدیمی‌تر پاک می‌شوند."""
+        with self._lock:
+            if self._fingerprint == fingerprint:
+                return
+            self._fingerprint = fingerprint
+        try:
+            seen = self.backend.register(self.FINGERPRINTS, fingerprint)
+        except Exception as e:  # بدون ثبت، پاسخ‌های قدیمی با TTL منقضی می‌شوند
+            log.warning("answer cache fingerprint not registered", extra={"error": str(e)})
+            return
+        mine = seen.get(fingerprint)
+        for previous, first_seen in seen.items():
+            # اثر انگشت جدیدتر (نسخهٔ تازهٔ در حال استقرار) دست نمی‌خورد
+            if mine is None or previous == fingerprint or first_seen >= mine:
+                continue
+            self.backend.retire(self.FINGERPRINTS, previous)
+            removed = self.backend.purge(f"{self.NAMESPACE}{previous}:")
+            log.info("answer cache fingerprint changed; purged old entries",
+                     extra={"fingerprint": previous, "purged": removed})
+
+    @staticmethod
+    def fingerprint(system_prompt: str, model: str) -> str:
+        return hashlib.sha1(f"{model}\n{system_prompt}".encode("utf-8")).hexdigest()[:12]
+
+    def get(self, question: str, fingerprint: str) -> Optional[str]:
+        self._check_fingerprint(fingerprint)
+        key = self._key(question, fingerprint)
+        value = self.backend.get(key) if key else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, question: str, fingerprint: str, answer: str) -> None:
+        key = self._key(question, fingerprint)
+        if key and answer:
+            self.backend.set(key, answer, self.ttl_s)
+
+    def purge(self) -> int:
+        """پاک‌سازی کامل (مثلاً پس از به‌روزرسانی دستی پرامپت)."""
+        return self.backend.purge(self.NAMESPACE)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
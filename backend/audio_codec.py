@@ -0,0 +1,283 @@
+"""
+audio_codec – مراحل ffmpeg/pydub صدا (probe، رمزگشایی، VAD، فشرده‌سازی به Ogg/Opus)
+
+این ماژول نقطهٔ ورود پردازه‌های استخر decode_pool است: کارهای استخر (_prepare_payload،
+_prepare_pcm) و _timed_call از اینجا pickle می‌شوند، پس پردازهٔ spawn‌شده فقط همین ماژول
+(و timing/log) را import می‌کند، نه Core، کش‌ها، نمایهٔ قوانین یا کلاینت‌های upstream.
+بقیهٔ مسیر صوت (آپلود، کش متن، STT، رمزگشایی استریمی) در audio_handler است.
+
+initializer استخر هر worker را رهبر یک process group می‌کند؛ ffmpeg/ffprobeهای فرزند
+عضو همان گروه‌اند و recycle استخر (decode_pool) کل گروه را می‌کشد، نه فقط worker را.
+
+تنظیمات (متغیر محیطی):
+    AUDIO_FFMPEG_TIMEOUT_S    سقف هر اجرای ffmpeg/ffprobe (پیش‌فرض 15)
+    AUDIO_VAD                 on (پیش‌فرض) | off
+    AUDIO_VAD_SILENCE_DBFS    سطح انرژی کمتر از این مقدار سکوت است (پیش‌فرض -45)
+    AUDIO_VAD_MIN_SPEECH_MS   کمتر از این مقدار گفتار = فایل بی‌صدا (پیش‌فرض 300)
+    AUDIO_VAD_PAD_MS          حاشیهٔ نگه‌داشته‌شده دور هر بخش گفتار (پیش‌فرض 200)
+    AUDIO_VAD_MAX_GAP_MS      مکث‌های بلندتر از این مقدار کوتاه می‌شوند (پیش‌فرض 700)
+"""
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Final, Optional, Tuple
+
+from . import timing
+from .log import configure as configure_logging
+
+log = logging.getLogger(__name__)
+
+# pydub در اولین استفاده import می‌شود
+if TYPE_CHECKING:
+    from pydub import AudioSegment
+
+MAX_DURATION_S: Final[int] = 30
+
+# فرمت ارسال به مدل STT: مونو 16kHz با Opus (چند ده برابر کوچک‌تر از WAV)
+STT_SAMPLE_RATE: Final[int] = 16000
+STT_BITRATE: Final[str] = "24k"
+FFMPEG_TIMEOUT_S: Final[float] = float(os.getenv("AUDIO_FFMPEG_TIMEOUT_S", 15))
+
+# VAD انرژی‌محور (pydub.silence روی PCM مونو 16kHz)
+VAD_ENABLED: Final[bool] = os.getenv("AUDIO_VAD", "on").lower() != "off"
+VAD_SILENCE_DBFS: Final[float] = float(os.getenv("AUDIO_VAD_SILENCE_DBFS", -45))
+VAD_MIN_SPEECH_MS: Final[int] = int(os.getenv("AUDIO_VAD_MIN_SPEECH_MS", 300))
+VAD_PAD_MS: Final[int] = int(os.getenv("AUDIO_VAD_PAD_MS", 200))
+VAD_MAX_GAP_MS: Final[int] = int(os.getenv("AUDIO_VAD_MAX_GAP_MS", 700))
+VAD_STEP_MS: Final[int] = 10
+
+
+class TranscriptionError(RuntimeError):
+    """Raised when STT fails or input invalid."""
+
+
+class AudioDecodeError(TranscriptionError):
+    """Raised when ffmpeg cannot decode or encode the upload."""
+
+
+class SilentAudioError(TranscriptionError):
+    """Raised when a clip holds (almost) no speech; rejected without an STT call."""
+
+    def __init__(self, message: str, duration_s: float = 0.0):
+        # هر دو آرگومان در args تا exception از پردازهٔ استخر pickle شود
+        super().__init__(message, duration_s)
+        self.duration_s = duration_s
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+def _silent_message(filename: str) -> str:
+    return f"در فایل '{filename}' صدای گفتاری شنیده نشد. لطفاً دوباره ضبط کنید."
+
+
+# ───────────────────────────── ffmpeg / pydub
+@lru_cache(maxsize=None)
+def _ffmpeg() -> str:
+    from pydub.utils import get_encoder_name
+    return get_encoder_name()
+
+
+@lru_cache(maxsize=None)
+def _ffprobe() -> str:
+    from pydub.utils import get_prober_name
+    return get_prober_name()
+
+
+# کانتینرهایی که ممکن است moov را در انتها داشته باشند و بدون seek رمزگشایی نشوند
+SEEKABLE_EXTENSIONS: Final[Tuple[str, ...]] = (".mp4", ".m4a", ".3gp", ".3g2", ".mov")
+_INPUT: Final[str] = "<input>"  # جای ورودی در فرمان ffmpeg/ffprobe
+
+
+def _needs_seek(filename: str) -> bool:
+    return os.path.splitext(filename or "")[1].lower() in SEEKABLE_EXTENSIONS
+
+
+@contextmanager
+def _seekable_input(data: bytes):
+    """(مسیر، fdهای لازم برای پردازهٔ فرزند) یک کپی قابل seek از بایت‌ها؛ memfd در لینوکس، وگرنه فایل موقت."""
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("qy-audio", os.MFD_CLOEXEC)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            yield f"/proc/self/fd/{fd}", (fd,)
+        finally:
+            os.close(fd)
+        return
+    with tempfile.NamedTemporaryFile(prefix="qy-audio-") as tmp:
+        tmp.write(data)
+        tmp.flush()
+        yield tmp.name, ()
+
+
+def _run_on_input(cmd: list, data: bytes, seekable: bool) -> subprocess.CompletedProcess:
+    """اجرای فرمان با «-i _INPUT»؛ ورودی از pipe یا (seekable=True) از یک کپی قابل seek."""
+    if not seekable:
+        return subprocess.run([("pipe:0" if a == _INPUT else a) for a in cmd],
+                              input=data, capture_output=True, timeout=FFMPEG_TIMEOUT_S)
+    with _seekable_input(data) as (path, fds):
+        return subprocess.run([(path if a == _INPUT else a) for a in cmd], stdin=subprocess.DEVNULL,
+                              capture_output=True, timeout=FFMPEG_TIMEOUT_S, pass_fds=fds)
+
+
+def _segment(pcm: bytes) -> "AudioSegment":
+    """PCM مونو 16kHz (s16le) → AudioSegment."""
+    from pydub import AudioSegment
+    return AudioSegment(data=pcm, sample_width=2, frame_rate=STT_SAMPLE_RATE, channels=1)
+
+
+def _probe_duration(data: bytes, filename: str = "") -> Optional[float]:
+    """مدت فایل از هدر کانتینر (بدون رمزگشایی)؛ اگر معلوم نباشد None."""
+    try:
+        proc = _run_on_input(
+            [_ffprobe(), "-v", "error", "-show_format", "-show_streams", "-of", "json", "-i", _INPUT],
+            data, seekable=_needs_seek(filename),
+        )
+        info = json.loads(proc.stdout or b"{}")
+    except (OSError, subprocess.TimeoutExpired, ValueError) as e:
+        log.warning("ffprobe failed, falling back to bounded decode", extra={"error": str(e)})
+        return None
+
+    durations = [info.get("format", {}).get("duration")]
+    durations += [s.get("duration") for s in info.get("streams", []) if s.get("codec_type") == "audio"]
+    for d in durations:
+        try:
+            return float(d)
+        except (TypeError, ValueError):
+            continue
+    # برای مثال webm ضبط‌شده در مرورگر معمولاً مدت را در هدر ندارد
+    return None
+
+
+def _decode(data: bytes, filename: str = "") -> "AudioSegment":
+    """رمزگشایی به PCM مونو 16kHz؛ فقط تا کمی بیش از MAX_DURATION_S رمزگشایی می‌شود.
+
+    ورودی از pipe؛ کانتینرهای MP4 و هر رمزگشایی ناموفق از pipe از ورودی قابل seek.
+    """
+    cmd = [
+        _ffmpeg(), "-v", "error", "-nostdin", "-i", _INPUT,
+        "-t", str(MAX_DURATION_S + 1), "-vn",
+        "-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-f", "s16le", "pipe:1",
+    ]
+    seekable = _needs_seek(filename)
+    try:
+        proc = _run_on_input(cmd, data, seekable)
+        if not seekable and (proc.returncode != 0 or not proc.stdout):
+            # مثلاً m4a با نام/پسوند نامعمول که moov آن در انتهای فایل است
+            log.info("pipe decode failed; retrying from seekable input", extra={"filename": filename})
+            proc = _run_on_input(cmd, data, seekable=True)
+    except subprocess.TimeoutExpired:
+        raise AudioDecodeError(f"رمزگشایی فایل صوتی '{filename}' بیش از حد طول کشید.")
+    if proc.returncode != 0 or not proc.stdout:
+        detail = proc.stderr.decode("utf-8", "replace").strip()[-300:]
+        raise AudioDecodeError(f"خطا در رمزگشایی فایل صوتی '{filename}': {detail}. "
+                                 "ممکن است فایل خراب باشد یا فرمت آن توسط ffmpeg پشتیبانی نشود.")
+    return _segment(proc.stdout)
+
+
+@timing.span("vad")
+def _trim_silence(audio: "AudioSegment", filename: str = "") -> "AudioSegment":
+    """سکوت ابتدا و انتها حذف و مکث‌های بلندتر از VAD_MAX_GAP_MS کوتاه می‌شوند؛
+    اگر کل گفتار کمتر از VAD_MIN_SPEECH_MS باشد SilentAudioError."""
+    from pydub.silence import detect_nonsilent
+
+    audio = audio.set_channels(1).set_frame_rate(STT_SAMPLE_RATE).set_sample_width(2)
+    if not VAD_ENABLED:
+        return audio
+    ranges = detect_nonsilent(audio, min_silence_len=VAD_MAX_GAP_MS,
+                              silence_thresh=VAD_SILENCE_DBFS, seek_step=VAD_STEP_MS)
+    if sum(end - start for start, end in ranges) < VAD_MIN_SPEECH_MS:
+        raise SilentAudioError(_silent_message(filename), audio.duration_seconds)
+
+    # بخش‌ها دست‌کم VAD_MAX_GAP_MS از هم فاصله دارند، پس حاشیه‌ها هم‌پوشانی ندارند
+    pad = min(VAD_PAD_MS, VAD_MAX_GAP_MS // 2)
+    return _segment(b"".join(audio[max(0, start - pad):end + pad].raw_data for start, end in ranges))
+
+
+def _encode_for_stt(audio: "AudioSegment") -> bytes:
+    """AudioSegment → Ogg/Opus فشرده (در حافظه) برای آپلود به مدل STT."""
+    audio = audio.set_channels(1).set_frame_rate(STT_SAMPLE_RATE).set_sample_width(2)
+    return _encode_pcm(audio.raw_data)
+
+
+@timing.span("export")
+def _encode_pcm(pcm: bytes) -> bytes:
+    """PCM مونو 16kHz (s16le) → Ogg/Opus از طریق pipe."""
+    cmd = [
+        _ffmpeg(), "-v", "error", "-nostdin",
+        "-f", "s16le", "-ar", str(STT_SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+        "-c:a", "libopus", "-b:a", STT_BITRATE, "-application", "voip", "-f", "ogg", "pipe:1",
+    ]
+    try:
+        proc = subprocess.run(cmd, input=pcm, capture_output=True, timeout=FFMPEG_TIMEOUT_S)
+    except subprocess.TimeoutExpired:
+        raise AudioDecodeError("فشرده‌سازی فایل صوتی بیش از حد طول کشید.")
+    if proc.returncode != 0 or not proc.stdout:
+        detail = proc.stderr.decode("utf-8", "replace").strip()[-300:]
+        raise AudioDecodeError(f"خطا در فشرده‌سازی فایل صوتی: {detail}")
+    return proc.stdout
+
+
+def _validate_and_get_audio_segment(data: bytes, filename: str) -> "AudioSegment":
+    """Validates the uploaded bytes and returns an AudioSegment (all in memory)."""
+    # رد زودهنگام فایل‌های بلند از روی هدر، پیش از رمزگشایی کامل
+    with timing.span("duration_check"):
+        dur = _probe_duration(data, filename)
+    if dur is not None and dur > MAX_DURATION_S:
+        raise TranscriptionError(f"طول فایل '{filename}' ({dur:.2f}s) نباید بیش از {MAX_DURATION_S} ثانیه باشد.")
+
+    with timing.span("decode"):
+        audio = _decode(data, filename)
+
+    # رمزگشایی در MAX_DURATION_S + 1 قطع شده است؛ اگر به آن رسیده، فایل بلندتر است
+    dur = audio.duration_seconds
+    if dur > MAX_DURATION_S:
+        raise TranscriptionError(f"طول فایل '{filename}' نباید بیش از {MAX_DURATION_S} ثانیه باشد.")
+
+    log.debug("audio validated", extra={"filename": filename, "duration_s": round(dur, 2)})
+    return audio
+
+
+def _prepare_audio(audio: "AudioSegment", filename: str):
+    """VAD + فشرده‌سازی؛ (بایت‌های Ogg/Opus، مدت اصلی، مدت ارسالی) بر حسب ثانیه."""
+    voiced = _trim_silence(audio, filename)
+    payload = _encode_for_stt(voiced)
+    log.debug("audio encoded for stt", extra={"duration_s": round(audio.duration_seconds, 2),
+                                               "sent_s": round(voiced.duration_seconds, 2), "bytes": len(payload)})
+    return payload, audio.duration_seconds, voiced.duration_seconds
+
+
+def _prepare_payload(data: bytes, filename: str):
+    """کار استخر decode برای آپلود کامل: اعتبارسنجی + رمزگشایی + VAD + فشرده‌سازی."""
+    return _prepare_audio(_validate_and_get_audio_segment(data, filename), filename)
+
+
+def _prepare_pcm(pcm: bytes, filename: str):
+    """کار استخر decode برای PCM رمزگشایی‌شده (مسیر استریمی): VAD + فشرده‌سازی."""
+    return _prepare_audio(_segment(pcm), filename)
+
+
+# ───────────────────────────── pool worker
+def init_worker() -> None:
+    """initializer پردازه‌های استخر: process group جدا و همان قالب لاگ پردازهٔ وب."""
+    os.setpgrp()
+    configure_logging()
+
+
+def _timed_call(fn: Callable, *args):
+    # داخل پردازهٔ worker اجرا می‌شود؛ زمان شروع/پایان (برای انتظار صف) و مراحل داخلی برمی‌گردد
+    timing.start_request()
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time(), timing.current()
+
+
+def _noop() -> None:
+    return None
@@ -1,169 +1,470 @@
 """
-audio_handler – تبدیل فایل WAV (≤30s) به متن فارسی
+audio_handler – تبدیل فایل صوتی (≤30s) به متن فارسی
 استفاده از مدل gpt-4o-mini-transcribe
+
+کل مسیر در حافظه انجام می‌شود (بدون فایل موقت روی دیسک):
+    بایت‌های آپلود (با سقف حجم) → کش متن بر اساس sha256 بایت‌ها (transcript_cache)
+    → بررسی مدت از هدر کانتینر (ffprobe)
+    → رمزگشایی محدود به MAX_DURATION_S با ffmpeg از طریق pipe (downmix و resample به 16kHz mono PCM)
+      کانتینرهای MP4 (m4a/3gp/mov، مثل پیام صوتی iOS) که اطلاعات moov را در انتهای فایل دارند
+      از pipe خوانده نمی‌شوند؛ برای آن‌ها (و هر رمزگشایی ناموفق از pipe) ورودی قابل seek
+      (memfd، یا فایل موقت اگر memfd در دسترس نباشد) به ffmpeg داده می‌شود.
+    → VAD: حذف سکوت ابتدا و انتها و کوتاه کردن مکث‌های طولانی؛ فایل تقریباً بی‌صدا
+      بدون فراخوانی مدل رد می‌شود (SilentAudioError)
+    → فشرده‌سازی به Ogg/Opus برای ارسال به مدل STT
+مراحل ffmpeg/pydub (ماژول audio_codec) در استخر پردازه‌ای decode_pool اجرا می‌شوند، نه روی نخ درخواست.
+مسیر استریمی (رمزگشایی هم‌زمان با آپلود) ffmpeg خودش را روی نخ درخواست اجرا می‌کند،
+اما از سقف کارهای همان استخر سهم می‌گیرد (پر بودن → 503) و کل آپلود + رمزگشایی
+مهلت AUDIO_STREAM_DEADLINE_S دارد (پیش‌فرض 60 ثانیه).
+در مسیر استریمی hash پیش از رسیدن کل بدنه معلوم نیست؛ کلاینتی که فایلی را دوباره
+می‌فرستد sha256 آن را همراهش می‌فرستد (transcribe_stream) و اگر متنش در کش باشد بدنه
+بدون ffmpeg فقط خوانده و hash می‌شود.
+آپلودهای یکسانِ هم‌زمان (تلاش دوبارهٔ کلاینت) یک بار پردازش می‌شوند. ثانیه‌ها و
+بایت‌های صرفه‌جویی‌شده در qy_audio_saved_seconds_total / qy_audio_saved_bytes_total.
+
+تنظیمات ffmpeg و VAD در audio_codec فهرست شده‌اند.
 """
-import tempfile
+import asyncio
+import hashlib
+import logging
 import os
-import time 
-import shutil # برای کپی کردن فایل (برای دیباگ)
-from typing import Final
+import random
+import subprocess
+import threading
+import time
+from typing import TYPE_CHECKING, Final, Iterable, Optional, Tuple
 from werkzeug.datastructures import FileStorage
-import openai
-from pydub import AudioSegment, exceptions as pydub_exceptions
+
+from . import aio, inflight, timing
+from .aio import UpstreamBusy
+from .audio_codec import (
+    FFMPEG_TIMEOUT_S, MAX_DURATION_S, STT_SAMPLE_RATE, VAD_ENABLED, VAD_MAX_GAP_MS, VAD_MIN_SPEECH_MS, VAD_PAD_MS,
+    VAD_SILENCE_DBFS, AudioDecodeError, SilentAudioError, TranscriptionError, _ffmpeg, _prepare_payload, _prepare_pcm,
+    _segment, _silent_message,
+)
+from .decode_pool import pool as decode_pool
+from .metrics import audio_saved_bytes, audio_saved_seconds, audio_stt_seconds, registry
+from .transcript_cache import TranscriptCache
+
+log = logging.getLogger(__name__)
+
+# pydub و openai در اولین استفاده import می‌شوند (راه‌اندازی سریع‌تر پردازه)
+if TYPE_CHECKING:
+    from pydub import AudioSegment
 
 STT_MODEL: Final[str] = "gpt-4o-mini-transcribe"
-MAX_DURATION_S: Final[int] = 30
+STT_UPLOAD_NAME: Final[str] = "audio.ogg"
+MAX_UPLOAD_BYTES: Final[int] = int(os.getenv("AUDIO_MAX_UPLOAD_BYTES", 5 * 1024 * 1024))
 
-# مسیر برای ذخیره فایل‌های صوتی مشکل‌دار (برای دیباگ)
-# مطمئن شوید که این دایرکتوری وجود دارد و قابل نوشتن توسط کاربر Flask است.
-DEBUG_AUDIO_PATH = "/tmp/problematic_audio_files/" 
-# ایجاد دایرکتوری دیباگ اگر وجود ندارد
-if not os.path.exists(DEBUG_AUDIO_PATH):
-    try:
-        os.makedirs(DEBUG_AUDIO_PATH, exist_ok=True) # exist_ok=True از خطا جلوگیری می‌کند اگر دایرکتوری از قبل وجود داشته باشد
-        print(f"Debug directory ensured: {DEBUG_AUDIO_PATH}")
-    except OSError as e:
-        print(f"Warning: Could not create/ensure debug directory {DEBUG_AUDIO_PATH}: {e}. Debug files will not be saved.")
-        DEBUG_AUDIO_PATH = None # غیرفعال کردن ذخیره فایل دیباگ در صورت خطا
+# سقف کل یک کار در استخر (صف + probe + decode + encode)
+DECODE_JOB_TIMEOUT_S: Final[float] = FFMPEG_TIMEOUT_S * 3
+# سقف کل آپلود استریمی + رمزگشایی آن (کلاینتی که بایت‌ها را قطره‌قطره می‌فرستد نخ و ffmpeg را نگه ندارد)
+STREAM_DEADLINE_S: Final[float] = float(os.getenv("AUDIO_STREAM_DEADLINE_S", 60))
 
-class TranscriptionError(RuntimeError):
-    """Raised when STT fails or input invalid."""
+# متن کش‌شده به مدل و تنظیمات پیش‌پردازش وابسته است
+transcript_cache = TranscriptCache.from_env(
+    version=f"{STT_MODEL}:{VAD_ENABLED:d}:{VAD_SILENCE_DBFS}:{VAD_MIN_SPEECH_MS}:{VAD_PAD_MS}:{VAD_MAX_GAP_MS}")
 
+# ذخیرهٔ فایل‌های صوتی مشکل‌دار (برای دیباگ) – پیش‌فرض خاموش؛
+# با DEBUG_AUDIO_SAMPLE_RATE (بین 0 و 1) درصدی از خطاهای رمزگشایی ذخیره می‌شوند
+# و حجم کل دایرکتوری از DEBUG_AUDIO_MAX_BYTES بیشتر نمی‌شود (قدیمی‌ترها حذف می‌شوند).
+DEBUG_AUDIO_PATH = os.getenv("DEBUG_AUDIO_PATH", "/tmp/problematic_audio_files/")
+DEBUG_AUDIO_SAMPLE_RATE = float(os.getenv("DEBUG_AUDIO_SAMPLE_RATE", 0))
+DEBUG_AUDIO_MAX_BYTES = int(os.getenv("DEBUG_AUDIO_MAX_BYTES", 50 * 1024 * 1024))
 
-def _validate_and_get_audio_segment(file: FileStorage) -> AudioSegment:
-    """Validates the uploaded file and returns an AudioSegment."""
-    # دیگر به mimetype برای تصمیم‌گیری اولیه اتکا نمی‌کنیم، اجازه می‌دهیم pydub تشخیص دهد
-    print(f"Received file: '{file.filename}', mimetype reported by client: '{file.mimetype}'")
 
-    audio = None 
-    temp_path = None # برای نگهداری مسیر فایل موقت که ایجاد و سپس حذف می‌شود
+class StreamDeadlineError(AudioDecodeError):
+    """Raised when a streamed upload plus its decode overruns STREAM_DEADLINE_S."""
 
+
+def _deadline_message(filename: str) -> str:
+    return f"دریافت و رمزگشایی فایل صوتی '{filename}' بیش از {STREAM_DEADLINE_S:g} ثانیه طول کشید."
+
+
+# ───────────────────────────── ingest
+def _read_upload(file: FileStorage) -> bytes:
+    """Reads the upload into memory, rejecting oversize payloads before buffering them."""
+    log.debug("audio upload received", extra={"filename": file.filename, "mimetype": file.mimetype})
     try:
-        # --- همیشه فایل را ابتدا در یک مکان موقت ذخیره می‌کنیم ---
-        # این کار پایداری بیشتری نسبت به خواندن مستقیم از استریم FileStorage دارد
-        # و به ما اجازه می‌دهد فایل را برای دیباگ کپی کنیم.
-        
-        # قبل از ذخیره، پوینتر را به ابتدا برگردانید (اگر FileStorage از آن پشتیبانی کند)
-        if hasattr(file, 'seek') and callable(file.seek):
-            try:
-                file.seek(0)
-            except Exception as e_seek:
-                print(f"Warning: Could not seek on input filestream '{file.filename}': {e_seek}")
-
-        # ایجاد فایل موقت. پسوند را .webm یا .oga می‌گذاریم تا pydub/ffmpeg بهتر حدس بزند،
-        # یا حتی بدون پسوند و اجازه دهیم ffmpeg کاملا از محتوا تشخیص دهد.
-        # برای سازگاری بیشتر، فعلا بدون پسوند خاص ذخیره می‌کنیم.
-        fd, temp_path = tempfile.mkstemp(suffix=".dat") # .dat یا حتی بدون پسوند
-        os.close(fd)
-        
-        file.save(temp_path)
-        print(f"Saved uploaded file '{file.filename}' to temp file '{temp_path}'.")
-
-        if not os.path.isfile(temp_path) or os.path.getsize(temp_path) == 0:
-            raise TranscriptionError(f"فایل موقت در مسیر {temp_path} پس از ذخیره‌سازی ایجاد نشد یا خالی است.")
-        
-        # ---- بخش دیباگ: کپی کردن فایل موقت برای بررسی دستی ----
-        if DEBUG_AUDIO_PATH:
-            try:
-                # برای نام فایل دیباگ، از نام فایل موقت و یک پسوند عمومی استفاده می‌کنیم
-                # یا پسوندی که از mimetype حدس می‌زنیم (مثلا .webm اگر mimetype شامل آن باشد)
-                debug_file_ext = ".bin" # پسوند عمومی
-                if 'webm' in (file.mimetype or ""): debug_file_ext = ".webm"
-                elif 'ogg' in (file.mimetype or ""): debug_file_ext = ".ogg"
-                
-                debug_file_name = f"{os.path.basename(temp_path)}-{file.filename}{debug_file_ext}"
-                debug_file_copy_path = os.path.join(DEBUG_AUDIO_PATH, debug_file_name)
-                shutil.copy2(temp_path, debug_file_copy_path)
-                print(f"DEBUG: Copied temp file to '{debug_file_copy_path}' for inspection.")
-            except Exception as e_copy:
-                print(f"DEBUG: Failed to copy temp file for inspection: {e_copy}")
-        # ---- پایان بخش دیباگ ----
-
-        # به pydub اجازه دهید فرمت را از محتوای فایل تشخیص دهد
-        # از from_file استفاده کنید و format را مشخص نکنید
-        print(f"Attempting to load audio from '{temp_path}' with pydub (auto-detect format).")
-        audio = AudioSegment.from_file(temp_path) 
-        print(f"Successfully loaded audio from '{temp_path}'. Detected duration: {audio.duration_seconds:.2f}s")
-
-    except pydub_exceptions.CouldntDecodeError as e_decode:
-        # این خطا معمولا زمانی رخ می‌دهد که ffmpeg نتواند فایل را بخواند
-        raise TranscriptionError(f"خطا در رمزگشایی فایل صوتی '{file.filename}' (ذخیره شده در '{temp_path}'): {e_decode}. "
-                                 "ممکن است فایل خراب باشد یا فرمت آن توسط ffmpeg پشتیبانی نشود.")
-    except Exception as e_process:
-        raise TranscriptionError(f"خطا در پردازش فایل صوتی '{file.filename}': {type(e_process).__name__} - {e_process}")
+        if file.content_length and file.content_length > MAX_UPLOAD_BYTES:
+            raise TranscriptionError(f"حجم فایل '{file.filename}' نباید بیش از {MAX_UPLOAD_BYTES // 1024} کیلوبایت باشد.")
+
+        # یک بایت بیشتر از سقف می‌خوانیم تا حجم غیرمجاز تشخیص داده شود
+        data = file.stream.read(MAX_UPLOAD_BYTES + 1)
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise TranscriptionError(f"حجم فایل '{file.filename}' نباید بیش از {MAX_UPLOAD_BYTES // 1024} کیلوبایت باشد.")
+        if not data:
+            raise TranscriptionError(f"فایل '{file.filename}' خالی است.")
+        return data
     finally:
-        # فایل موقت اصلی را اگر ایجاد شده بود پاک کن
-        if temp_path and os.path.exists(temp_path):
-            try: 
-                os.unlink(temp_path)
-                print(f"Temp file {temp_path} deleted.")
-            except Exception as e_unlink_finally:
-                 print(f"Warning: Could not delete temp file {temp_path} in finally: {e_unlink_finally}")
-        
-        # استریم فایل ورودی را ببند (اگر هنوز باز است و قابل بستن)
-        if hasattr(file, 'close') and callable(file.close) and not file.closed:
-            try: 
-                file.close()
-                print(f"Input filestream '{file.filename}' closed.")
-            except Exception as e_close_finally:
-                print(f"Warning: Could not close input filestream '{file.filename}': {e_close_finally}")
-
-    # --- اعتبارسنجی نهایی و بازگشت ---
-    if audio is None:
-        # این نباید اتفاق بیفتد اگر کد بالا به درستی اجرا شود و خطاها را پرتاب کند
-        raise TranscriptionError("پردازش فایل صوتی با شکست مواجه شد و شیء صوتی ایجاد نشد.")
-
-    dur = audio.duration_seconds
-    if dur > MAX_DURATION_S:
-        raise TranscriptionError(f"طول فایل '{file.filename}' ({dur:.2f}s) نباید بیش از {MAX_DURATION_S} ثانیه باشد.")
-    
-    print(f"File '{file.filename}' validated. Duration: {dur:.2f}s")
-    return audio
+        try:
+            file.close()
+        except Exception as e_close:
+            log.warning("could not close upload stream", extra={"filename": file.filename, "error": str(e_close)})
 
 
-def transcribe(file: FileStorage) -> str:
-    """Main API: FileStorage → str transcript (fa)."""
-    temp_wav_for_openai = None # مسیری برای فایل موقت که به OpenAI ارسال می‌شود
+def _read_and_hash(file: FileStorage):
+    """(بایت‌های آپلود، sha256 آن‌ها) برای کلید کش متن."""
+    data = _read_upload(file)
+    return data, TranscriptCache.digest(data)
+
+
+def _capture_debug(data: bytes, filename: str) -> None:
+    """ذخیرهٔ نمونه‌ای از فایل‌های مشکل‌دار، با رعایت سقف حجم دایرکتوری."""
+    if not DEBUG_AUDIO_PATH or random.random() >= DEBUG_AUDIO_SAMPLE_RATE:
+        return
     try:
-        audio_segment = _validate_and_get_audio_segment(file)
-        
-        # AudioSegment را در یک فایل WAV موقت (فرمت استاندارد PCM) برای ارسال به OpenAI ذخیره کنید
-        fd, temp_wav_for_openai = tempfile.mkstemp(suffix=".wav")
-        os.close(fd)
-        
-        # export با فرمت wav، فایل را به یک WAV استاندارد تبدیل می‌کند
-        audio_segment.export(temp_wav_for_openai, format="wav")
-        print(f"AudioSegment exported to temp WAV file for OpenAI: {temp_wav_for_openai}")
-
-        if not os.path.isfile(temp_wav_for_openai) or os.path.getsize(temp_wav_for_openai) == 0:
-            raise TranscriptionError(f"فایل WAV موقت برای OpenAI در مسیر {temp_wav_for_openai} ایجاد نشد یا خالی است.")
-
-        print(f"Proceeding to OpenAI transcription with file: {temp_wav_for_openai}")
-        with open(temp_wav_for_openai, "rb") as f_audio:
-            resp = openai.Audio.transcribe(
-                file=f_audio,
+        os.makedirs(DEBUG_AUDIO_PATH, exist_ok=True)
+        safe_name = os.path.basename(filename or "upload") or "upload"
+        path = os.path.join(DEBUG_AUDIO_PATH, f"{int(time.time() * 1000)}-{safe_name}.bin")
+        with open(path, "wb") as f:
+            f.write(data)
+
+        # حذف قدیمی‌ترین فایل‌ها تا حجم کل زیر سقف برود
+        entries = sorted(
+            (e for e in os.scandir(DEBUG_AUDIO_PATH) if e.is_file()),
+            key=lambda e: e.stat().st_mtime,
+        )
+        total = sum(e.stat().st_size for e in entries)
+        for e in entries:
+            if total <= DEBUG_AUDIO_MAX_BYTES:
+                break
+            total -= e.stat().st_size
+            os.unlink(e.path)
+        log.info("captured problematic upload", extra={"path": path})
+    except Exception as e_copy:
+        log.warning("failed to capture upload for inspection", extra={"error": str(e_copy)})
+
+
+async def _export_for_stt(data: bytes, filename: str):
+    """آپلود → بایت‌های آمادهٔ STT؛ مراحل ffmpeg در استخر پردازه‌ای اجرا می‌شوند."""
+    try:
+        return await decode_pool.run(_prepare_payload, data, filename, timeout=DECODE_JOB_TIMEOUT_S)
+    except AudioDecodeError:
+        _capture_debug(data, filename)
+        raise
+    except asyncio.TimeoutError:
+        raise AudioDecodeError(f"پردازش فایل صوتی '{filename}' بیش از حد طول کشید.")
+
+
+async def _transcribe_prepared(digest: Optional[str], upload_bytes: int, filename: str, prepare) -> str:
+    """کش متن → یکی کردن آپلودهای یکسانِ هم‌زمان → prepare() در استخر → STT.
+
+    digest=None یعنی بدون کش و بدون یکی کردن.
+    """
+    cached = transcript_cache.get(digest) if transcript_cache and digest else None
+    if cached is not None:
+        audio_saved_seconds.inc(cached["seconds"], reason="cache")
+        audio_saved_bytes.inc(upload_bytes, reason="cache")
+        if cached.get("silent"):
+            raise SilentAudioError(_silent_message(filename), cached["seconds"])
+        return cached["text"]
+
+    key = f"stt:{digest}" if digest else None
+    flight = inflight.flights.follow(key)
+    if flight is not None:
+        try:
+            return "".join([part async for part in flight.follow()])
+        except inflight.LeaderGone:
+            pass  # leader رها شد؛ این درخواست خودش پردازش می‌کند
+
+    flight = inflight.flights.lead(key)
+    error = inflight.LeaderGone()
+    try:
+        payload, duration_s, sent_s = await prepare()
+        text = await _stt(payload)
+    except SilentAudioError as e:
+        audio_saved_seconds.inc(e.duration_s, reason="silent")
+        audio_saved_bytes.inc(upload_bytes, reason="silent")
+        if transcript_cache and digest:
+            transcript_cache.put(digest, {"silent": True, "seconds": round(e.duration_s, 3)})
+        error = e
+        raise
+    except TranscriptionError as e:
+        error = e
+        raise
+    else:
+        audio_stt_seconds.inc(sent_s)
+        audio_saved_seconds.inc(max(0.0, duration_s - sent_s), reason="trim")
+        audio_saved_bytes.inc(max(0, upload_bytes - len(payload)), reason="encode")
+        if transcript_cache and digest:
+            transcript_cache.put(digest, {"text": text, "seconds": round(sent_s, 3), "bytes": len(payload)})
+        flight.push(text)
+        error = None
+        return text
+    finally:
+        inflight.flights.land(key, flight, error)
+
+
+# ───────────────────────────── streaming ingest
+class StreamingDecoder:
+    """رمزگشایی هم‌زمان با دریافت: هر تکهٔ بدنهٔ درخواست بلافاصله به stdin ffmpeg می‌رود.
+
+    ffmpeg خودش پس از MAX_DURATION_S + 1 ثانیه متوقف می‌شود؛ در این صورت بقیهٔ
+    آپلود خوانده نمی‌شود و finish() خطای طول بیش از حد می‌دهد. پس از deadline
+    (time.monotonic) ffmpeg کشته می‌شود و feed/finish خطای StreamDeadlineError می‌دهند.
+    """
+
+    def __init__(self, filename: str = "stream", deadline: Optional[float] = None):
+        self.filename = filename
+        self.deadline = deadline if deadline is not None else time.monotonic() + STREAM_DEADLINE_S
+        self.received = 0
+        self._sha = hashlib.sha256()
+        self._pcm = []
+        self._stderr = b""
+        self._proc = subprocess.Popen(
+            [_ffmpeg(), "-v", "error", "-nostdin", "-i", "pipe:0",
+             "-t", str(MAX_DURATION_S + 1), "-vn",
+             "-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-f", "s16le", "pipe:1"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        # خروجی‌ها باید هم‌زمان خالی شوند وگرنه نوشتن در stdin قفل می‌شود
+        self._readers = [
+            threading.Thread(target=self._drain_stdout, daemon=True),
+            threading.Thread(target=self._drain_stderr, daemon=True),
+        ]
+        for t in self._readers:
+            t.start()
+        # حتی اگر نخ درخواست روی خواندن سوکت گیر کرده باشد، ffmpeg در deadline کشته می‌شود
+        self._watchdog = threading.Timer(max(0.0, self.remaining()), self.abort)
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def _check_deadline(self) -> None:
+        if self.remaining() <= 0:
+            self.abort()
+            raise StreamDeadlineError(_deadline_message(self.filename))
+
+    def _drain_stdout(self) -> None:
+        for chunk in iter(lambda: self._proc.stdout.read(65536), b""):
+            self._pcm.append(chunk)
+
+    def _drain_stderr(self) -> None:
+        self._stderr = self._proc.stderr.read()[-2000:]
+
+    @property
+    def stopped(self) -> bool:
+        """ffmpeg زودتر تمام کرده (سقف مدت یا خطای ورودی)؛ ادامهٔ ارسال بی‌فایده است."""
+        return self._proc.poll() is not None
+
+    def feed(self, chunk: bytes) -> bool:
+        """یک تکه را به ffmpeg می‌دهد؛ اگر ffmpeg دیگر ورودی نپذیرد False برمی‌گرداند."""
+        self._check_deadline()
+        self.received += len(chunk)
+        self._sha.update(chunk)
+        if self.received > MAX_UPLOAD_BYTES:
+            self.abort()
+            raise TranscriptionError(f"حجم فایل '{self.filename}' نباید بیش از {MAX_UPLOAD_BYTES // 1024} کیلوبایت باشد.")
+        try:
+            self._proc.stdin.write(chunk)
+            return True
+        except (BrokenPipeError, ValueError):
+            return False
+
+    def finish(self) -> "AudioSegment":
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        try:
+            self._proc.wait(timeout=max(0.0, min(FFMPEG_TIMEOUT_S, self.remaining())))
+        except subprocess.TimeoutExpired:
+            self.abort()
+            if self.remaining() <= 0:
+                raise StreamDeadlineError(_deadline_message(self.filename))
+            raise AudioDecodeError(f"رمزگشایی فایل صوتی '{self.filename}' بیش از حد طول کشید.")
+        finally:
+            self._watchdog.cancel()
+        for t in self._readers:
+            t.join(timeout=1)
+        # ffmpeg به دست watchdog کشته شده است
+        self._check_deadline()
+
+        pcm = b"".join(self._pcm)
+        if self._proc.returncode != 0 or not pcm:
+            detail = self._stderr.decode("utf-8", "replace").strip()[-300:]
+            raise AudioDecodeError(f"خطا در رمزگشایی فایل صوتی '{self.filename}': {detail}. "
+                                   "ممکن است فایل خراب باشد یا فرمت آن توسط ffmpeg پشتیبانی نشود.")
+
+        audio = _segment(pcm)
+        if audio.duration_seconds > MAX_DURATION_S:
+            raise TranscriptionError(f"طول فایل '{self.filename}' نباید بیش از {MAX_DURATION_S} ثانیه باشد.")
+        log.debug("streamed audio decoded while uploading",
+                  extra={"filename": self.filename, "duration_s": round(audio.duration_seconds, 2)})
+        return audio
+
+    @property
+    def digest(self) -> str:
+        """sha256 بایت‌های دریافت‌شده (کلید کش متن، مثل TranscriptCache.digest)."""
+        return self._sha.hexdigest()
+
+    def abort(self) -> None:
+        self._watchdog.cancel()
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+
+
+def decode_stream(chunks: Iterable[bytes], filename: str = "stream",
+                  deadline: Optional[float] = None) -> Tuple["AudioSegment", str, int]:
+    """تکه‌های بدنهٔ درخواست را هم‌زمان با رسیدن رمزگشایی می‌کند؛
+    (AudioSegment، sha256 بایت‌های دریافتی، تعداد بایت‌ها) برای transcribe_segment.
+
+    یک سهم از سقف استخر decode می‌گیرد (DecodePoolBusy اگر پر باشد)؛ deadline
+    (time.monotonic، پیش‌فرض اکنون + STREAM_DEADLINE_S) سقف آپلود + رمزگشایی است.
+    """
+    with decode_pool.reserve():
+        decoder = StreamingDecoder(filename, deadline)
+        try:
+            # زمان این مرحله شامل خود آپلود هم هست (دو کار هم‌پوشان‌اند)
+            with timing.span("upload_decode"):
+                for chunk in chunks:
+                    if chunk and not decoder.feed(chunk):
+                        break
+                return decoder.finish(), decoder.digest, decoder.received
+        except BaseException:
+            decoder.abort()
+            raise
+
+
+def _read_stream(chunks: Iterable[bytes], filename: str, deadline: float) -> Tuple[bytes, str]:
+    """(بایت‌های بدنه، sha256 آن‌ها) بدون رمزگشایی؛ با همان سقف حجم و deadline مسیر استریمی."""
+    sha = hashlib.sha256()
+    parts, received = [], 0
+    with timing.span("save"):
+        for chunk in chunks:
+            if time.monotonic() > deadline:
+                raise StreamDeadlineError(_deadline_message(filename))
+            received += len(chunk)
+            if received > MAX_UPLOAD_BYTES:
+                raise TranscriptionError(f"حجم فایل '{filename}' نباید بیش از {MAX_UPLOAD_BYTES // 1024} کیلوبایت باشد.")
+            sha.update(chunk)
+            parts.append(chunk)
+    if not received:
+        raise TranscriptionError(f"فایل '{filename}' خالی است.")
+    return b"".join(parts), sha.hexdigest()
+
+
+def transcribe_stream(chunks: Iterable[bytes], filename: str = "stream", deadline: Optional[float] = None,
+                      expected_digest: Optional[str] = None) -> str:
+    """بدنهٔ استریمی → متن.
+
+    expected_digest (sha256 اعلام‌شدهٔ کلاینت) اگر در کش متن باشد، بدنه فقط خوانده و hash
+    می‌شود و ffmpeg اجرا نمی‌شود؛ اگر hash واقعی فرق کند بایت‌ها مثل آپلود معمولی در استخر
+    رمزگشایی می‌شوند. در غیر این صورت رمزگشایی هم‌زمان با آپلود (decode_stream).
+    """
+    deadline = deadline if deadline is not None else time.monotonic() + STREAM_DEADLINE_S
+    expected = (expected_digest or "").strip().lower()
+    if expected and transcript_cache and transcript_cache.contains(expected):
+        data, digest = _read_stream(chunks, filename, deadline)
+        if digest != expected:
+            log.info("stream digest mismatch; decoding buffered upload", extra={"filename": filename})
+        return aio.run(_atranscribe_bytes(data, digest, filename))
+    audio, digest, received = decode_stream(chunks, filename, deadline)
+    return transcribe_segment(audio, digest, received, filename)
+
+
+# ───────────────────────────── STT
+async def _stt(payload: bytes) -> str:
+    import openai
+    from . import upstream
+
+    queued = time.perf_counter()
+    async with aio.limiter.slot():
+        timing.record("upstream_queue", time.perf_counter() - queued)
+        with timing.span("stt"):
+            resp = await upstream.stt.call(
+                openai.Audio.atranscribe_raw,
                 model=STT_MODEL,
+                file=payload,
+                filename=STT_UPLOAD_NAME,
                 response_format="text",
                 language="fa",
             )
 
-        if not resp:
-            raise TranscriptionError("مدل هیچ متنی برنگرداند.")
-        
-        return str(resp).strip()
+    if not resp:
+        raise TranscriptionError("مدل هیچ متنی برنگرداند.")
 
+    return str(resp).strip()
+
+
+def transcribe(file: FileStorage) -> str:
+    """Main API: FileStorage → str transcript (fa)."""
+    return aio.run(atranscribe(file))
+
+
+async def atranscribe(file: FileStorage) -> str:
+    """Async variant: decoding runs in the decode pool, the STT call on the shared loop."""
+    try:
+        with timing.span("save"):
+            data, digest = await asyncio.to_thread(_read_and_hash, file)
+        return await _transcribe_prepared(digest, len(data), file.filename,
+                                          lambda: _export_for_stt(data, file.filename))
+
+    except UpstreamBusy:
+        raise
     except Exception as e:
-        print(f"ERROR in transcribe function: {type(e).__name__}: {e}")
+        log.warning("transcription failed", extra={"error_class": type(e).__name__, "error": str(e)})
         if not isinstance(e, TranscriptionError):
             raise TranscriptionError(f"خطا در تبدیل گفتار: {type(e).__name__} - {e}") from e
         else:
             raise
 
-    finally:
-        if temp_wav_for_openai and os.path.exists(temp_wav_for_openai):
+
+async def _atranscribe_bytes(data: bytes, digest: str, filename: str) -> str:
+    """بایت‌های کامل بدنهٔ استریمی → متن (کش متن، سپس رمزگشایی در استخر و STT)."""
+    try:
+        return await _transcribe_prepared(digest, len(data), filename, lambda: _export_for_stt(data, filename))
+
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        log.warning("transcription failed", extra={"error_class": type(e).__name__, "error": str(e)})
+        if not isinstance(e, TranscriptionError):
+            raise TranscriptionError(f"خطا در تبدیل گفتار: {type(e).__name__} - {e}") from e
+        else:
+            raise
+
+
+def transcribe_segment(audio: "AudioSegment", digest: Optional[str] = None, upload_bytes: int = 0,
+                       filename: str = "stream") -> str:
+    """AudioSegment رمزگشایی‌شده (مثلاً از decode_stream) → متن؛ با digest از کش متن استفاده می‌شود."""
+    return aio.run(atranscribe_segment(audio, digest, upload_bytes, filename))
+
+
+async def atranscribe_segment(audio: "AudioSegment", digest: Optional[str] = None, upload_bytes: int = 0,
+                              filename: str = "stream") -> str:
+    try:
+        # تبدیل PCM فقط وقتی متن در کش نیست (درون prepare، پس از بررسی کش)
+        async def prepare():
+            pcm = audio.set_channels(1).set_frame_rate(STT_SAMPLE_RATE).set_sample_width(2).raw_data
             try:
-                os.unlink(temp_wav_for_openai)
-                print(f"Successfully deleted temp file for OpenAI: {temp_wav_for_openai} in transcribe's finally block.")
-            except Exception as unlink_error:
-                print(f"WARNING: Could not delete temp file for OpenAI {temp_wav_for_openai} in transcribe's finally block: {unlink_error}")
+                return await decode_pool.run(_prepare_pcm, pcm, filename, timeout=DECODE_JOB_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                raise AudioDecodeError("فشرده‌سازی فایل صوتی بیش از حد طول کشید.")
+
+        return await _transcribe_prepared(digest, upload_bytes or len(audio.raw_data), filename, prepare)
+
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        log.warning("segment transcription failed", extra={"error_class": type(e).__name__, "error": str(e)})
+        if not isinstance(e, TranscriptionError):
+            raise TranscriptionError(f"خطا در تبدیل گفتار: {type(e).__name__} - {e}") from e
+        else:
+            raise
+
+
+def _collect_transcript_cache():
+    if transcript_cache is None:
+        return
+    stats = transcript_cache.stats()
+    yield "qy_transcript_cache_lookups_total", {"result": "hit"}, stats["hits"]
+    yield "qy_transcript_cache_lookups_total", {"result": "miss"}, stats["misses"]
+
 
+registry.source("qy_transcript_cache_lookups_total", "counter",
+                "Transcript cache lookups (keyed by raw upload hash) by result.", _collect_transcript_cache)
@@ -0,0 +1,313 @@
+"""
+batches – اجرای دسته‌ای پرسش‌ها (FAQ، مجموعه‌های رگرسیون) با هم‌روندی محدود
+
+هر دسته یک فایل journal در BATCH_DIR دارد: خط اول سرآیند (پرسش‌ها، tenant، هم‌روندی)
+و سپس برای هر پرسش به محض پایانش یک خط نتیجه (result یا error، با زمان‌بندی مراحل)
+و در پایان یک خط done (اگر اجرا با خطا متوقف شود، خط done با status و error).
+پاسخ HTTP همین خطوط را به صورت NDJSON دنبال (tail) می‌کند؛
+پس قطع اتصال کلاینت اجرای دسته را متوقف نمی‌کند و اتصال دوباره با همان batch id
+(و after=تعداد خطوط دریافت‌شده) از همان‌جا ادامه می‌دهد، حتی اگر به worker دیگری برسد.
+
+اجراکنندهٔ هر دسته روی فایل journal قفل (flock) می‌گیرد؛ اگر پردازهٔ اجراکننده بمیرد
+قفل آزاد می‌شود و اولین خواننده پرسش‌های باقی‌مانده را خودش اجرا می‌کند.
+هر پرسش مثل یک درخواست جدا از سهمیهٔ درخواست tenant کم می‌کند (Tenant.admit) و از
+مسیر عادی Core.achat_with_gpt می‌گذرد (کش پاسخ، یکی کردن پرسش‌های یکسان، سهمیهٔ توکن
+tenant و صف منصفانه)؛ در صف پر یا سهمیهٔ تمام‌شده پس از Retry-After دوباره تلاش می‌شود.
+
+تنظیمات (متغیر محیطی):
+    BATCH_DIR                  دایرکتوری journalها، مشترک بین workerها (پیش‌فرض <tmp>/qy-batches)
+    BATCH_MAX_ITEMS            حداکثر پرسش در هر دسته (پیش‌فرض 1000)
+    BATCH_CONCURRENCY          هم‌روندی پیش‌فرض هر دسته (پیش‌فرض 4)
+    BATCH_MAX_CONCURRENCY      سقف هم‌روندی درخواستی کلاینت (پیش‌فرض 16)
+    BATCH_MAX_RETRIES          تلاش دوباره در صف پر / سهمیهٔ تمام‌شده (پیش‌فرض 5)
+    BATCH_TTL_S                نگهداری journal پس از آخرین تغییر (پیش‌فرض 86400)
+    BATCH_POLL_S               فاصلهٔ بررسی خطوط تازهٔ journal هنگام استریم (پیش‌فرض 0.2)
+"""
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from typing import AsyncIterator, List, Optional
+
+from . import aio, bot, timing
+from .aio import RateLimited, UpstreamBusy
+from .core import FALLBACK_MESSAGES
+from .metrics import batch_items, registry
+
+log = logging.getLogger(__name__)
+
+BATCH_DIR = os.getenv("BATCH_DIR", os.path.join(tempfile.gettempdir(), "qy-batches"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 16))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", 5))
+BATCH_TTL_S = int(os.getenv("BATCH_TTL_S", 86400))
+BATCH_POLL_S = float(os.getenv("BATCH_POLL_S", 0.2))
+
+_BATCH_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+_running = 0  # دسته‌های در حال اجرا در این پردازه
+
+
+class BatchError(ValueError):
+    """Invalid batch request; str(exc) is the Persian message for a 400."""
+
+
+def valid_batch_id(value: Optional[str]) -> Optional[str]:
+    value = (value or "").strip()
+    return value if _BATCH_ID_RE.match(value) else None
+
+
+def new_batch_id() -> str:
+    return uuid.uuid4().hex
+
+
+def parse_items(raw: list) -> List[dict]:
+    """["پرسش", {"id": ..., "question": ...}, ...] → [{"index", "id", "question"}]."""
+    if not isinstance(raw, list) or not raw:
+        raise BatchError("فهرست پرسش‌ها خالی است")
+    if len(raw) > BATCH_MAX_ITEMS:
+        raise BatchError(f"حداکثر {BATCH_MAX_ITEMS} پرسش در هر دسته مجاز است")
+    items = []
+    for index, entry in enumerate(raw):
+        if isinstance(entry, dict):
+            question, item_id = entry.get("question"), entry.get("id", index)
+        else:
+            question, item_id = entry, index
+        items.append({"index": index, "id": item_id, "question": question.strip() if isinstance(question, str) else ""})
+    return items
+
+
+def parse_jsonl(data: bytes) -> List[dict]:
+    """فایل JSONL: هر خط یک رشته (پرسش) یا شیء {"id", "question"}."""
+    raw = []
+    for number, line in enumerate(data.decode("utf-8-sig").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            raw.append(json.loads(line))
+        except ValueError:
+            raise BatchError(f"خط {number} فایل JSON معتبر نیست")
+    return parse_items(raw)
+
+
+def clamp_concurrency(value) -> int:
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = BATCH_CONCURRENCY
+    return max(1, min(value, BATCH_MAX_CONCURRENCY))
+
+
+# ───────────────────────────── journal
+def _path(batch_id: str) -> str:
+    return os.path.join(BATCH_DIR, f"{batch_id}.jsonl")
+
+
+def _dumps(entry: dict) -> str:
+    return json.dumps(entry, ensure_ascii=False) + "\n"
+
+
+def _parse(raw) -> Optional[dict]:
+    # خط ناقصِ اجراکننده‌ای که وسط نوشتن از بین رفته نادیده گرفته می‌شود
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def _read(batch_id: str):
+    """(سرآیند، خطوط نتیجه) یا (None, []) اگر دسته وجود نداشته باشد."""
+    try:
+        with open(_path(batch_id), encoding="utf-8") as fh:
+            lines = [_parse(line) for line in fh if line.endswith("\n")]
+    except OSError:
+        return None, []
+    lines = [line for line in lines if line is not None]
+    return (lines[0], lines[1:]) if lines else (None, [])
+
+
+def header(batch_id: str) -> Optional[dict]:
+    return _read(batch_id)[0]
+
+
+def _sweep() -> None:
+    """journalهای قدیمی‌تر از BATCH_TTL_S حذف می‌شوند."""
+    cutoff = time.time() - BATCH_TTL_S
+    for path in glob.glob(os.path.join(BATCH_DIR, "*.jsonl")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def create(batch_id: str, items: List[dict], tenant: str, concurrency: int) -> dict:
+    """journal دستهٔ تازه؛ اگر همین id قبلاً ساخته شده باشد سرآیند موجود برمی‌گردد."""
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    _sweep()
+    entry = {"type": "batch", "batch_id": batch_id, "tenant": tenant, "concurrency": concurrency,
+             "total": len(items), "created": time.time(), "items": items}
+    try:
+        with open(_path(batch_id), "x", encoding="utf-8") as fh:
+            fh.write(_dumps(entry))
+    except FileExistsError:
+        return header(batch_id)
+    return entry
+
+
+# ───────────────────────────── runner
+def _try_lock(batch_id: str):
+    """قفل اجرای دسته؛ فایل باز (قفل‌شده) یا None اگر پردازهٔ دیگری در حال اجرای آن است."""
+    fh = open(_path(batch_id), "a", encoding="utf-8")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return None
+    return fh
+
+
+def _ends_with_newline(batch_id: str) -> bool:
+    with open(_path(batch_id), "rb") as fh:
+        fh.seek(-1, os.SEEK_END)
+        return fh.read(1) == b"\n"
+
+
+def ensure_running(batch_id: str, tenant) -> None:
+    """اگر دسته تمام نشده و کسی در حال اجرای آن نیست، اجرای پرسش‌های باقی‌مانده شروع می‌شود."""
+    journal = _try_lock(batch_id)
+    if journal is None:
+        return
+    head, lines = _read(batch_id)
+    if head is None or (lines and lines[-1].get("type") == "done"):
+        journal.close()
+        return
+    if journal.tell() and not _ends_with_newline(batch_id):
+        journal.write("\n")
+    asyncio.run_coroutine_threadsafe(_run(journal, head, lines, tenant), aio.get_loop())
+
+
+async def _run(journal, head: dict, lines: List[dict], tenant) -> None:
+    global _running
+    _running += 1
+    aio.current_tenant.set(tenant)
+    started = time.perf_counter()
+    done = {line["index"] for line in lines if "index" in line}
+    counts = {"result": 0, "error": 0}
+    for line in lines:
+        counts[line["type"]] = counts.get(line["type"], 0) + 1
+    pending = [item for item in head["items"] if item["index"] not in done]
+    if done:
+        log.info("resuming batch", extra={"batch_id": head["batch_id"], "done": len(done), "pending": len(pending)})
+
+    semaphore = asyncio.Semaphore(head["concurrency"])
+    writing = asyncio.Lock()  # TextIOWrapper امن برای نخ نیست؛ هر بار یک نوشتن
+
+    async def append(entry: dict) -> None:
+        # نوشتن و flush روی دیسک (ممکن است کند باشد) روی loop مشترک اجرا نمی‌شود
+        async with writing:
+            await asyncio.to_thread(_append, journal, entry)
+
+    async def one(item: dict) -> None:
+        async with semaphore:
+            line = await _answer(item)
+        counts[line["type"]] += 1
+        batch_items.inc(outcome=line["type"])
+        await append(line)
+
+    done_line = {"type": "done", "batch_id": head["batch_id"], "total": head["total"]}
+    try:
+        outcomes = await asyncio.gather(*(one(item) for item in pending), return_exceptions=True)
+        failures = [e for e in outcomes if isinstance(e, Exception)]
+        if failures:
+            # بدون خط done هر خواننده (follow) دسته را هر BATCH_POLL_S از نو اجرا می‌کرد
+            log.error("batch runner failed", exc_info=failures[0],
+                      extra={"batch_id": head["batch_id"], "failures": len(failures)})
+            done_line.update(status=500, error=f"خطای داخلی: {failures[0]}")
+        done_line.update(succeeded=counts["result"], failed=counts["error"],
+                         elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+        await append(done_line)
+    except Exception:
+        log.exception("batch journal not finalized", extra={"batch_id": head["batch_id"]})
+    finally:
+        journal.close()  # قفل آزاد می‌شود؛ خواننده‌ها باقی‌مانده را ادامه می‌دهند
+        _running -= 1
+
+
+def _append(journal, entry: dict) -> None:
+    journal.write(_dumps(entry))
+    journal.flush()
+
+
+async def _answer(item: dict) -> dict:
+    """یک پرسش دسته؛ خطاها به صورت خط error با کد وضعیت معادل HTTP برمی‌گردند."""
+    timing.start_request()
+    started = time.perf_counter()
+    line = {"type": "error", "index": item["index"], "id": item["id"]}
+    if not item["question"]:
+        line.update(status=400, error="سؤال خالی است")
+
+    for attempt in range(BATCH_MAX_RETRIES + 1 if item["question"] else 0):
+        try:
+            tenant = aio.current_tenant.get()
+            if tenant is not None:
+                tenant.admit()  # یک دستهٔ هزار پرسشی هزار درخواست است، نه یکی
+            answer = await bot.achat_with_gpt(item["question"])
+        except (UpstreamBusy, RateLimited) as e:
+            if attempt == BATCH_MAX_RETRIES:
+                line.update(status=429 if isinstance(e, RateLimited) else 503, error=str(e))
+                break
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception as e:
+            log.exception("batch item failed", extra={"index": item["index"]})
+            line.update(status=500, error=f"خطای داخلی: {e}")
+            break
+        if answer in FALLBACK_MESSAGES:
+            line.update(status=502, error=answer)
+        else:
+            line.update(type="result", question=item["question"], answer=answer)
+        break
+
+    line["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    line["timings"] = {name: round(s * 1000, 1) for name, s in timing.current().items()}
+    return line
+
+
+# ───────────────────────────── reader
+async def follow(batch_id: str, tenant, after: int = 0) -> AsyncIterator[dict]:
+    """خطوط نتیجهٔ دسته از خط after به بعد تا خط done؛ اگر اجراکننده از بین برود، ادامه می‌دهد."""
+    # خواندن journal (و قفل/خواندن کامل در ensure_running) روی نخ جدا، نه روی loop مشترک
+    fh = await asyncio.to_thread(open, _path(batch_id), "rb")
+    with fh:
+        await asyncio.to_thread(fh.readline)  # سرآیند
+        seen = 0
+        buffered = b""
+        while True:
+            chunk = await asyncio.to_thread(fh.read)
+            if chunk:
+                buffered += chunk
+                *complete, buffered = buffered.split(b"\n")
+                for raw in complete:
+                    line = _parse(raw)
+                    if line is None:
+                        continue
+                    seen += 1
+                    if seen > after:
+                        yield line
+                    if line.get("type") == "done":
+                        return
+                continue
+            await asyncio.to_thread(ensure_running, batch_id, tenant)
+            await asyncio.sleep(BATCH_POLL_S)
+
+
+registry.source("qy_batches_running", "gauge", "Batches being executed by this process.",
+                lambda: [("qy_batches_running", {}, _running)])
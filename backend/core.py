@@ -2,9 +2,36 @@
 Core – هستهٔ چت‌بات (منطق گفت‌وگو برای دستیار حقوقی قانون‌یار)
 این نسخه فاقد قابلیت استعلام قیمت از API است.
 """
+import asyncio
 import os
 import json
-import openai # اطمینان حاصل کنید که کتابخانه openai نصب شده است: pip install openai
+import logging
+import time
+from typing import AsyncIterator, Iterator
+
+# openai (و aiohttp) سنگین‌اند؛ backend.upstream در اولین فراخوانی مدل import می‌شود
+from . import aio, inflight, routing, statutes, timing
+from .answer_cache import AnswerCache
+from .metrics import route_latency, upstream_tokens
+from .normalize import normalize_text
+from .tokens import MESSAGE_OVERHEAD, count_message_tokens, estimate_tokens
+
+log = logging.getLogger(__name__)
+
+CHAT_MODEL = "gpt-4o"  # مدل کامل؛ پرسش‌های ساده با routing به مدل سریع می‌روند
+CHAT_TEMPERATURE = 0.3  # میزان خلاقیت پاسخ (0.0 تا 2.0)
+# تخمین توکن پاسخ برای سهمیهٔ توکن tenant (پرامپت پاسخ را زیر ۲۵۰ کاراکتر می‌خواهد)
+COMPLETION_TOKENS_ESTIMATE = 300
+
+# پیام‌های جایگزین فارسی (هم برای حالت عادی و هم حالت استریم)
+FALLBACK_UPSTREAM = "متاسفانه در حال حاضر امکان پاسخگویی وجود ندارد. لطفاً بعداً تلاش کنید."
+FALLBACK_INTERNAL = "یک خطای داخلی رخ داده است. لطفاً با پشتیبانی تماس بگیرید."
+FALLBACK_MESSAGES = (FALLBACK_UPSTREAM, FALLBACK_INTERNAL)
+
+
+class ChatStreamError(RuntimeError):
+    """Raised when a streamed answer fails; str(exc) is the Persian fallback."""
+
 
 # ───────────────────────────── Chatbot core
 class Core:
@@ -12,48 +39,272 @@ class Core:
 
     def __init__(self):
         # کلید API باید به عنوان متغیر محیطی تنظیم شده باشد
-        # یا به صورت مستقیم مقداردهی شود (امنیت کمتر)
-        # مثال: openai.api_key = "sk-YOUR_API_KEY"
-        openai.api_key = os.getenv("OPENAI_API_KEY")          # REQUIRED!
-        if not openai.api_key:
-            print("هشدار: متغیر محیطی OPENAI_API_KEY تنظیم نشده است.")
+        # (هنگام import شدن backend.upstream روی openai.api_key قرار می‌گیرد)
+        if not os.getenv("OPENAI_API_KEY"):          # REQUIRED!
+            log.warning("OPENAI_API_KEY is not set")
             # می‌توانید در اینجا یک مقدار پیش‌فرض یا راهی برای دریافت کلید از کاربر قرار دهید
             # raise ValueError("کلید API OpenAI یافت نشد. لطفاً متغیر محیطی OPENAI_API_KEY را تنظیم کنید.")
 
+        # کش پاسخ پرسش‌های تکراری (فقط برای فراخوانی‌های بدون تاریخچه)
+        self.cache = AnswerCache.from_env()
+        # انتخاب مدل (سریع / کامل) یا پاسخ آماده برای هر پرسش
+        self.router = routing.Router.from_env(full_model=CHAT_MODEL)
+
+    # ---------------------------------------------------------------------
+    def _cache_fingerprint(self) -> str:
+        # بازسازی نمایهٔ قوانین، متن مواد تزریق‌شده را عوض می‌کند
+        models = f"{CHAT_MODEL}:{self.router.fast_model or '-'}"
+        return AnswerCache.fingerprint(self._system_prompt(), f"{models}:{statutes.index_version()}")
+
+    def _cache_get(self, question: str, chat_history: list = None):
+        if self.cache is None or chat_history:
+            return None
+        try:
+            return self.cache.get(question, self._cache_fingerprint())
+        except Exception as e:  # خرابی کش نباید پاسخگویی را متوقف کند
+            log.warning("answer cache read failed", extra={"error": str(e)})
+            return None
+
+    def _cache_put(self, question: str, answer: str, chat_history: list = None) -> None:
+        if self.cache is None or chat_history:
+            return
+        try:
+            self.cache.put(question, self._cache_fingerprint(), answer)
+        except Exception as e:
+            log.warning("answer cache write failed", extra={"error": str(e)})
+
+    def _dedup_key(self, question: str, chat_history: list = None):
+        """کلید یکی کردن پرسش‌های هم‌زمان؛ مثل کش فقط برای پرسش بدون تاریخچه."""
+        if chat_history:
+            return None
+        normalized = normalize_text(question)
+        return f"{self._cache_fingerprint()}:{normalized}" if normalized else None
+
+    @staticmethod
+    def _charge_tokens(messages: list) -> None:
+        """توکن تخمینی این فراخوانی از سهم tenant جاری کسر می‌شود (در صورت کمبود RateLimited)."""
+        tenant = aio.current_tenant.get()
+        if tenant is not None:
+            tenant.charge_tokens(count_message_tokens(messages) + COMPLETION_TOKENS_ESTIMATE)
+
+    async def _call_model(self, route: routing.Route, messages: list, **kwargs):
+        """(route، پاسخ) از مدل سطح انتخاب‌شده؛ اگر مدل سریع خطا بدهد همان پیام‌ها با مدل کامل."""
+        import openai
+        from . import upstream
+
+        try:
+            return route, await upstream.chat.call(openai.ChatCompletion.acreate, model=route.model,
+                                                   messages=messages, temperature=CHAT_TEMPERATURE, **kwargs)
+        except openai.error.OpenAIError as e:
+            if route.tier != routing.FAST:
+                raise
+            log.warning("fast model failed; retrying on full model",
+                        extra={"model": route.model, "error_class": type(e).__name__, "error": str(e)})
+            route = self.router.fallback(route, "error")
+            return route, await upstream.chat.call(openai.ChatCompletion.acreate, model=route.model,
+                                                   messages=messages, temperature=CHAT_TEMPERATURE, **kwargs)
+
+    # ---------------------------------------------------------------------
+    def _build_messages(self, question: str, chat_history: list = None) -> list:
+        """ساخت لیست پیام‌ها: پرامپت سیستمی + مواد قانونی مرتبط + تاریخچه (اختیاری) + پرسش کاربر."""
+        messages = [{"role": "system", "content": self._system_prompt()}]
+
+        articles = statutes.relevant_articles(question)
+        if articles:
+            messages.append({
+                "role": "system",
+                "content": "متن مواد قانونی مرتبط از پایگاه قوانین (برای استناد دقیق):\n\n" + articles,
+            })
+
+        if chat_history:
+            messages.extend(chat_history)
+
+        messages.append({"role": "user", "content": question})
+        return messages
+
+    def count_prompt_tokens(self, question: str, chat_history: list = None) -> int:
+        """سقف تخمینی توکن پرامپتی که برای این پرسش ارسال می‌شود.
+
+        بازیابی BM25 اجرا نمی‌شود: مواد قانونی با سقف STATUTE_CONTEXT_TOKENS حساب می‌شوند،
+        پس این شمارش روی نخ درخواست (پیش از مسیریابی و کش) ارزان است و بودجهٔ تاریخچه
+        را هیچ‌وقت کمتر از واقع تخمین نمی‌زند.
+        """
+        messages = [{"role": "system", "content": self._system_prompt()}]
+        if chat_history:
+            messages.extend(chat_history)
+        messages.append({"role": "user", "content": question})
+        total = count_message_tokens(messages)
+        if statutes.STATUTE_TOP_K > 0 and statutes.get_index() is not None:
+            total += MESSAGE_OVERHEAD + statutes.STATUTE_CONTEXT_TOKENS
+        return total
 
     # ---------------------------------------------------------------------
     def chat_with_gpt(self, question: str, chat_history: list = None) -> str:
         """
         ارسال پرسش به مدل GPT و دریافت پاسخ.
         تاریخچه چت (اختیاری) برای حفظ زمینه مکالمه استفاده می‌شود.
+        (پوستهٔ sync روی achat_with_gpt؛ در صف پر UpstreamBusy و با اتمام سهمیهٔ tenant RateLimited)
         """
-        system_prompt = self._system_prompt()
+        return aio.run(self.achat_with_gpt(question, chat_history))
 
-        messages = [{"role": "system", "content": system_prompt}]
+    async def achat_with_gpt(self, question: str, chat_history: list = None) -> str:
+        """نسخهٔ async؛ فراخوانی upstream روی loop مشترک و در صف منصفانهٔ سراسری اجرا می‌شود."""
+        started = time.perf_counter()
+        # درخواست متن عین یک ماده، بدون LLM از نمایهٔ محلی پاسخ داده می‌شود
+        article = statutes.lookup_article(question)
+        if article is not None:
+            return article
 
-        if chat_history:
-            messages.extend(chat_history)
+        route = self.router.route(question, chat_history)
+        if route.tier == routing.CANNED:
+            route_latency.observe(time.perf_counter() - started, tier=route.tier)
+            return route.answer
 
-        messages.append({"role": "user", "content": question})
+        cached = self._cache_get(question, chat_history)
+        if cached is not None:
+            return cached
 
+        # همین پرسش هم‌اکنون در حال پاسخ گرفتن است: همان پاسخ دنبال می‌شود
+        key = self._dedup_key(question, chat_history)
+        flight = inflight.flights.follow(key)
+        if flight is not None:
+            try:
+                return "".join([part async for part in flight.follow()])
+            except ChatStreamError as e:
+                return str(e)
+            except inflight.LeaderGone:
+                pass  # leader رها شد؛ این درخواست خودش فراخوانی می‌کند
+
+        import openai
+
+        # leader پیش از اولین await ثبت می‌شود تا پرسش‌های یکسانِ هم‌زمان دنبالش کنند
+        flight = inflight.flights.lead(key)
+        error = inflight.LeaderGone()
         try:
-            # دیگر نیازی به تعریف functions یا function_call نیست
-            resp = openai.ChatCompletion.create(
-                model="gpt-4o",  # یا مدل دیگری که ترجیح می‌دهید
-                messages=messages,
-                temperature=0.3, # میزان خلاقیت پاسخ (0.0 تا 2.0)
-                # max_tokens=1000 # حداکثر تعداد توکن‌های پاسخ (اختیاری)
-            )
-            
-            response_content = resp.choices[0].message["content"]
+            # بازیابی BM25 (پایتون خالص) روی loop مشترک بقیهٔ استریم‌ها را متوقف می‌کند
+            with timing.span("prompt"):
+                messages = await asyncio.to_thread(self._build_messages, question, chat_history)
+            self._charge_tokens(messages)
+
+            queued = time.perf_counter()
+            async with aio.limiter.slot():
+                timing.record("upstream_queue", time.perf_counter() - queued)
+                try:
+                    # دیگر نیازی به تعریف functions یا function_call نیست
+                    # (max_tokens=1000 حداکثر تعداد توکن‌های پاسخ، اختیاری)
+                    with timing.span("llm"):
+                        route, resp = await self._call_model(route, messages)
+
+                    response_content = resp.choices[0].message["content"]
+                    usage = resp.get("usage") or {}
+                    upstream_tokens.inc(usage.get("prompt_tokens", 0), model=route.model, type="prompt")
+                    upstream_tokens.inc(usage.get("completion_tokens", 0), model=route.model, type="completion")
+                    route_latency.observe(time.perf_counter() - started, tier=route.tier)
+
+                except openai.error.OpenAIError as e:
+                    log.error("chat completion failed", extra={"error_class": type(e).__name__, "error": str(e)})
+                    error = ChatStreamError(FALLBACK_UPSTREAM)
+                    return FALLBACK_UPSTREAM
+                except Exception as e:
+                    log.exception("unexpected error in chat completion")
+                    error = ChatStreamError(FALLBACK_INTERNAL)
+                    return FALLBACK_INTERNAL
+
+            self._cache_put(question, response_content, chat_history)
+            flight.push(response_content)
+            error = None
             return response_content
+        finally:
+            inflight.flights.land(key, flight, error)
 
-        except openai.error.OpenAIError as e:
-            print(f"خطا در ارتباط با OpenAI API: {e}")
-            return "متاسفانه در حال حاضر امکان پاسخگویی وجود ندارد. لطفاً بعداً تلاش کنید."
-        except Exception as e:
-            print(f"یک خطای پیش‌بینی نشده رخ داد: {e}")
-            return "یک خطای داخلی رخ داده است. لطفاً با پشتیبانی تماس بگیرید."
+    # ---------------------------------------------------------------------
+    def stream_chat_with_gpt(self, question: str, chat_history: list = None) -> Iterator[str]:
+        """
+        نسخهٔ استریمی chat_with_gpt: تکه‌های پاسخ (delta) را به محض تولید برمی‌گرداند.
+        اگر استریم در میانه قطع شود ChatStreamError با همان پیام جایگزین فارسی پرتاب می‌شود.
+        """
+        return aio.iterate(self.astream_chat_with_gpt(question, chat_history))
+
+    async def astream_chat_with_gpt(self, question: str, chat_history: list = None) -> AsyncIterator[str]:
+        """نسخهٔ async استریم؛ slot صف upstream تا پایان استریم نگه داشته می‌شود."""
+        begun = time.perf_counter()
+        article = statutes.lookup_article(question)
+        if article is not None:
+            yield article
+            return
+
+        route = self.router.route(question, chat_history)
+        if route.tier == routing.CANNED:
+            route_latency.observe(time.perf_counter() - begun, tier=route.tier)
+            yield route.answer
+            return
+
+        cached = self._cache_get(question, chat_history)
+        if cached is not None:
+            yield cached
+            return
+
+        key = self._dedup_key(question, chat_history)
+        flight = inflight.flights.follow(key)
+        if flight is not None:
+            received = False
+            try:
+                async for part in flight.follow():
+                    received = True
+                    yield part
+                return
+            except inflight.LeaderGone as e:
+                if received:  # نیمی از پاسخ رسیده؛ شروع دوباره پاسخ را تکراری می‌کند
+                    raise ChatStreamError(FALLBACK_UPSTREAM) from e
+
+        parts = []
+
+        import openai
+
+        flight = inflight.flights.lead(key)
+        error = inflight.LeaderGone()
+        try:
+            with timing.span("prompt"):
+                messages = await asyncio.to_thread(self._build_messages, question, chat_history)
+            self._charge_tokens(messages)
+
+            queued = time.perf_counter()
+            async with aio.limiter.slot():
+                started = time.perf_counter()
+                timing.record("upstream_queue", started - queued)
+                try:
+                    route, stream = await self._call_model(route, messages, stream=True)
+                    timing.record("llm_ttfb", time.perf_counter() - started)
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.get("content")
+                        if delta:
+                            parts.append(delta)
+                            flight.push(delta)
+                            yield delta
+
+                except openai.error.OpenAIError as e:
+                    log.error("chat stream failed", extra={"error_class": type(e).__name__, "error": str(e)})
+                    error = ChatStreamError(FALLBACK_UPSTREAM)
+                    raise error from e
+                except Exception as e:
+                    log.exception("unexpected error in chat stream")
+                    error = ChatStreamError(FALLBACK_INTERNAL)
+                    raise error from e
+                finally:
+                    timing.record("llm", time.perf_counter() - started)
+                    # استریم usage برنمی‌گرداند؛ تخمین محلی (حتی برای استریم نیمه‌کاره هزینه پرداخت شده)
+                    if parts:
+                        upstream_tokens.inc(count_message_tokens(messages), model=route.model, type="prompt")
+                        upstream_tokens.inc(estimate_tokens("".join(parts)), model=route.model, type="completion")
+
+            route_latency.observe(time.perf_counter() - begun, tier=route.tier)
+            # فقط پاسخ کاملِ بدون خطا کش می‌شود
+            self._cache_put(question, "".join(parts), chat_history)
+            error = None
+        finally:
+            inflight.flights.land(key, flight, error)
 
     # ---------------------------------------------------------------------
     @staticmethod
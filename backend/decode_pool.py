@@ -0,0 +1,191 @@
+"""
+decode_pool – استخر پردازه‌ای محدود برای کارهای سنگین ffmpeg/pydub
+
+رمزگشایی و فشرده‌سازی صدا روی نخ درخواست (و GIL پردازهٔ وب) اجرا نمی‌شود؛
+هر کار به یک پردازهٔ جدا فرستاده می‌شود تا رگبار پیام‌های صوتی، چت متنی را کند نکند.
+اگر تعداد کارهای در انتظار از سقف بگذرد DecodePoolBusy پرتاب می‌شود (→ 503 سریع).
+کاری که از timeout بگذرد رها نمی‌شود: اگر هنوز در صف است لغو می‌شود و اگر در حال
+اجراست پردازه‌های استخر (هر کدام با ffmpegهای فرزندش، از طریق process group) کشته و
+استخر از نو ساخته می‌شود؛ کارهای سالمی که همراه آن
+قطع شده‌اند یک بار دیگر روی استخر تازه اجرا می‌شوند. هر کار تا پایان واقعی‌اش
+(نه تا timeout) در سقف کارهای در انتظار شمرده می‌شود. رمزگشایی استریمی (ffmpeg روی
+نخ درخواست، هم‌زمان با آپلود) هم با reserve() از همین سقف سهم می‌گیرد.
+پردازه‌های استخر با spawn ساخته می‌شوند و نقطهٔ ورودشان backend.audio_codec است.
+
+تنظیمات (متغیر محیطی):
+    AUDIO_DECODE_WORKERS      تعداد پردازه‌ها (پیش‌فرض: تعداد هسته‌ها)
+    AUDIO_DECODE_MAX_PENDING  حداکثر کار در صف + در حال اجرا (پیش‌فرض 4 × workers)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+from . import timing
+from .aio import UpstreamBusy
+from .audio_codec import _noop, _timed_call, init_worker
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DECODE_WORKERS = int(os.getenv("AUDIO_DECODE_WORKERS", os.cpu_count() or 1))
+DECODE_MAX_PENDING = int(os.getenv("AUDIO_DECODE_MAX_PENDING", DECODE_WORKERS * 4))
+
+
+class DecodePoolBusy(UpstreamBusy):
+    """Raised when too many decode jobs are pending; same 503 contract as UpstreamBusy."""
+
+
+class DecodePool:
+    """Bounded process pool with queue-depth admission and wait/decode timing stats."""
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        # استخرهایی که عمداً (به خاطر کار گیرکرده) کشته شده‌اند
+        self._recycled: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+        self.stats = {
+            "jobs": 0, "rejected": 0, "timeouts": 0, "errors": 0, "recycles": 0,
+            "queue_wait_s_sum": 0.0, "queue_wait_s_max": 0.0,
+            "decode_s_sum": 0.0, "decode_s_max": 0.0,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # spawn: پردازه‌های worker از نخ‌های پردازهٔ وب (loop، سوکت‌ها) ارث نمی‌برند
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_worker,
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _recycle(self, executor: ProcessPoolExecutor) -> None:
+        """کار در حال اجرا از timeout گذشته: پردازه‌های این استخر کشته می‌شوند و استخر بعدی تازه است."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            if executor in self._recycled:
+                return
+            self._recycled.add(executor)
+            self.stats["recycles"] += 1
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            try:
+                # worker رهبر گروه خودش است (init_worker)؛ ffmpeg در حال اجرا یتیم نمی‌ماند
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                process.kill()  # initializer هنوز اجرا نشده یا پردازه رفته است
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise DecodePoolBusy()
+            self._pending += 1
+
+    def _release(self, _job: Future = None) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _record(self, key: str, value: float) -> None:
+        self.stats[f"{key}_sum"] += value
+        self.stats[f"{key}_max"] = max(self.stats[f"{key}_max"], value)
+
+    async def run(self, fn: Callable, *args, timeout: float):
+        """اجرای fn(*args) در استخر؛ timeout شامل زمان انتظار در صف هم می‌شود."""
+        self._admit()
+
+        submitted = time.time()
+        deadline = time.monotonic() + timeout
+        try:
+            executor = self._get_executor()
+            job = executor.submit(_timed_call, fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # سهم این کار از max_pending تا پایان واقعی آن (نه تا timeout) نگه داشته می‌شود
+        job.add_done_callback(self._release)
+
+        try:
+            result, started, finished, spans = await asyncio.wait_for(asyncio.wrap_future(job), timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            # wait_for کار در صف را لغو کرده است؛ کار در حال اجرا فقط با کشتن worker متوقف می‌شود
+            if not job.done():
+                logger.warning("decode job timed out while running; recycling pool", extra={"timeout_s": timeout})
+                self._recycle(executor)
+            raise
+        except BrokenProcessPool:
+            if executor in self._recycled and time.monotonic() < deadline:
+                # قربانی کشتن کار گیرکردهٔ دیگری بود؛ یک بار دیگر روی استخر تازه
+                return await self.run(fn, *args, timeout=deadline - time.monotonic())
+            # یک worker کشته شده (مثلاً OOM)؛ استخر برای درخواست‌های بعدی از نو ساخته می‌شود
+            self.stats["errors"] += 1
+            self._reset_executor()
+            raise
+
+        queue_wait, decode = max(0.0, started - submitted), finished - started
+        self.stats["jobs"] += 1
+        self._record("queue_wait_s", queue_wait)
+        self._record("decode_s", decode)
+        timing.record("decode_queue", queue_wait)
+        for name, seconds in spans.items():
+            timing.record(name, seconds)
+        return result
+
+    @contextmanager
+    def reserve(self):
+        """یک سهم از max_pending برای رمزگشایی بیرون از استخر؛ اگر سقف پر باشد DecodePoolBusy."""
+        self._admit()
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def warm(self) -> None:
+        """پردازه‌های worker را از پیش بالا می‌آورد تا اولین فایل صوتی هزینهٔ spawn را نپردازد."""
+        await asyncio.gather(*(self.run(_noop, timeout=60) for _ in range(min(self.workers, self.max_pending))))
+
+    def shutdown(self) -> None:
+        """بستن استخر (هنگام drain پردازهٔ وب)؛ کارهای در صف لغو می‌شوند."""
+        self._reset_executor()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending": self._pending, "workers": self.workers}
+
+
+pool = DecodePool(DECODE_WORKERS, DECODE_MAX_PENDING)
+
+
+def _collect():
+    snap = pool.snapshot()
+    for key in ("jobs", "rejected", "timeouts", "errors"):
+        yield "qy_decode_pool_jobs_total", {"outcome": key}, snap[key]
+
+
+registry.source("qy_decode_pool_jobs_total", "counter", "Decode pool jobs by outcome.", _collect)
+registry.source("qy_decode_pool_recycles_total", "counter", "Pools killed and rebuilt after a job overran its timeout.",
+                lambda: [("qy_decode_pool_recycles_total", {}, pool.snapshot()["recycles"])])
+registry.source("qy_decode_pool_pending", "gauge", "Decode jobs queued or running.",
+                lambda: [("qy_decode_pool_pending", {}, pool.snapshot()["pending"])])
@@ -0,0 +1,94 @@
+"""
+inflight – یکی کردن پرسش‌های یکسانِ هم‌زمان (بدون تاریخچه) روی یک فراخوانی upstream
+
+اولین درخواست (leader) فراخوانی را انجام می‌دهد و هر تکهٔ پاسخ را در Flight می‌گذارد؛
+درخواست‌های یکسانی که در همین فاصله می‌رسند (follower) بدون گرفتن slot صف و بدون
+مصرف توکن همان تکه‌ها را دنبال می‌کنند. پس از پایان، پاسخ از کش پاسخ خوانده می‌شود.
+
+همهٔ متدها فقط روی loop پل aio اجرا می‌شوند، پس قفل لازم نیست.
+"""
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
+
+from .metrics import registry
+
+
+class LeaderGone(RuntimeError):
+    """The leading request was abandoned (client left) before the answer was complete."""
+
+
+class Flight:
+    """Parts of one in-progress answer, replayable by any number of followers."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._wake = asyncio.Event()
+
+    def push(self, part: str) -> None:
+        self.parts.append(part)
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done, self.error = True, error
+        self._wake.set()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """همهٔ تکه‌ها از ابتدا و سپس تکه‌های تازه تا پایان؛ خطای leader دوباره پرتاب می‌شود."""
+        index = 0
+        while True:
+            wake = self._wake
+            while index < len(self.parts):
+                yield self.parts[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await wake.wait()
+
+
+class Flights:
+    """Key → in-progress Flight, with leader/follower counts for /metrics."""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def follow(self, key: Optional[str]) -> Optional[Flight]:
+        flight = self._flights.get(key) if key else None
+        if flight is not None:
+            self.followers += 1
+        return flight
+
+    def lead(self, key: Optional[str]) -> Flight:
+        flight = Flight()
+        if key:
+            self._flights[key] = flight
+            self.leaders += 1
+        return flight
+
+    def land(self, key: Optional[str], flight: Flight, error: Optional[BaseException] = None) -> None:
+        flight.finish(error)
+        if key and self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+
+flights = Flights()
+
+
+def _collect():
+    yield "qy_inflight_dedup_total", {"role": "leader"}, flights.leaders
+    yield "qy_inflight_dedup_total", {"role": "follower"}, flights.followers
+
+
+registry.source("qy_inflight_dedup_total", "counter",
+                "Deduplicated questions: leaders made the upstream call, followers shared it.", _collect)
+registry.source("qy_inflight_flights", "gauge", "Answers currently being shared between identical questions.",
+                lambda: [("qy_inflight_flights", {}, len(flights))])
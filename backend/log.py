@@ -0,0 +1,66 @@
+"""
+log – پیکربندی logging سطح‌بندی‌شده؛ در حالت پیش‌فرض هر رکورد یک خط JSON است
+
+ماژول‌ها فقط logging.getLogger(__name__) می‌گیرند و فیلدهای ساخت‌یافته را با
+extra={...} می‌فرستند؛ configure() یک‌بار هنگام راه‌اندازی اپ صدا زده می‌شود.
+
+تنظیمات (متغیر محیطی):
+    LOG_LEVEL    DEBUG | INFO | WARNING | ERROR (پیش‌فرض INFO)
+    LOG_FORMAT   json | text (پیش‌فرض json)
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+# کتابخانه‌هایی که در سطح INFO برای هر فراخوانی یک خط می‌نویسند
+_NOISY_LOGGERS = ("openai", "urllib3")
+
+# فیلدهای استاندارد LogRecord؛ هر چیز دیگری از extra آمده است
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg + any extra={...} fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _RESERVED)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local runs; extra fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = " ".join(f"{k}={v}" for k, v in vars(record).items() if k not in _RESERVED)
+        return f"{line} {extra}" if extra else line
+
+
+def configure(level: str = None, fmt: str = None) -> None:
+    """هندلر stderr روی root logger؛ صدا زدن دوباره فقط تنظیمات را جایگزین می‌کند."""
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name in _NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.WARNING))
@@ -0,0 +1,288 @@
+"""
+metrics – شمارنده‌ها و هیستوگرام‌های درون‌پردازه‌ای با خروجی متنی Prometheus
+
+بدون وابستگی بیرونی؛ endpoint /metrics خروجی render() را برمی‌گرداند.
+علاوه بر متریک‌های ثبت‌شده، «منبع»هایی (callback) هم ثبت می‌شوند که هنگام render
+آمار موجود ماژول‌ها (استخر decode، صف upstream، کش پاسخ و ...) را می‌خوانند؛
+به این ترتیب مسیر داغ درخواست هزینهٔ اضافه‌ای برای آن‌ها نمی‌پردازد.
+
+چند پردازه (serve.py): اگر METRICS_DIR تنظیم شده باشد هر worker وضعیت خود را هر
+چند ثانیه در <METRICS_DIR>/<pid>.json می‌نویسد و /metrics مجموع همهٔ workerها را
+برمی‌گرداند (gaugeها جمع نمی‌شوند و برچسب pid می‌گیرند). با مرگ یک worker شمارنده‌هایش در archive.json جمع می‌شوند (تا شمارنده‌ها
+کاهش نیابند) و gaugeهایش کنار گذاشته می‌شوند.
+
+تنظیمات (متغیر محیطی):
+    METRICS_DIR        دایرکتوری مشترک workerها (پیش‌فرض خالی = تک‌پردازه)
+    METRICS_FLUSH_S    فاصلهٔ نوشتن وضعیت هر worker (پیش‌فرض 5)
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# مرزهای پیش‌فرض (ثانیه): از چند میلی‌ثانیه (prompt/serialize) تا ده‌ها ثانیه (LLM)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS_FLUSH_S = float(os.getenv("METRICS_FLUSH_S", 5))
+ARCHIVE_NAME = "archive.json"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + pairs + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with free-form labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def collect(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) with free-form labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, list] = {}  # [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self) -> Dict[LabelKey, list]:
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+
+# ───────────────────────────── multi-process state files
+def _dump(state: dict) -> dict:
+    """LabelKey (tuple) در JSON کلید نمی‌شود؛ به لیست [labels, value] تبدیل می‌شود."""
+    return {name: [[list(map(list, key)), value] for key, value in values.items()] for name, values in state.items()}
+
+
+def _load(raw: dict) -> dict:
+    return {name: {tuple(map(tuple, key)): value for key, value in values} for name, values in raw.items()}
+
+
+def _merge_into(total: dict, state: dict) -> None:
+    for name, values in state.items():
+        merged = total.setdefault(name, {})
+        for key, value in values.items():
+            if key not in merged:
+                merged[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            else:
+                merged[key] += value
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as fh:
+            return {section: _load(values) for section, values in json.load(fh).items()}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write(path: str, state: dict) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({section: _dump(values) for section, values in state.items()}, fh)
+    os.replace(tmp, path)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+        self._sources: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+        self._flusher_pid = None
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def source(self, name: str, kind: str, help_text: str, collect: Callable[[], Iterable[Sample]]) -> None:
+        """متریکی که مقدارش هنگام render از collect() خوانده می‌شود: [(name, labels, value), ...]."""
+        self._sources.append((name, kind, help_text, collect))
+
+    # ---------------------------------------------------------------- state
+    def snapshot(self) -> dict:
+        """وضعیت فعلی این پردازه: {"metrics": {name: {key: value}}, "counters"/"gauges": نمونه‌های منابع}."""
+        state = {"metrics": {m.name: m.collect() for m in self._metrics}, "counters": {}, "gauges": {}}
+        for name, kind, _, collect in self._sources:
+            try:
+                samples = list(collect())
+            except Exception:  # یک منبع خراب نباید کل /metrics را از کار بیندازد
+                continue
+            section = state["counters" if kind == "counter" else "gauges"]
+            for sample_name, labels, value in samples:
+                values = section.setdefault(sample_name, {})
+                values[_key(labels)] = values.get(_key(labels), 0) + value
+        return state
+
+    def flush(self, directory: str) -> None:
+        _write(os.path.join(directory, f"{os.getpid()}.json"), self.snapshot())
+
+    def start_flusher(self, directory: str, interval_s: float = METRICS_FLUSH_S) -> None:
+        """نخ پس‌زمینه‌ای که وضعیت این worker را دوره‌ای می‌نویسد (یک‌بار به ازای هر پردازه)."""
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+
+        def loop():
+            while True:
+                try:
+                    self.flush(directory)
+                except OSError:
+                    pass
+                time.sleep(interval_s)
+
+        threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+    @staticmethod
+    def mark_process_dead(directory: str, pid: int) -> None:
+        """(در پردازهٔ master) شمارنده‌های worker مرده به archive منتقل و فایلش حذف می‌شود."""
+        path = os.path.join(directory, f"{pid}.json")
+        dead = _read(path)
+        if not dead:
+            return
+        archive_path = os.path.join(directory, ARCHIVE_NAME)
+        archive = _read(archive_path)
+        for section in ("metrics", "counters"):
+            _merge_into(archive.setdefault(section, {}), dead.get(section, {}))
+        _write(archive_path, archive)
+        os.unlink(path)
+
+    def _merged(self, directory: str) -> dict:
+        """جمع همهٔ workerها؛ gaugeها جمع نمی‌شوند و برچسب pid می‌گیرند."""
+        own = f"{os.getpid()}.json"
+        states = [(str(os.getpid()), self.snapshot())]
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            if os.path.basename(path) != own:
+                states.append((os.path.basename(path)[:-len(".json")], _read(path)))
+
+        total = {"metrics": {}, "counters": {}, "gauges": {}}
+        for pid, state in states:
+            for section in ("metrics", "counters"):
+                _merge_into(total[section], state.get(section, {}))
+            for name, values in state.get("gauges", {}).items():
+                series = total["gauges"].setdefault(name, {})
+                for key, value in values.items():
+                    series[tuple(sorted(key + (("pid", pid),)))] = value
+        return total
+
+    # ---------------------------------------------------------------- text
+    def render(self) -> str:
+        directory = os.getenv("METRICS_DIR")
+        state = self._merged(directory) if directory else self.snapshot()
+
+        out = []
+        for metric in self._metrics:
+            values = state["metrics"].get(metric.name)
+            if not values:
+                continue
+            out += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+            if metric.kind == "counter":
+                out += [f"{metric.name}{_format_labels(k)} {_format_value(v)}" for k, v in values.items()]
+            else:
+                out += self._histogram_lines(metric, values)
+        for name, kind, help_text, _ in self._sources:
+            values = state["counters" if kind == "counter" else "gauges"].get(name, {})
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            out += [f"{name}{_format_labels(k)} {_format_value(v)}" for k, v in values.items()]
+        return "\n".join(out) + "\n"
+
+    @staticmethod
+    def _histogram_lines(metric: Histogram, values: Dict[LabelKey, list]) -> List[str]:
+        out = []
+        for key, series in values.items():
+            cumulative = 0
+            for bound, count in zip(metric.buckets, series):
+                cumulative += count
+                out.append(f"{metric.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {cumulative}")
+            out.append(f"{metric.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            out.append(f"{metric.name}_sum{_format_labels(key)} {_format_value(series[-2])}")
+            out.append(f"{metric.name}_count{_format_labels(key)} {series[-1]}")
+        return out
+
+
+registry = Registry()
+
+http_requests = registry.counter("qy_http_requests_total", "HTTP requests by endpoint, method and status.")
+http_duration = registry.histogram(
+    "qy_http_request_duration_seconds", "Time until the response (or its headers, for SSE) is ready.")
+stage_duration = registry.histogram(
+    "qy_stage_duration_seconds", "Per-stage latency: save, duration_check, decode, export, stt, prompt, llm, ...")
+upstream_errors = registry.counter("qy_upstream_errors_total", "Failed upstream attempts by client and error class.")
+upstream_tokens = registry.counter(
+    "qy_upstream_tokens_total", "Upstream token usage by model and type (streams are estimated).")
+tenant_requests = registry.counter("qy_tenant_requests_total", "Requests admitted per tenant (X-Domain).")
+tenant_rejections = registry.counter(
+    "qy_tenant_rejections_total", "Requests rejected with 429 by tenant and reason (requests, tokens, queue).")
+batch_items = registry.counter("qy_batch_items_total", "Batch questions completed, by line type (result, error).")
+audio_stt_seconds = registry.counter("qy_audio_stt_seconds_total", "Audio seconds sent to STT after preprocessing.")
+audio_saved_seconds = registry.counter(
+    "qy_audio_saved_seconds_total", "Audio seconds not sent to STT, by reason (trim, silent, cache).")
+audio_saved_bytes = registry.counter(
+    "qy_audio_saved_bytes_total", "Upload bytes not sent to STT, by reason (encode, silent, cache).")
+route_decisions = registry.counter("qy_route_decisions_total", "Model routing decisions by tier and intent.")
+route_fallbacks = registry.counter("qy_route_fallbacks_total", "Fast-tier calls retried on the full model, by reason.")
+route_latency = registry.histogram(
+    "qy_route_latency_seconds", "Time to a complete answer by routing tier (canned, fast, full); cache hits excluded.")
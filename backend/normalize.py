@@ -0,0 +1,44 @@
+"""
+normalize – یکسان‌سازی متن فارسی برای کلید کش و جست‌وجو
+(ی/ک عربی و فارسی، نیم‌فاصله، ارقام، علائم نگارشی، اعراب)
+"""
+import re
+import unicodedata
+
+# ی/ک عربی → فارسی و چند حرف هم‌ارز دیگر
+_CHAR_MAP = {
+    "ي": "ی",  # ي
+    "ى": "ی",  # ى
+    "ك": "ک",  # ك
+    "ة": "ه",  # ة
+    "ۀ": "ه",  # ۀ
+    "أ": "ا",  # أ
+    "إ": "ا",  # إ
+    "آ": "ا",  # آ
+    "ؤ": "و",  # ؤ
+    "ئ": "ی",  # ئ
+}
+# ارقام فارسی (۰-۹) و عربی (٠-٩) → لاتین
+_CHAR_MAP.update({chr(0x06F0 + i): str(i) for i in range(10)})
+_CHAR_MAP.update({chr(0x0660 + i): str(i) for i in range(10)})
+# نیم‌فاصله و کاراکترهای نامرئی مشابه → فاصله
+_CHAR_MAP.update({"\u200c": " ", "\u200d": "", "\u200e": "", "\u200f": "", "\ufeff": ""})
+
+_TRANSLATION = str.maketrans(_CHAR_MAP)
+
+# اعراب (فتحه، کسره، تنوین، تشدید، ...) و کشیده (ـ)
+_DIACRITICS_RE = re.compile("[ً-ٰٟـ]")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """متن را به فرم یکسان تبدیل می‌کند؛ دو پرسش هم‌معنا با املای متفاوت یک خروجی دارند."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = text.translate(_TRANSLATION)
+    text = _DIACRITICS_RE.sub("", text)
+    # علائم نگارشی و نمادها (؟ ، ! . « » ...) → فاصله
+    text = "".join(
+        " " if unicodedata.category(ch)[0] in ("P", "S") else ch
+        for ch in text
+    )
+    return _SPACES_RE.sub(" ", text).strip().lower()
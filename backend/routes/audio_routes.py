@@ -1,27 +1,137 @@
 """
-audio_routes – endpoint صوتی /chatbot/audio
+audio_routes – endpoint صوتی /chatbot/audio و نسخهٔ استریمی /chatbot/audio/stream
 """
-from flask import Blueprint, request, jsonify
-from backend import bot
-from backend.audio_handler import transcribe, TranscriptionError
+import time
+
+from flask import Blueprint, g, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from backend import bot, tenants, timing
+from backend.aio import RateLimited, UpstreamBusy, current_tenant
+from backend.audio_handler import (STREAM_DEADLINE_S, StreamDeadlineError, TranscriptionError, transcribe,
+                                   transcribe_stream)
+from backend.routes.conversation import session_id_from_request, prepare, remember, stream_answer_events
+from backend.routes.errors import busy_response, rate_limited_response
+from backend.routes.sse import sse_event, sse_response
+
+STREAM_CHUNK_BYTES = 16 * 1024
 
 bp_audio = Blueprint("audio_routes", __name__)
 
 
+def _admit() -> None:
+    """سهمیهٔ درخواست tenant؛ این endpointها X-Domain را الزامی نمی‌کنند و دامنهٔ ناشناس
+    با سقف‌های anonymous پذیرفته می‌شود."""
+    tenant = tenants.registry.resolve(request.headers.get("X-Domain")) or tenants.registry.anonymous
+    tenant.admit()
+    g.tenant_token = current_tenant.set(tenant)
+
+
 @bp_audio.post("/chatbot/audio")
 def chat_audio():
+    try:
+        _admit()
+    except RateLimited as limited:
+        return rate_limited_response(limited)
     if "audio" not in request.files:
         return jsonify({"error": "فایل audio ارسال نشده است"}), 400
 
     try:
         transcript = transcribe(request.files["audio"])
+    except UpstreamBusy as busy:
+        return busy_response(busy)
+    except RateLimited as limited:
+        return rate_limited_response(limited)
     except TranscriptionError as te:
         return jsonify({"error": str(te)}), 400
     except Exception as exc:
         return jsonify({"error": f"خطا در تبدیل گفتار: {exc}"}), 500
 
+    session_id = session_id_from_request(request.form)
+
     try:
-        answer = bot.chat_with_gpt(transcript)
-        return jsonify({"transcript": transcript, "answer": answer}), 200
+        history, prompt_tokens = prepare(transcript, session_id)
+        answer = bot.chat_with_gpt(transcript, history)
+        remember(session_id, transcript, answer)
+        body = {"transcript": transcript, "answer": answer, "prompt_tokens": prompt_tokens}
+        if session_id:
+            body["session_id"] = session_id
+        with timing.span("serialize"):
+            response = jsonify(body)
+        return response, 200
+    except UpstreamBusy as busy:
+        return busy_response(busy)
+    except RateLimited as limited:
+        return rate_limited_response(limited)
     except Exception as exc:
         return jsonify({"error": f"خطای داخلی: {exc}"}), 500
+
+
+@bp_audio.post("/chatbot/audio/stream")
+def chat_audio_stream():
+    """
+    بدنهٔ خام صوت (ترجیحاً با Transfer-Encoding: chunked) دریافت می‌شود و رمزگشایی
+    هم‌زمان با رسیدن بایت‌ها انجام می‌شود. پاسخ SSE است:
+        transcript → delta ... → done   (یا error)
+    تلاش دوباره با هدر X-Audio-SHA256 (sha256 فایل، hex): اگر متن همان فایل در کش باشد
+    بدنه بدون رمزگشایی خوانده می‌شود.
+    """
+    try:
+        _admit()
+    except RateLimited as limited:
+        return rate_limited_response(limited)
+    filename = request.headers.get("X-Filename", "stream")
+    session_id = session_id_from_request()
+    deadline = time.monotonic() + STREAM_DEADLINE_S
+    try:
+        transcript = transcribe_stream(_iter_body(deadline, filename), filename, deadline,
+                                       request.headers.get("X-Audio-SHA256"))
+    except UpstreamBusy as busy:
+        return busy_response(busy)
+    except RateLimited as limited:
+        return rate_limited_response(limited)
+    except StreamDeadlineError as te:
+        return jsonify({"error": str(te)}), 408
+    except TranscriptionError as te:
+        return jsonify({"error": str(te)}), 400
+    except RequestEntityTooLarge:
+        raise  # بدنه از MAX_CONTENT_LENGTH گذشت → 413 (app)
+    except Exception as exc:
+        return jsonify({"error": f"خطا در تبدیل گفتار: {exc}"}), 500
+
+    # هدرها و رویداد transcript بلافاصله پس از STT ارسال می‌شوند، نه پس از اولین توکن
+    return sse_response(_stream_voice_answer(transcript, session_id))
+
+
+def _iter_body(deadline: float, filename: str):
+    """بدنهٔ درخواست را تکه‌تکه و به محض رسیدن از سوکت می‌خواند.
+
+    زیر gunicorn هر خواندن از سوکت فقط تا deadline منتظر می‌ماند؛ کلاینتی که
+    بایت‌ها را قطره‌قطره یا اصلاً نمی‌فرستد نخ درخواست را نگه نمی‌دارد.
+    """
+    stream = request.stream
+    sock = request.environ.get("gunicorn.socket")
+    try:
+        while True:
+            if sock is not None:
+                sock.settimeout(max(0.01, deadline - time.monotonic()))
+            try:
+                chunk = stream.read(STREAM_CHUNK_BYTES)
+            except TimeoutError:
+                raise StreamDeadlineError(f"دریافت فایل صوتی '{filename}' بیش از {STREAM_DEADLINE_S:g} ثانیه طول کشید.")
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        if sock is not None:
+            sock.settimeout(None)
+
+
+def _stream_voice_answer(transcript: str, session_id):
+    yield sse_event("transcript", {"transcript": transcript})
+    try:
+        history, prompt_tokens = prepare(transcript, session_id)
+    except Exception as exc:
+        yield sse_event("error", {"error": f"خطای داخلی: {exc}"})
+        return
+    deltas = bot.stream_chat_with_gpt(transcript, history)
+    yield from stream_answer_events(deltas, transcript, session_id, prompt_tokens)
@@ -0,0 +1,110 @@
+"""
+batch_routes – endpoint دسته‌ای /chatbot/batch با خروجی NDJSON
+
+    POST /chatbot/batch                       {"questions": [...], "concurrency": 8, "batch_id": "..."}
+                                              یا multipart با فایل JSONL در فیلد file
+    GET  /chatbot/batch/<batch_id>?after=N    اتصال دوباره: خطوط پس از N خط دریافت‌شده
+
+خط اول پاسخ {"type": "batch", ...} است و در شمارش after حساب نمی‌شود؛ سپس برای هر
+پرسش یک خط result یا error (به ترتیب پایان، با index و id پرسش) و در آخر خط done
+(اگر اجرای دسته با خطا متوقف شده باشد، همراه status و error).
+ارسال دوبارهٔ POST با همان batch_id هم همان دسته را ادامه می‌دهد (پرسش‌های جدید نادیده گرفته می‌شوند).
+"""
+import json
+
+from flask import Blueprint, Response, g, jsonify, request, stream_with_context
+
+from backend import aio, batches, tenants
+from backend.aio import RateLimited, current_tenant
+from backend.routes.errors import rate_limited_response
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+bp_batch = Blueprint("batch_routes", __name__)
+
+
+def _tenant():
+    """(tenant, پاسخ خطا)؛ مثل /chatbot/responses دامنهٔ ناشناس 403 و سهمیهٔ تمام‌شده 429."""
+    tenant = tenants.registry.resolve(request.headers.get("X-Domain", ""))
+    if tenant is None:
+        return None, (jsonify({"error": "دامنه مجاز نیست"}), 403)
+    try:
+        tenant.admit()
+    except RateLimited as limited:
+        return None, rate_limited_response(limited)
+    g.tenant_token = current_tenant.set(tenant)
+    return tenant, None
+
+
+def _after() -> int:
+    try:
+        return max(0, int(request.args.get("after", 0)))
+    except ValueError:
+        return 0
+
+
+@bp_batch.post("/chatbot/batch")
+def create_batch():
+    tenant, error = _tenant()
+    if error:
+        return error
+
+    if request.files.get("file"):
+        form = request.form
+        try:
+            items = batches.parse_jsonl(request.files["file"].read())
+        except (batches.BatchError, UnicodeDecodeError) as exc:
+            return jsonify({"error": str(exc)}), 400
+    else:
+        form = request.get_json(silent=True) or {}
+        items = None
+
+    requested_id = form.get("batch_id") or request.headers.get("X-Batch-Id")
+    batch_id = batches.valid_batch_id(requested_id)
+    if requested_id and batch_id is None:
+        return jsonify({"error": "batch_id نامعتبر است"}), 400
+
+    head = batches.header(batch_id) if batch_id else None
+    if head is None:
+        if items is None:
+            try:
+                items = batches.parse_items(form.get("questions"))
+            except batches.BatchError as exc:
+                return jsonify({"error": str(exc)}), 400
+        head = batches.create(batch_id or batches.new_batch_id(), items, tenant.name,
+                              batches.clamp_concurrency(form.get("concurrency")))
+    return _stream(head, tenant)
+
+
+@bp_batch.get("/chatbot/batch/<batch_id>")
+def resume_batch(batch_id: str):
+    tenant, error = _tenant()
+    if error:
+        return error
+    head = batches.header(batch_id) if batches.valid_batch_id(batch_id) else None
+    if head is None:
+        return jsonify({"error": "دسته‌ای با این شناسه یافت نشد"}), 404
+    return _stream(head, tenant)
+
+
+def _stream(head: dict, tenant) -> Response:
+    # دستهٔ tenant دیگر برای این دامنه وجود ندارد
+    if head["tenant"] != tenant.name:
+        return jsonify({"error": "دسته‌ای با این شناسه یافت نشد"}), 404
+    batch_id, after = head["batch_id"], _after()
+    batches.ensure_running(batch_id, tenant)
+
+    def lines():
+        yield _line({"type": "batch", "batch_id": batch_id, "total": head["total"], "after": after})
+        for line in aio.iterate(batches.follow(batch_id, tenant, after)):
+            yield _line(line)
+
+    resp = Response(stream_with_context(lines()), mimetype=NDJSON_MIMETYPE)
+    resp.headers["X-Batch-Id"] = batch_id
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # غیرفعال کردن بافر nginx
+    return resp
+
+
+def _line(entry: dict) -> str:
+    return json.dumps(entry, ensure_ascii=False) + "\n"
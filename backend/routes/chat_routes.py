@@ -1,35 +1,66 @@
 """
 chat_routes – endpoint متنی /chatbot/responses
 """
-from flask import Blueprint, request, jsonify
-from backend import bot
+from flask import Blueprint, g, request, jsonify
+from backend import bot, tenants, timing
+from backend.aio import RateLimited, UpstreamBusy, current_tenant
+from backend.core import ChatStreamError
+from backend.routes.conversation import session_id_from_request, prepare, remember, stream_answer_events
+from backend.routes.errors import busy_response, rate_limited_response
+from backend.routes.sse import wants_stream, sse_event, sse_response, prime
 
 bp_chat = Blueprint("chat_routes", __name__)
 
-AUTHORIZED_DOMAINS = {
-    'https://mobit.ir',
-    'mobit.ir',
-    'www.mobit.ir',
-    'http://localhost',
-    'http://localhost:5000',
-    'localhost',
-    'file://',
-
-}
-
 
 @bp_chat.post("/chatbot/responses")
 def chat():
-    origin = request.headers.get("X-Domain", "")
-    if origin not in AUTHORIZED_DOMAINS:
+    # فهرست دامنه‌های مجاز و سقف هر کدام در config/tenants.json (backend.tenants)
+    tenant = tenants.registry.resolve(request.headers.get("X-Domain", ""))
+    if tenant is None:
         return jsonify({"error": "دامنه مجاز نیست"}), 403
+    try:
+        tenant.admit()
+    except RateLimited as limited:
+        return rate_limited_response(limited)
+    # token در teardown_request (app.py) برگردانده می‌شود
+    g.tenant_token = current_tenant.set(tenant)
 
-    question = (request.get_json(silent=True) or {}).get("question", "").strip()
+    payload = request.get_json(silent=True) or {}
+    question = payload.get("question", "").strip()
     if not question:
         return jsonify({"error": "سؤال خالی است"}), 400
 
+    # تاریخچهٔ جلسه (اختیاری، با X-Session-Id یا session_id) در بودجهٔ توکن
+    session_id = session_id_from_request(payload)
+    try:
+        history, prompt_tokens = prepare(question, session_id)
+    except Exception as exc:
+        return jsonify({"error": f"خطای داخلی: {exc}"}), 500
+
+    # حالت استریم (SSE): با ?stream=1 یا Accept: text/event-stream
+    if wants_stream():
+        try:
+            deltas = prime(bot.stream_chat_with_gpt(question, history))
+        except UpstreamBusy as busy:
+            return busy_response(busy)
+        except RateLimited as limited:
+            return rate_limited_response(limited)
+        except ChatStreamError as exc:
+            return sse_response(iter([sse_event("error", {"error": str(exc)})]))
+        return sse_response(stream_answer_events(deltas, question, session_id, prompt_tokens))
+
     try:
-        answer = bot.chat_with_gpt(question)
-        return jsonify({"answer": answer}), 200
+        answer = bot.chat_with_gpt(question, history)
+        remember(session_id, question, answer)
+        body = {"answer": answer, "prompt_tokens": prompt_tokens}
+        if session_id:
+            body["session_id"] = session_id
+        with timing.span("serialize"):
+            response = jsonify(body)
+        return response, 200
+    except UpstreamBusy as busy:
+        return busy_response(busy)
+    except RateLimited as limited:
+        return rate_limited_response(limited)
     except Exception as exc:
         return jsonify({"error": f"خطای داخلی: {exc}"}), 500
@@ -0,0 +1,70 @@
+"""
+conversation – منطق مشترک روت‌های چت و صوت: جلسه، بودجهٔ توکن و رویدادهای استریم پاسخ
+"""
+from typing import Iterator, Optional, Tuple
+
+from flask import request
+
+from backend import bot, session_store, timing
+from backend.aio import RateLimited, UpstreamBusy, current_tenant
+from backend.core import ChatStreamError, FALLBACK_MESSAGES
+from backend.routes.sse import sse_event
+from backend.sessions import valid_session_id
+
+
+def session_id_from_request(payload=None) -> Optional[str]:
+    """session id از هدر X-Session-Id یا فیلد session_id در payload (JSON یا فرم)."""
+    candidate = request.headers.get("X-Session-Id")
+    if not candidate and payload:
+        candidate = payload.get("session_id")
+    return valid_session_id(candidate)
+
+
+def _store_key(session_id: Optional[str]) -> Optional[str]:
+    """کلید جلسه در session_store؛ شناسهٔ کلاینت زیر نام tenant درخواست قرار می‌گیرد
+    تا یک دامنه با تکرار همان شناسه تاریخچهٔ دامنهٔ دیگر را نخواند یا ادامه ندهد."""
+    if not session_id:
+        return None
+    tenant = current_tenant.get()
+    return f"{tenant.name if tenant is not None else '-'}/{session_id}"
+
+
+def prepare(question: str, session_id: Optional[str]) -> Tuple[list, int]:
+    """تاریخچهٔ بریده‌شده در بودجهٔ توکن و سقف تخمینی توکن پرامپت (بدون بازیابی مواد قانونی)."""
+    with timing.span("prompt"):
+        return session_store.history_for(_store_key(session_id), bot.count_prompt_tokens(question))
+
+
+def remember(session_id: Optional[str], question: str, answer: str) -> None:
+    # پیام‌های جایگزین خطا جزو گفت‌وگو نیستند
+    if answer not in FALLBACK_MESSAGES:
+        session_store.append(_store_key(session_id), question, answer)
+
+
+def stream_answer_events(deltas: Iterator[str], question: str,
+                         session_id: Optional[str], prompt_tokens: int):
+    """رویدادهای delta → done؛ در صورت قطع استریم یک رویداد error با پیام فارسی."""
+    parts = []
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            yield sse_event("delta", {"delta": delta})
+    except (UpstreamBusy, RateLimited) as busy:
+        yield sse_event("error", {"error": str(busy), "retry_after": busy.retry_after})
+        return
+    except ChatStreamError as exc:
+        yield sse_event("error", {"error": str(exc)})
+        return
+    except Exception as exc:
+        yield sse_event("error", {"error": f"خطای داخلی: {exc}"})
+        return
+    finally:
+        close = getattr(deltas, "close", None)
+        if close:
+            close()
+
+    remember(session_id, question, "".join(parts))
+    done = {"prompt_tokens": prompt_tokens}
+    if session_id:
+        done["session_id"] = session_id
+    yield sse_event("done", done)
@@ -0,0 +1,31 @@
+"""
+errors – پاسخ‌های خطای مشترک بین روت‌ها
+"""
+from flask import current_app, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from backend.aio import RateLimited, UpstreamBusy
+
+
+def busy_response(exc: UpstreamBusy):
+    """503 سریع با Retry-After وقتی صف فراخوانی‌های upstream پر است."""
+    resp = jsonify({"error": str(exc)})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = str(exc.retry_after)
+    return resp
+
+
+def rate_limited_response(exc: RateLimited):
+    """429 سریع با Retry-After وقتی سهمیهٔ درخواست یا توکنِ دامنه تمام شده است."""
+    resp = jsonify({"error": str(exc)})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(exc.retry_after)
+    return resp
+
+
+def too_large_response(_exc: RequestEntityTooLarge):
+    """413 با همان قالب JSON؛ بدنهٔ بزرگ‌تر از MAX_CONTENT_LENGTH پیش از بافر شدن رد می‌شود."""
+    limit = current_app.config.get("MAX_CONTENT_LENGTH") or 0
+    resp = jsonify({"error": f"حجم درخواست نباید بیش از {limit // 1024} کیلوبایت باشد."})
+    resp.status_code = 413
+    return resp
@@ -0,0 +1,25 @@
+"""
+metrics_routes – endpointهای عملیاتی: /metrics (قالب متنی Prometheus) و /healthz
+"""
+from flask import Blueprint, Response, jsonify
+
+from backend import startup
+from backend.metrics import registry
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+bp_metrics = Blueprint("metrics_routes", __name__)
+
+
+@bp_metrics.get("/metrics")
+def metrics():
+    return Response(registry.render(), content_type=PROMETHEUS_MIMETYPE)
+
+
+@bp_metrics.get("/healthz")
+def healthz():
+    """زمان‌های راه‌اندازی سرد این worker (برای تنظیم autoscaling).
+
+    worker فقط پس از گرم شدن درخواست می‌پذیرد، پس هر پاسخی یعنی آماده است.
+    """
+    return jsonify(startup.status()), 200
@@ -0,0 +1,52 @@
+"""
+sse – ابزارهای مشترک پاسخ استریمی (Server-Sent Events) برای روت‌ها
+"""
+import json
+from typing import Iterable, Iterator
+
+from flask import Response, request, stream_with_context
+
+SSE_MIMETYPE = "text/event-stream"
+
+
+def wants_stream() -> bool:
+    """کلاینت با ?stream=1 یا هدر Accept: text/event-stream حالت استریم را می‌خواهد."""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", SSE_MIMETYPE])
+    return best == SSE_MIMETYPE
+
+
+def sse_event(event: str, data: dict) -> str:
+    """یک رویداد SSE؛ داده به صورت JSON (با حروف فارسی خوانا) سریال می‌شود."""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def sse_response(events: Iterable[str]) -> Response:
+    """پاسخ chunked که هر رویداد را بلافاصله (بدون بافر پراکسی) ارسال می‌کند."""
+    resp = Response(stream_with_context(events), mimetype=SSE_MIMETYPE)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # غیرفعال کردن بافر nginx
+    return resp
+
+
+def prime(items: Iterator):
+    """اولین آیتم را پیش از ارسال هدرها می‌گیرد تا خطاهای آغازین (مثل صف پر) هنوز
+    به صورت کد وضعیت HTTP قابل گزارش باشند."""
+    try:
+        first = next(items)
+    except StopIteration:
+        return iter(())
+
+    def _chained():
+        try:
+            yield first
+            yield from items
+        finally:
+            # بستن زودهنگام (قطع کلاینت) به generator اصلی هم منتقل شود
+            close = getattr(items, "close", None)
+            if close:
+                close()
+
+    return _chained()
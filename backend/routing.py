@@ -0,0 +1,160 @@
+"""
+routing – انتخاب مدل هر پرسش با یک طبقه‌بند محلی ارزان (قاعده‌محور، بدون فراخوانی شبکه)
+
+سه سطح:
+    canned   سلام و احوال‌پرسی و پرسش هویت («تو کی هستی؟»، «دانوش کیه؟»): پاسخ آماده، بدون upstream
+             (فقط وقتی کل پیام همین پرسش باشد و واژهٔ حقوقی نداشته باشد؛ شبیه آن ولی مبهم → full)
+    fast     پرسش‌های کوتاه تعریفی («مهریه چیست؟»، «منظور از عقد موقت چیست؟») → مدل سریع
+    full     بقیه؛ و هر جا طبقه‌بند مطمئن نیست، تاریخچهٔ گفت‌وگو دارد یا خطا می‌دهد → مدل کامل
+اگر فراخوانی مدل سریع خطا بدهد، Core همان پیام‌ها را با مدل کامل تکرار می‌کند.
+سهم هر سطح، fallbackها و تأخیر پاسخ هر سطح در /metrics (qy_route_*).
+
+تنظیمات (متغیر محیطی):
+    ROUTER                   on (پیش‌فرض) | off = همه با مدل کامل و بدون پاسخ آماده
+    ROUTER_FAST_MODEL        مدل سطح fast (پیش‌فرض gpt-4o-mini)
+    ROUTER_MIN_CONFIDENCE    کمترین اطمینان طبقه‌بند برای سطح fast (پیش‌فرض 0.75)
+    ROUTER_FAST_MAX_WORDS    بلندترین پرسش (تعداد کلمه) برای سطح fast (پیش‌فرض 8)
+    ROUTER_CANNED            on (پیش‌فرض) | off = سلام و پرسش هویت هم به مدل می‌رود
+"""
+import logging
+import os
+import re
+from typing import NamedTuple, Optional
+
+from .metrics import route_decisions, route_fallbacks
+from .normalize import normalize_text
+
+log = logging.getLogger(__name__)
+
+CANNED, FAST, FULL = "canned", "fast", "full"
+
+# پاسخ‌های آماده (هویت طبق پرامپت سیستمی: دانوش، ساخت هوش مصنوعی هوشیدر)
+CANNED_ANSWERS = {
+    "greeting": "سلام! من دانوش هستم، دستیار حقوقی قانون‌یار. پرسش حقوقی خود را بپرسید تا بر اساس قوانین ایران راهنمایی‌تان کنم.",
+    "identity": "من دانوش هستم، چت‌بات هوشمند حقوقی که توسط شرکت هوش مصنوعی هوشیدر توسعه داده شده است. "
+                "می‌توانم دربارهٔ قوانین جمهوری اسلامی ایران و مواد قانونی مرتبط به شما کمک کنم.",
+}
+
+# واژه‌هایی که یک پیام را «فقط احوال‌پرسی» نگه می‌دارند (فرم یکسان‌شده)
+_GREETING_WORDS = frozenset("""
+سلام درود علیک سلامتی وقت روز صبح ظهر عصر شب بخیر خسته نباشید نباشی خوبی خوبید خوبین
+چطوری چطورید چطورین حالت حالتون حال شما خوب هست هستید و عزیز جان دانوش
+hi hello hey salam
+""".split())
+
+# پرسش هویت فقط وقتی کل پیام (یکسان‌شده) همین جمله باشد؛ «تو/شما» در الگوی سازنده الزامی است
+_YOU = r"(تو|ترا|تو را|تو رو|شما|شما را|شما رو)"
+_MAKER = r"(کی|چه کسی|چه شرکتی|کدام شرکت)"
+_MADE = r"(ساخته|ساخت|طراحی کرده|توسعه داده)( است|ه)?"
+_IDENTITY_RE = re.compile(
+    r"^((سلام|درود|hi|hello|hey) )?("
+    r"(تو|شما) (کی|کیه|چی|چیه|چه کسی)( هستی| هستید| هستین)?"
+    r"|(تو|شما) کیستی(د)?"
+    r"|اسم(ت| تو| شما|تون) (چیه|چیست|چی هست)"
+    rf"|{_MAKER} {_YOU} {_MADE}"
+    rf"|{_YOU} {_MAKER} {_MADE}"
+    r"|دانوش (کیه|کیست|چیه|چیست|کی هست|چی هست)"
+    r"|who are you|what is your name|who (made|built|created) you"
+    r")$"
+)
+# نشانهٔ پرسش هویت بدون تطبیق کامل («وکیل تعیینی شما کیه»، «این سند را کی ساخته»): مبهم → مدل کامل
+_IDENTITY_CUE_RE = re.compile(
+    r"(تو|شما) (کی|کیه|کیستی|چه کسی)|اسم(ت| تو| شما|تون)? (چیه|چیست)|(ساخته|ساخت|طراحی کرده|توسعه داده)$"
+    r"|دانوش|who|your name"
+)
+# واژه‌های حقوقی: پیامی که یکی از این‌ها را دارد هرگز پاسخ آمادهٔ هویت نمی‌گیرد
+_LEGAL_WORDS = frozenset("""
+قانون قانونی قوانین ماده مواد تبصره حقوق حقوقی وکیل وکالت وکالتنامه دادگاه دادگستری دادسرا قاضی
+سند اسناد جعل جعلی قرارداد قرار شکایت دعوا دعوی جرم مجازات حکم رای ارث ملک اجاره مهریه نفقه طلاق
+حضانت چک سفته کلاهبرداری ثبت محضر
+""".split())
+
+_DEFINITION_RE = re.compile(r"^(تعریف|معنی|معنای|مفهوم|منظور از) |(چیست|چیه|یعنی چه|یعنی چی|به چه معناست)$")
+
+# نشانه‌های پرسش موردی (شرح ماجرا، ضمیر اول شخص، عدد و مبلغ) که مدل کامل می‌خواهند
+_SCENARIO_RE = re.compile(
+    r"\b(اگر|اگه|چنانچه|درصورتی|در صورتی|آیا|چه کنم|چکار|چیکار|میتوانم|می توانم|میتونم|می تونم)\b"
+    r"|\b(من|ما|شوهرم|همسرم|زنم|پدرم|مادرم|برادرم|خواهرم|پسرم|دخترم|کارفرمام|کارفرمایم|موجر|مستاجرم)\b"
+    r"|\d"
+)
+# پرسش از حکم، مجازات، مهلت یا رویه تعریف ساده نیست؛ دقت استناد مدل کامل لازم است
+_RULING_RE = re.compile(r"\b(مجازات|حکم|مهلت|مدت|شرایط|مراحل|نحوه|هزینه|میزان|جریمه|دیه|حبس)\b")
+
+
+class Route(NamedTuple):
+    tier: str                     # canned | fast | full
+    model: Optional[str]          # None برای canned
+    intent: str                   # greeting | identity | definition | general | ...
+    confidence: float
+    answer: Optional[str] = None  # فقط برای canned
+
+
+class Router:
+    """Rule-based question classifier that picks a model tier; never raises."""
+
+    def __init__(self, full_model: str, fast_model: Optional[str], min_confidence: float = 0.75,
+                 fast_max_words: int = 8, canned: bool = True):
+        self.full_model = full_model
+        self.fast_model = fast_model
+        self.min_confidence = min_confidence
+        self.fast_max_words = fast_max_words
+        self.canned = canned
+
+    @classmethod
+    def from_env(cls, full_model: str) -> "Router":
+        if os.getenv("ROUTER", "on").lower() == "off":
+            return cls(full_model, None, canned=False)
+        return cls(
+            full_model,
+            os.getenv("ROUTER_FAST_MODEL", "gpt-4o-mini") or None,
+            min_confidence=float(os.getenv("ROUTER_MIN_CONFIDENCE", 0.75)),
+            fast_max_words=int(os.getenv("ROUTER_FAST_MAX_WORDS", 8)),
+            canned=os.getenv("ROUTER_CANNED", "on").lower() != "off",
+        )
+
+    def route(self, question: str, chat_history: list = None) -> Route:
+        try:
+            decision = self._classify(question, chat_history)
+        except Exception as e:  # طبقه‌بند خراب نباید پاسخگویی را متوقف کند
+            log.warning("router failed; using full model", extra={"error": str(e)})
+            decision = Route(FULL, self.full_model, "error", 0.0)
+        route_decisions.inc(tier=decision.tier, intent=decision.intent)
+        return decision
+
+    def fallback(self, route: Route, reason: str) -> Route:
+        """سطح fast شکست خورد؛ همان پرسش با مدل کامل."""
+        route_fallbacks.inc(reason=reason)
+        return Route(FULL, self.full_model, route.intent, route.confidence)
+
+    # ---------------------------------------------------------------------
+    def _classify(self, question: str, chat_history: list = None) -> Route:
+        text = normalize_text(question)
+        words = text.split()
+
+        if self.canned and words and len(words) <= 10:
+            if all(word in _GREETING_WORDS for word in words):
+                return Route(CANNED, None, "greeting", 1.0, CANNED_ANSWERS["greeting"])
+            legal = not _LEGAL_WORDS.isdisjoint(words)
+            if _IDENTITY_RE.match(text) and not legal:
+                return Route(CANNED, None, "identity", 0.95, CANNED_ANSWERS["identity"])
+            if _IDENTITY_CUE_RE.search(text):
+                return Route(FULL, self.full_model, "identity_ambiguous", 0.5)
+
+        if not self.fast_model:
+            return Route(FULL, self.full_model, "general", 1.0)
+        # پرسش‌های پیگیری به زمینهٔ گفت‌وگو وابسته‌اند
+        if chat_history:
+            return Route(FULL, self.full_model, "follow_up", 1.0)
+
+        confidence = self._definition_confidence(text, words)
+        if confidence >= self.min_confidence:
+            return Route(FAST, self.fast_model, "definition", confidence)
+        return Route(FULL, self.full_model, "definition" if confidence else "general", 1.0 - confidence)
+
+    def _definition_confidence(self, text: str, words: list) -> float:
+        """اطمینان از این‌که پرسش یک تعریف کوتاه است (0 = اصلاً)."""
+        if not words or len(words) > self.fast_max_words or not _DEFINITION_RE.search(text):
+            return 0.0
+        confidence = 0.95 if len(words) <= 4 else 0.8
+        confidence -= 0.3 * (len(_SCENARIO_RE.findall(text)) + len(_RULING_RE.findall(text)))
+        return max(confidence, 0.0)
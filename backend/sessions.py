@@ -0,0 +1,144 @@
+"""
+sessions – نگهداری تاریخچهٔ گفت‌وگو سمت سرور، با کلید session id درخواست
+
+هر جلسه فقط چند نوبت آخر را (با سقف حجم) نگه می‌دارد؛ نوبت‌های قدیمی‌تر در یک
+خلاصهٔ کوتاه (فهرست پرسش‌های قبلی کاربر) جمع می‌شوند. هنگام ساخت پرامپت، تاریخچه
+طوری بریده می‌شود که پرامپت سیستمی + تاریخچه + پرسش از بودجهٔ توکن بیشتر نشود.
+
+تنظیمات (متغیر محیطی):
+    SESSION_MAX_TURNS      حداکثر پیام نگه‌داشته‌شده در هر جلسه (پیش‌فرض 20)
+    SESSION_MAX_BYTES      سقف حجم متن هر جلسه (پیش‌فرض 16384)
+    SESSION_IDLE_TTL_S     انقضای جلسهٔ بی‌فعالیت بر حسب ثانیه (پیش‌فرض 1800)
+    SESSION_MAX_SESSIONS   حداکثر جلسهٔ هم‌زمان در حافظه (پیش‌فرض 10000)
+    PROMPT_TOKEN_BUDGET    سقف توکن پرامپت ارسالی به مدل (پیش‌فرض 6000)
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Tuple
+
+from .tokens import MESSAGE_OVERHEAD, estimate_tokens
+
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 20))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 16384))
+SESSION_IDLE_TTL_S = int(os.getenv("SESSION_IDLE_TTL_S", 1800))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 10000))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000))
+
+SUMMARY_MAX_CHARS = 600
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+def valid_session_id(value: Optional[str]) -> Optional[str]:
+    """session id معتبر یا None (شناسهٔ نامعتبر = بدون جلسه)."""
+    value = (value or "").strip()
+    return value if _SESSION_ID_RE.match(value) else None
+
+
+class Session:
+    """Recent turns as compact (role, content) tuples plus a summary of older ones."""
+
+    __slots__ = ("turns", "size", "summary", "last_seen")
+
+    def __init__(self):
+        self.turns = deque()
+        self.size = 0
+        self.summary = ""
+        self.last_seen = time.monotonic()
+
+    def append(self, role: str, content: str) -> None:
+        self.turns.append((role, content))
+        self.size += len(content.encode("utf-8"))
+        while self.turns and (len(self.turns) > SESSION_MAX_TURNS or self.size > SESSION_MAX_BYTES):
+            self._drop_oldest()
+
+    def _drop_oldest(self) -> None:
+        role, content = self.turns.popleft()
+        self.size -= len(content.encode("utf-8"))
+        if role == "user":
+            # از پاسخ‌های قدیمی فقط پرسش کاربر در خلاصه می‌ماند
+            self.summary = (self.summary + "؛ " + content[:120]).strip("؛ ")[-SUMMARY_MAX_CHARS:]
+
+
+class SessionStore:
+    """In-memory LRU of sessions with idle expiry and a token-budgeted history view."""
+
+    def __init__(self):
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        # قدیمی‌ترین‌ها ابتدای OrderedDict هستند؛ با اولین جلسهٔ زنده متوقف می‌شویم
+        while self._sessions:
+            sid, session = next(iter(self._sessions.items()))
+            if now - session.last_seen < SESSION_IDLE_TTL_S and len(self._sessions) <= SESSION_MAX_SESSIONS:
+                break
+            del self._sessions[sid]
+
+    def _get(self, session_id: str, create: bool) -> Optional[Session]:
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None and create:
+            session = self._sessions[session_id] = Session()
+        if session is not None:
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    # ------------------------------------------------------------------
+    def history_for(self, session_id: Optional[str], fixed_tokens: int) -> Tuple[list, int]:
+        """
+        تاریخچهٔ قابل ارسال برای این جلسه و تعداد کل توکن پرامپت.
+        fixed_tokens = توکن‌های پرامپت سیستمی + سقف مواد قانونی + پرسش فعلی (بدون تاریخچه).
+        """
+        if not session_id:
+            return [], fixed_tokens
+
+        with self._lock:
+            session = self._get(session_id, create=False)
+            if session is None:
+                return [], fixed_tokens
+            turns = list(session.turns)
+            summary = session.summary
+
+        budget = PROMPT_TOKEN_BUDGET - fixed_tokens
+        history, used = [], 0
+        # از جدیدترین نوبت به عقب، تا جایی که بودجه اجازه دهد
+        for role, content in reversed(turns):
+            cost = MESSAGE_OVERHEAD + estimate_tokens(content)
+            if used + cost > budget:
+                break
+            history.append({"role": role, "content": content})
+            used += cost
+        history.reverse()
+
+        # پیام assistant بدون پرسش قبلی‌اش معنایی ندارد
+        if history and history[0]["role"] == "assistant":
+            used -= MESSAGE_OVERHEAD + estimate_tokens(history.pop(0)["content"])
+
+        dropped = len(turns) - len(history)
+        if summary or dropped:
+            older = [c[:120] for r, c in turns[:dropped] if r == "user"]
+            note = "؛ ".join(filter(None, [summary] + older))[-SUMMARY_MAX_CHARS:]
+            if note:
+                content = f"خلاصهٔ پرسش‌های قبلی کاربر در این گفت‌وگو: {note}"
+                cost = MESSAGE_OVERHEAD + estimate_tokens(content)
+                if used + cost <= budget:
+                    history.insert(0, {"role": "system", "content": content})
+                    used += cost
+
+        return history, fixed_tokens + used
+
+    def append(self, session_id: Optional[str], question: str, answer: str) -> None:
+        if not session_id or not answer:
+            return
+        with self._lock:
+            session = self._get(session_id, create=True)
+            session.append("user", question)
+            session.append("assistant", answer)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,87 @@
+"""
+startup – گرم کردن پردازه پیش از پذیرش درخواست و گزارش زمان راه‌اندازی سرد
+
+دو مرحله دارد:
+    warm_shared()  در پردازهٔ master پیش از fork: import‌های سنگین (openai/aiohttp، pydub)،
+                   ساخت پرامپت سیستمی و بارگذاری نمایهٔ قوانین؛ workerها این حافظه را
+                   به صورت copy-on-write به ارث می‌برند.
+    warm_worker()  در هر worker پس از fork: event loop و استخر اتصال upstream و بالا
+                   آوردن پردازه‌های استخر decode.
+
+زمان هر مرحله در لاگ، متریک qy_startup_seconds و endpoint /healthz گزارش می‌شود.
+"""
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from .metrics import registry
+
+log = logging.getLogger(__name__)
+
+_report: Dict[str, object] = {"master_s": None, "worker_s": None, "steps": {}}
+
+
+def _step(name: str, fn) -> None:
+    started = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:  # گرم کردن ناموفق نباید مانع سرویس‌دهی شود؛ اولین درخواست دوباره تلاش می‌کند
+        log.warning("warm-up step failed", extra={"step": name, "error": str(e)})
+    _report["steps"][name] = round(time.perf_counter() - started, 4)
+
+
+def _import_clients() -> None:
+    from . import upstream  # noqa: F401  (openai + aiohttp)
+    from .audio_codec import _ffmpeg
+    _ffmpeg()  # pydub
+
+
+def _preload_prompt_and_index() -> None:
+    from . import bot, statutes
+    statutes.get_index()
+    bot.count_prompt_tokens("")  # پرامپت سیستمی + tokenizer
+
+
+def warm_shared(started_at: float) -> None:
+    """گرم کردن بخش مشترک؛ started_at = time.time() در ابتدای اجرای پردازه."""
+    _step("imports", _import_clients)
+    _step("prompt_index", _preload_prompt_and_index)
+    _report["master_s"] = round(time.time() - started_at, 4)
+    log.info("shared warm-up done", extra={"cold_start_s": _report["master_s"], "steps": dict(_report["steps"])})
+
+
+def _open_client() -> None:
+    from . import aio, upstream
+    aio.run(upstream.warm())
+
+
+def _start_decode_workers() -> None:
+    from . import aio
+    from .decode_pool import pool
+    aio.run(pool.warm())
+
+
+def warm_worker(forked_at: Optional[float] = None) -> None:
+    """گرم کردن بخش وابسته به پردازه (پس از fork)؛ پس از آن worker آمادهٔ پذیرش است."""
+    forked_at = forked_at or time.time()
+    _step("client", _open_client)
+    _step("decode_pool", _start_decode_workers)
+    _report["worker_s"] = round(time.time() - forked_at, 4)
+    log.info("worker ready", extra={"pid": os.getpid(), "worker_start_s": _report["worker_s"],
+                                    "cold_start_s": _report["master_s"]})
+
+
+def status() -> dict:
+    return {**_report, "steps": dict(_report["steps"]), "pid": os.getpid()}
+
+
+def _collect():
+    for phase in ("master", "worker"):
+        value = _report[f"{phase}_s"]
+        if value is not None:
+            yield "qy_startup_seconds", {"phase": phase}, value
+
+
+registry.source("qy_startup_seconds", "gauge",
+                "Cold start: process start to shared warm-up done (master), fork to ready (worker).", _collect)
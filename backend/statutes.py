@@ -0,0 +1,386 @@
+"""
+statutes – نمایهٔ محلی متن قوانین (قانون مدنی، مجازات اسلامی، صدور چک و ...)
+
+دو کاربرد دارد:
+    1. جست‌وجوی مستقیم (قانون، شمارهٔ ماده): پرسش‌هایی مثل «متن ماده ۱۹۰ قانون مدنی»
+       بدون هیچ فراخوانی LLM و در حد میلی‌ثانیه پاسخ داده می‌شوند.
+    2. بازیابی BM25 روی نمایهٔ معکوس: چند مادهٔ مرتبط (در سقف توکن) به پرامپت تزریق می‌شود.
+
+ساخت نمایه یک مرحلهٔ آفلاین است (tools/build_statute_index.py). پیکره ورودی فایل‌های
+JSONL با سطرهای {"law": "...", "article": "190", "text": "..."} است؛ law می‌تواند شناسه
+(مثل civil) یا عنوان فارسی قانون باشد. فایل نمایه هنگام اولین استفاده با mmap باز می‌شود و
+جدول‌هایش (مواد، واژه‌ها، postings) در جای خود خوانده می‌شوند، پس workerها صفحه‌ها را به
+اشتراک دارند؛ اگر وجود نداشته باشد هر دو قابلیت غیرفعال‌اند (با هشدار در لاگ؛ build ایمیج
+Docker هم در این حالت فقط هشدار می‌دهد). BM25 پایتون خالص است و Core آن را بیرون از loop مشترک اجرا می‌کند.
+
+تنظیمات (متغیر محیطی):
+    STATUTE_INDEX_PATH       مسیر فایل نمایه (پیش‌فرض data/statutes.idx در ریشهٔ پروژه)
+    STATUTE_TOP_K            حداکثر مادهٔ تزریق‌شده به پرامپت (پیش‌فرض 4)
+    STATUTE_CONTEXT_TOKENS   سقف توکن متن مواد تزریق‌شده (پیش‌فرض 800)
+"""
+import glob
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from .normalize import normalize_text
+from .tokens import estimate_tokens
+
+log = logging.getLogger(__name__)
+
+STATUTE_INDEX_PATH = os.getenv(
+    "STATUTE_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "statutes.idx"),
+)
+STATUTE_TOP_K = int(os.getenv("STATUTE_TOP_K", 4))
+STATUTE_CONTEXT_TOKENS = int(os.getenv("STATUTE_CONTEXT_TOKENS", 800))
+
+_MAGIC = b"QYSTAT2\n"
+_SECTIONS = ("docs", "articles", "vocab", "dl", "postings", "strings", "texts")
+_DOC_ROW = struct.Struct("<6I")
+_KEYED_ROW = struct.Struct("<4I")
+_BM25_K1 = 1.5
+_BM25_B = 0.75
+
+# ───────────────────────────── laws
+# شناسهٔ قانون → (عنوان رسمی، نام‌های دیگر). نام‌ها پس از normalize_text مقایسه می‌شوند.
+LAWS = {
+    "constitution": ("قانون اساسی جمهوری اسلامی ایران", ["قانون اساسی"]),
+    "civil": ("قانون مدنی", ["قانون مدنی"]),
+    "penal": ("قانون مجازات اسلامی", ["قانون مجازات اسلامی", "قانون مجازات"]),
+    "commercial": ("قانون تجارت", ["قانون تجارت"]),
+    "civil_procedure": ("قانون آیین دادرسی مدنی", ["قانون آیین دادرسی مدنی", "قانون آئین دادرسی مدنی", "آیین دادرسی مدنی"]),
+    "criminal_procedure": ("قانون آیین دادرسی کیفری", ["قانون آیین دادرسی کیفری", "قانون آئین دادرسی کیفری", "آیین دادرسی کیفری"]),
+    "registration": ("قانون ثبت اسناد و املاک", ["قانون ثبت اسناد و املاک", "قانون ثبت"]),
+    "family": ("قانون حمایت خانواده", ["قانون حمایت خانواده", "قانون حمایت از خانواده"]),
+    "labor": ("قانون کار", ["قانون کار"]),
+    "cheque": ("قانون صدور چک", ["قانون صدور چک", "قانون چک"]),
+    "landlord": ("قانون روابط موجر و مستاجر", ["قانون روابط موجر و مستاجر", "قانون موجر و مستاجر"]),
+}
+
+# نام‌ها از بلند به کوتاه تا «قانون مجازات اسلامی» پیش از «قانون مجازات» تطبیق شود
+_ALIASES = sorted(
+    ((normalize_text(alias), law_id) for law_id, (_, aliases) in LAWS.items() for alias in aliases),
+    key=lambda item: -len(item[0]),
+)
+
+# «ماده ۱۹۰ قانون مدنی» / «ماده 10 از قانون صدور چک» (پس از یکسان‌سازی ارقام)
+_ARTICLE_RE = re.compile(r"ماده\s+(\d+)\s+(?:از\s+)?(.*)")
+
+# کلماتی که نشان می‌دهند کاربر فقط متن ماده را می‌خواهد، نه تحلیل
+_LOOKUP_WORDS = {normalize_text(w) for w in (
+    "متن", "چیست", "چی", "چه", "میگوید", "می", "گوید", "میگه", "رو", "را", "بگو", "بنویس",
+    "بفرمایید", "لطفا", "لطفاً", "ذکر", "کن", "کنید", "است", "هست", "در", "مورد", "چیه",
+    "مفاد", "محتوای", "ماده", "از", "بخوان", "نشان", "بده", "بدهید", "ارسال",
+)}
+
+_STOPWORDS = {normalize_text(w) for w in (
+    "و", "در", "به", "از", "که", "این", "آن", "را", "با", "برای", "است", "هست", "یا", "تا",
+    "بر", "هم", "نیز", "می", "شود", "شده", "باشد", "کند", "کنند", "های", "ها", "یک", "چه",
+    "چیست", "آیا", "اگر", "بین", "هر", "باید", "خود", "اینکه", "ای", "من", "ما", "شما",
+)}
+
+
+def resolve_law(text: str) -> Optional[str]:
+    """شناسهٔ قانونی که متن با نام آن شروع می‌شود (یا خود شناسه)."""
+    text = normalize_text(text)
+    if text in LAWS:
+        return text
+    for alias, law_id in _ALIASES:
+        if text == alias or text.startswith(alias + " "):
+            return law_id
+    return None
+
+
+def _stem(token: str) -> str:
+    # ریشه‌یابی بسیار سبک: حذف پسوندهای جمع رایج
+    for suffix in ("هایی", "های", "ها"):
+        if len(token) > len(suffix) + 2 and token.endswith(suffix):
+            return token[: -len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """توکن‌سازی فارسی برای نمایهٔ معکوس (یکسان‌سازی، حذف ایست‌واژه، ریشه‌یابی سبک)."""
+    return [_stem(t) for t in normalize_text(text).split() if t not in _STOPWORDS and len(t) > 1]
+
+
+# ───────────────────────────── build (offline)
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def build_index(sources: List[str], out_path: str) -> dict:
+    """
+    ساخت فایل نمایه از فایل‌های JSONL. قالب فایل:
+        MAGIC | طول meta (8 بایت) | meta (JSON کوچک: نسخه، قانون‌ها، شمارش‌ها، جای بخش‌ها) | بخش‌ها
+    همهٔ بخش‌ها جدول‌های باینری little-endian (هم‌تراز 8 بایت) هستند و در زمان اجرا مستقیم
+    از mmap خوانده می‌شوند، نه با parse شدن در حافظهٔ هر پردازه:
+        docs      هر ماده (uint32): قانون، جای شمارهٔ ماده در strings، طول آن، جای متن در texts، طول متن، طول (توکن)
+        articles  «law:article» مرتب (uint32: جای کلید در strings، طول کلید، doc، 0)
+        vocab     واژه‌های مرتب (uint32: جای واژه در strings، طول واژه، اندیس در postings، df)
+        dl        طول هر ماده (uint32) برای BM25
+        postings  (doc, tf) های هر واژه پشت سر هم (uint32)
+        strings   واژه‌ها، کلیدها و شماره‌های ماده (UTF-8)
+        texts     متن مواد (UTF-8)
+    """
+    docs, texts, postings = [], [], defaultdict(list)
+    for path in sorted(p for src in sources for p in (glob.glob(os.path.join(src, "*.jsonl")) if os.path.isdir(src) else [src])):
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                law_id = resolve_law(row["law"])
+                if law_id is None:
+                    raise ValueError(f"{path}:{line_no}: unknown law {row['law']!r}")
+                article = normalize_text(str(row["article"]))
+                text = row["text"].strip()
+
+                doc_id = len(docs)
+                terms = Counter(tokenize(text))
+                for term, tf in terms.items():
+                    postings[term].append((doc_id, tf))
+                docs.append((law_id, article, sum(terms.values())))
+                texts.append(text.encode("utf-8"))
+
+    strings = bytearray()
+
+    def intern(value: str) -> Tuple[int, int]:
+        encoded = value.encode("utf-8")
+        strings.extend(encoded)
+        return len(strings) - len(encoded), len(encoded)
+
+    laws = sorted({law_id for law_id, _, _ in docs})
+    doc_rows, dl, text_blob = array("I"), array("I"), bytearray()
+    for (law_id, article, length), encoded in zip(docs, texts):
+        doc_rows.extend((laws.index(law_id), *intern(article), len(text_blob), len(encoded), length))
+        dl.append(length)
+        text_blob.extend(encoded)
+
+    # ترتیب str پایتون (code point) همان ترتیب بایت‌های UTF-8 است؛ جست‌وجوی دودویی روی بایت‌ها
+    article_rows = array("I")
+    for key, doc_id in sorted({f"{d[0]}:{d[1]}": i for i, d in enumerate(docs)}.items()):
+        article_rows.extend((*intern(key), doc_id, 0))
+    vocab_rows, post = array("I"), array("I")
+    for term in sorted(postings):
+        vocab_rows.extend((*intern(term), len(post), len(postings[term])))
+        for doc_id, tf in postings[term]:
+            post.extend((doc_id, tf))
+
+    avgdl = (sum(dl) / len(dl)) if dl else 0.0
+    tables = [doc_rows, article_rows, vocab_rows, dl, post]
+    if sys.byteorder != "little":
+        for table in tables:
+            table.byteswap()
+    blobs = dict(zip(_SECTIONS, [t.tobytes() for t in tables] + [bytes(strings), bytes(text_blob)]))
+    sections, offset = {}, 0
+    for name in _SECTIONS:
+        sections[name] = [offset, len(blobs[name])]
+        offset = _align(offset + len(blobs[name]))
+
+    meta = {
+        "version": int(time.time()),
+        "laws": laws,
+        "docs": len(docs),
+        "articles": len(article_rows) // 4,
+        "terms": len(vocab_rows) // 4,
+        "avgdl": avgdl,
+        "sections": sections,
+    }
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<Q", len(meta_bytes)))
+        f.write(meta_bytes)
+        base = _align(f.tell())
+        for name in _SECTIONS:
+            f.write(b"\0" * (base + sections[name][0] - f.tell()))
+            f.write(blobs[name])
+    os.replace(tmp_path, out_path)  # جایگزینی اتمیک برای پردازه‌هایی که نمایهٔ قبلی را باز دارند
+    return {"articles": len(docs), "terms": meta["terms"], "bytes": os.path.getsize(out_path)}
+
+
+# ───────────────────────────── runtime index
+class StatuteIndex:
+    """Memory-mapped statute index: direct article lookup and BM25 retrieval.
+
+    Only the small meta header is parsed; every table is read in place from the mmap,
+    so forked workers share the pages instead of each holding its own dicts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a statute index (or an older format; rebuild it)")
+        (meta_len,) = struct.unpack_from("<Q", self._mm, len(_MAGIC))
+        start = len(_MAGIC) + 8
+        meta = json.loads(self._mm[start: start + meta_len].decode("utf-8"))
+        base = _align(start + meta_len)
+        self._sections = {name: (base + offset, size) for name, (offset, size) in meta["sections"].items()}
+        self.version = meta["version"]
+        self._laws = meta["laws"]
+        self._n_docs = meta["docs"]
+        self._n_articles = meta["articles"]
+        self._n_terms = meta["terms"]
+        self._avgdl = meta["avgdl"] or 1.0
+        self._strings = self._sections["strings"][0]
+        self._texts = self._sections["texts"][0]
+        self._dl = self._u32("dl")
+        self._post = self._u32("postings")
+
+    def _u32(self, name: str):
+        """بخش uint32 به صورت memoryview بدون کپی (در ماشین big-endian یک کپی برگردانده‌شده)."""
+        start, size = self._sections[name]
+        view = memoryview(self._mm)[start: start + size].cast("I")
+        if sys.byteorder == "little":
+            return view
+        arr = array("I", view)
+        arr.byteswap()
+        return arr
+
+    def _row(self, fmt: struct.Struct, name: str, i: int) -> tuple:
+        return fmt.unpack_from(self._mm, self._sections[name][0] + i * fmt.size)
+
+    def _string(self, offset: int, length: int) -> bytes:
+        return self._mm[self._strings + offset: self._strings + offset + length]
+
+    def _find(self, name: str, count: int, key: str) -> Optional[tuple]:
+        """جست‌وجوی دودویی کلید در جدول مرتب articles یا vocab؛ رکورد یا None."""
+        key, lo, hi = key.encode("utf-8"), 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = self._row(_KEYED_ROW, name, mid)
+            probe = self._string(row[0], row[1])
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return row
+        return None
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    def text(self, doc_id: int) -> str:
+        _, _, _, offset, length, _ = self._row(_DOC_ROW, "docs", doc_id)
+        return self._mm[self._texts + offset: self._texts + offset + length].decode("utf-8")
+
+    def describe(self, doc_id: int) -> Tuple[str, str]:
+        law, offset, length = self._row(_DOC_ROW, "docs", doc_id)[:3]
+        return LAWS[self._laws[law]][0], self._string(offset, length).decode("utf-8")
+
+    def article(self, law_id: str, number: str) -> Optional[int]:
+        row = self._find("articles", self._n_articles, f"{law_id}:{number}")
+        return row[2] if row else None
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        n = self._n_docs
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            row = self._find("vocab", self._n_terms, term)
+            if row is None:
+                continue
+            start, df = row[2], row[3]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            postings = self._post[start: start + 2 * df]
+            for i in range(0, len(postings), 2):
+                doc_id, tf = postings[i], postings[i + 1]
+                dl = self._dl[doc_id]
+                scores[doc_id] += idf * tf * (_BM25_K1 + 1) / (tf + _BM25_K1 * (1 - _BM25_B + _BM25_B * dl / self._avgdl))
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+
+_index: Optional[StatuteIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_index() -> Optional[StatuteIndex]:
+    """بارگذاری تنبل نمایه در اولین استفاده؛ در نبود فایل None."""
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if not _index_loaded:
+            try:
+                _index = StatuteIndex(STATUTE_INDEX_PATH)
+                log.info("statute index loaded", extra={"articles": len(_index), "path": STATUTE_INDEX_PATH})
+            except FileNotFoundError:
+                log.warning("statute index not found; article lookup and retrieval disabled",
+                            extra={"path": STATUTE_INDEX_PATH})
+            except Exception as e:
+                log.error("could not load statute index", extra={"path": STATUTE_INDEX_PATH, "error": str(e)})
+            _index_loaded = True
+    return _index
+
+
+def index_version() -> int:
+    index = get_index()
+    return index.version if index else 0
+
+
+# ───────────────────────────── public API
+def lookup_article(question: str) -> Optional[str]:
+    """
+    اگر پرسش صرفاً درخواست متن یک ماده باشد («ماده ۱۹۰ قانون مدنی چیست؟»)
+    متن عین ماده را برمی‌گرداند؛ در غیر این صورت None (ادامه با LLM).
+    """
+    index = get_index()
+    if index is None:
+        return None
+    match = _ARTICLE_RE.search(normalize_text(question))
+    if not match:
+        return None
+    number, rest = match.group(1), match.group(2)
+    law_id = resolve_law(rest)
+    if law_id is None:
+        return None
+
+    # کلمات خارج از مرجع ماده باید فقط «متن را بگو» و مشابه آن باشند
+    alias_len = next(len(a.split()) for a, lid in _ALIASES if lid == law_id and (rest == a or rest.startswith(a + " ")))
+    before = normalize_text(question)[: match.start()].split()
+    after = rest.split()[alias_len:]
+    if any(w not in _LOOKUP_WORDS for w in before + after):
+        return None
+
+    doc_id = index.article(law_id, number)
+    if doc_id is None:
+        return None
+    title, article = index.describe(doc_id)
+    return f"ماده {article} {title}:\n{index.text(doc_id)}"
+
+
+@lru_cache(maxsize=1024)
+def relevant_articles(question: str) -> str:
+    """متن مواد مرتبط (BM25، حداکثر STATUTE_TOP_K) در سقف STATUTE_CONTEXT_TOKENS؛ یا رشتهٔ خالی."""
+    index = get_index()
+    if index is None or STATUTE_TOP_K <= 0:
+        return ""
+    parts, used = [], 0
+    for doc_id, _ in index.search(question, STATUTE_TOP_K):
+        title, article = index.describe(doc_id)
+        block = f"ماده {article} {title}: {index.text(doc_id)}"
+        cost = estimate_tokens(block)
+        if used + cost > STATUTE_CONTEXT_TOKENS:
+            continue
+        parts.append(block)
+        used += cost
+    return "\n\n".join(parts)
@@ -0,0 +1,215 @@
+"""
+tenants – دامنه‌های مجاز (tenant) بر اساس هدر X-Domain و محدودیت نرخ هر کدام
+
+هر tenant دو سطل توکن (token bucket) دارد:
+    requests   تعداد درخواست در دقیقه؛ پیش از هر کار دیگری در روت بررسی می‌شود.
+    tokens     توکن تخمینی (پرامپت + پاسخ) در دقیقه؛ فقط وقتی فراخوانی واقعی upstream
+               لازم است (نه برای پاسخ کش‌شده یا ماده‌ای که از نمایه می‌آید) کسر می‌شود.
+با خالی بودن سطل RateLimited پرتاب می‌شود و روت 429 با Retry-After برمی‌گرداند.
+weight سهم tenant در صف منصفانهٔ upstream (aio.UpstreamLimiter) و max_queued سقف
+درخواست‌های منتظر همان tenant است.
+
+فهرست tenantها از فایل JSON خوانده می‌شود و با تغییر فایل (mtime) بدون راه‌اندازی
+مجدد دوباره بارگذاری می‌شود؛ سطل tenantهای موجود حفظ می‌شود و فقط سقف‌ها عوض می‌شوند.
+قالب فایل (نمونه: config/tenants.json):
+    {"defaults": {...}, "anonymous": {...}, "tenants": {"mobit.ir": {"aliases": [...], ...}}}
+
+سقف‌ها برای کل سرویس نوشته می‌شوند و هر پردازه سهم WEB_CONCURRENCY-ام آن را اعمال می‌کند.
+
+تنظیمات (متغیر محیطی):
+    TENANTS_CONFIG      مسیر فایل tenantها (پیش‌فرض config/tenants.json در ریشهٔ پروژه)
+    TENANTS_RELOAD_S    حداکثر فاصلهٔ بررسی تغییر فایل بر حسب ثانیه (پیش‌فرض 5)
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from .aio import RateLimited
+from .metrics import tenant_rejections, tenant_requests
+
+log = logging.getLogger(__name__)
+
+TENANTS_CONFIG = os.getenv(
+    "TENANTS_CONFIG",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "tenants.json"),
+)
+TENANTS_RELOAD_S = float(os.getenv("TENANTS_RELOAD_S", 5))
+
+ANONYMOUS = "anonymous"
+
+DEFAULT_LIMITS = {
+    "weight": 1.0,
+    "requests_per_min": 120,
+    "burst": 20,
+    "tokens_per_min": 300000,
+    "token_burst": 60000,
+    "max_queued": 64,
+}
+
+
+def _processes() -> int:
+    return max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+
+
+# ───────────────────────────── token bucket
+class TokenBucket:
+    """Thread-safe token bucket; take() returns 0 on success or seconds until it would succeed."""
+
+    def __init__(self, rate_per_s: float, capacity: float):
+        self._lock = threading.Lock()
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def configure(self, rate_per_s: float, capacity: float) -> None:
+        with self._lock:
+            self._refill()
+            self.rate_per_s, self.capacity = rate_per_s, capacity
+            self.level = min(self.level, capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate_per_s)
+        self._updated = now
+
+    def take(self, amount: float = 1.0) -> float:
+        # درخواستی بزرگ‌تر از ظرفیت هرگز پذیرفته نمی‌شد؛ حداکثر یک سطل پر هزینه دارد
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return 0.0
+            if self.rate_per_s <= 0:
+                return float("inf")
+            return (amount - self.level) / self.rate_per_s
+
+
+# ───────────────────────────── tenant
+class Tenant:
+    """One X-Domain tenant: request and token buckets plus its fair-queue weight."""
+
+    def __init__(self, name: str, limits: dict):
+        self.name = name
+        self._requests = TokenBucket(0, 0)
+        self._tokens = TokenBucket(0, 0)
+        self.configure(limits)
+        self._requests.level = self._requests.capacity
+        self._tokens.level = self._tokens.capacity
+
+    def configure(self, limits: dict) -> None:
+        processes = _processes()
+        self.weight = max(float(limits["weight"]), 0.01)
+        self.max_queued = max(1, int(limits["max_queued"]) // processes)
+        self._requests.configure(limits["requests_per_min"] / 60.0 / processes,
+                                 max(1.0, limits["burst"] / processes))
+        self._tokens.configure(limits["tokens_per_min"] / 60.0 / processes,
+                               max(1.0, limits["token_burst"] / processes))
+
+    def _reject(self, reason: str, wait_s: float):
+        tenant_rejections.inc(tenant=self.name, reason=reason)
+        return RateLimited(retry_after=max(1, math.ceil(min(wait_s, 3600))))
+
+    def admit(self) -> None:
+        """یک درخواست از سطل requests؛ در صورت خالی بودن RateLimited."""
+        wait_s = self._requests.take(1)
+        if wait_s:
+            raise self._reject("requests", wait_s)
+        tenant_requests.inc(tenant=self.name)
+
+    def charge_tokens(self, tokens: int) -> None:
+        """کسر توکن تخمینی یک فراخوانی upstream؛ در صورت کمبود RateLimited."""
+        wait_s = self._tokens.take(tokens)
+        if wait_s:
+            raise self._reject("tokens", wait_s)
+
+    def reject_queued(self) -> RateLimited:
+        """خطای «صف این tenant پر است» (از aio.UpstreamLimiter)."""
+        return self._reject("queue", 1)
+
+
+# ───────────────────────────── registry
+class TenantRegistry:
+    """Maps X-Domain values (names and aliases) to tenants; reloads the config file on change."""
+
+    def __init__(self, path: str = TENANTS_CONFIG, reload_s: float = TENANTS_RELOAD_S):
+        self.path = path
+        self.reload_s = reload_s
+        self._lock = threading.Lock()
+        self._tenants: Dict[str, Tenant] = {}
+        self._domains: Dict[str, Tenant] = {}
+        self.anonymous = Tenant(ANONYMOUS, DEFAULT_LIMITS)
+        self._mtime = None
+        self._checked = 0.0
+        self._maybe_reload(force=True)
+
+    @staticmethod
+    def _domain_key(domain: str) -> str:
+        return domain.strip().lower()
+
+    def _maybe_reload(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_s:
+            return
+        with self._lock:
+            if not force and now - self._checked < self.reload_s:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if force or self._mtime is not None:
+                    log.error("tenant config not found; no domain is authorized",
+                              extra={"path": self.path, "error": str(e)})
+                self._mtime = None
+                self._tenants, self._domains = {}, {}
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                self._load()
+            except (OSError, ValueError, TypeError, KeyError) as e:
+                # فایل نیمه‌نوشته یا نامعتبر: پیکربندی قبلی معتبر می‌ماند
+                log.error("invalid tenant config; keeping previous", extra={"path": self.path, "error": str(e)})
+                return
+            self._mtime = mtime
+            log.info("tenant config loaded", extra={"path": self.path, "tenants": sorted(self._tenants)})
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as fh:
+            raw = json.load(fh)
+        defaults = {**DEFAULT_LIMITS, **raw.get("defaults", {})}
+
+        tenants: Dict[str, Tenant] = {}
+        domains: Dict[str, Tenant] = {}
+        for name, spec in raw.get("tenants", {}).items():
+            limits = {**defaults, **{k: v for k, v in spec.items() if k != "aliases"}}
+            tenant = self._tenants.get(name)
+            if tenant is None:
+                tenant = Tenant(name, limits)
+            else:
+                tenant.configure(limits)
+            tenants[name] = tenant
+            for domain in [name, *spec.get("aliases", [])]:
+                domains[self._domain_key(domain)] = tenant
+
+        self.anonymous.configure({**defaults, **raw.get("anonymous", {})})
+        self._tenants, self._domains = tenants, domains
+
+    def resolve(self, domain: Optional[str]) -> Optional[Tenant]:
+        """tenant مربوط به مقدار X-Domain، یا None اگر دامنه مجاز نباشد."""
+        self._maybe_reload()
+        if not domain:
+            return None
+        return self._domains.get(self._domain_key(domain))
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+
+registry = TenantRegistry()
@@ -0,0 +1,48 @@
+"""
+timing – زمان‌سنجی مراحل هر درخواست (decode، انتظار upstream و ...)
+
+مراحل در یک dict وابسته به درخواست (contextvar) جمع می‌شوند؛ چون aio.run
+contextvarها را به task روی loop مشترک منتقل می‌کند، مراحلی که آنجا اجرا می‌شوند
+هم در همان dict ثبت می‌شوند. در پایان درخواست به هدر Server-Timing تبدیل می‌شود.
+هر مرحله (حتی بیرون از درخواست) در هیستوگرام qy_stage_duration_seconds هم ثبت می‌شود.
+
+کارهای استخر decode در پردازهٔ دیگری اجرا می‌شوند؛ آنجا start_request() صدا زده
+می‌شود و current() همراه نتیجه برمی‌گردد تا در درخواست اصلی record شود.
+"""
+import contextlib
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from .metrics import stage_duration
+
+_spans: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_spans", default=None)
+
+
+def start_request() -> None:
+    _spans.set({})
+
+
+def record(name: str, seconds: float) -> None:
+    stage_duration.observe(seconds, stage=name)
+    spans = _spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def current() -> Dict[str, float]:
+    return dict(_spans.get() or {})
+
+
+def server_timing_header(spans: Dict[str, float]) -> str:
+    """{"stt": 0.8} → 'stt;dur=800.0' (میلی‌ثانیه، طبق استاندارد Server-Timing)."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items())
@@ -0,0 +1,44 @@
+"""
+tokens – تخمین تعداد توکن پرامپت (برای بودجهٔ توکن و گزارش مصرف)
+
+اگر پکیج اختیاری tiktoken نصب باشد شمارش دقیق انجام می‌شود؛ در غیر این صورت
+یک تخمین محافظه‌کارانه (حروف لاتین ~۴ کاراکتر، فارسی ~۲ کاراکتر به ازای هر توکن).
+"""
+from functools import lru_cache
+
+try:
+    import tiktoken  # وابستگی اختیاری
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:  # ImportError یا عدم دسترسی به فایل‌های encoding
+    _ENCODING = None
+
+# سربار هر پیام در قالب chat (نقش + جداکننده‌ها) و سربار کل پاسخ
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+
+@lru_cache(maxsize=64)
+def _estimate_cached(text: str) -> int:
+    return _estimate(text)
+
+
+def _estimate(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars + 1) // 2 + 1
+
+
+def estimate_tokens(text: str) -> int:
+    # متن‌های بلند و تکراری (پرامپت سیستمی) کش می‌شوند
+    if len(text) > 1024:
+        return _estimate_cached(text)
+    return _estimate(text)
+
+
+def count_message_tokens(messages: list) -> int:
+    """تعداد توکن تخمینی یک لیست پیام chat."""
+    total = REPLY_OVERHEAD
+    for m in messages:
+        total += MESSAGE_OVERHEAD + estimate_tokens(m.get("content") or "")
+    return total
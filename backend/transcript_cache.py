@@ -0,0 +1,89 @@
+"""
+transcript_cache – کش متن پیام‌های صوتی بر اساس hash بایت‌های خام آپلود
+
+کلاینت موبایل پس از timeout همان فایل را دوباره می‌فرستد؛ با این کش تلاش دوباره
+بدون رمزگشایی و بدون فراخوانی STT پاسخ می‌گیرد. کلید = مدل STT + نسخهٔ پیش‌پردازش +
+sha256 بایت‌های آپلود. نتیجهٔ «فایل بی‌صدا» هم کش می‌شود تا دوباره پردازش نشود.
+بک‌اندها همان بک‌اندهای کش پاسخ‌اند (answer_cache).
+
+تنظیمات (متغیر محیطی):
+    TRANSCRIPT_CACHE_BACKEND      memory (پیش‌فرض) | redis | off
+    TRANSCRIPT_CACHE_MAX_ENTRIES  حداکثر تعداد آیتم در بک‌اند حافظه (پیش‌فرض 1024)
+    TRANSCRIPT_CACHE_TTL_S        عمر هر متن بر حسب ثانیه (پیش‌فرض 3600)
+    TRANSCRIPT_CACHE_REDIS_URL    آدرس redis (پیش‌فرض همان ANSWER_CACHE_REDIS_URL)
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from .answer_cache import MemoryBackend, RedisBackend
+
+log = logging.getLogger(__name__)
+
+
+class TranscriptCache:
+    """Transcript (or "silent") per raw-upload digest, with hit/miss counters."""
+
+    NAMESPACE = "qy:stt:"
+
+    def __init__(self, backend, ttl_s: int = 3600, version: str = ""):
+        self.backend = backend
+        self.ttl_s = ttl_s
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, version: str = "") -> Optional["TranscriptCache"]:
+        kind = os.getenv("TRANSCRIPT_CACHE_BACKEND", "memory").lower()
+        ttl_s = int(os.getenv("TRANSCRIPT_CACHE_TTL_S", 3600))
+        if kind == "off":
+            return None
+        if kind == "redis":
+            url = os.getenv("TRANSCRIPT_CACHE_REDIS_URL",
+                            os.getenv("ANSWER_CACHE_REDIS_URL", "redis://localhost:6379/0"))
+            return cls(RedisBackend(url, cls.NAMESPACE), ttl_s, version)
+        max_entries = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", 1024))
+        return cls(MemoryBackend(max_entries), ttl_s, version)
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def _key(self, digest: str) -> str:
+        return f"{self.NAMESPACE}{self.version}:{digest}"
+
+    def get(self, digest: str) -> Optional[dict]:
+        """{"text": ..., "seconds": ..., "bytes": ...} یا {"silent": True, "seconds": ...}."""
+        try:
+            raw = self.backend.get(self._key(digest))
+        except Exception as e:  # خرابی کش نباید تبدیل گفتار را متوقف کند
+            log.warning("transcript cache read failed", extra={"error": str(e)})
+            raw = None
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return json.loads(raw) if raw is not None else None
+
+    def contains(self, digest: str) -> bool:
+        """بررسی بدون شمارش hit/miss (پیش از تصمیم به رمزگشایی)؛ ممکن است تا get بعدی منقضی شود."""
+        try:
+            return self.backend.get(self._key(digest)) is not None
+        except Exception as e:
+            log.warning("transcript cache read failed", extra={"error": str(e)})
+            return False
+
+    def put(self, digest: str, entry: dict) -> None:
+        try:
+            self.backend.set(self._key(digest), json.dumps(entry, ensure_ascii=False), self.ttl_s)
+        except Exception as e:
+            log.warning("transcript cache write failed", extra={"error": str(e)})
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.backend)}
@@ -0,0 +1,292 @@
+"""
+upstream – لایهٔ مشترک فراخوانی OpenAI: اتصال‌های keep-alive، مهلت، تلاش مجدد، قطع‌کن مدار و hedging
+
+همهٔ فراخوانی‌ها روی loop مشترک aio اجرا می‌شوند و از یک aiohttp.ClientSession با
+استخر اتصال مشترک استفاده می‌کنند. خطاهای گذرا (429، 5xx، timeout، قطع اتصال) با
+backoff نمایی و jitter دوباره تلاش می‌شوند؛ اگر upstream پشت سر هم خطا بدهد مدار باز
+می‌شود و فراخوانی‌ها تا پایان زمان خنک‌شدن بلافاصله شکست می‌خورند (بدون نگه‌داشتن worker).
+برای چت (غیر استریم) می‌توان hedging را فعال کرد: اگر پاسخ از p95 تأخیر اخیر دیرتر شود،
+یک درخواست دوم موازی فرستاده می‌شود و اولین پاسخ برنده است. درخواست دوم slot جداگانه‌ای از
+سقف سراسری aio.limiter می‌گیرد؛ اگر slot آزادی نباشد (یا کسی در صف باشد) hedge انجام نمی‌شود.
+
+برای تست با سرور محلی کافی است OPENAI_API_BASE (مثلاً http://127.0.0.1:8099/v1) تنظیم شود.
+
+تنظیمات (متغیر محیطی):
+    OPENAI_API_BASE               آدرس پایهٔ API (پیش‌فرض آدرس رسمی OpenAI)
+    UPSTREAM_CONNECT_TIMEOUT_S    مهلت برقراری اتصال (پیش‌فرض 5)
+    UPSTREAM_CHAT_TIMEOUT_S       مهلت کل فراخوانی چت (پیش‌فرض 60)
+    UPSTREAM_STT_TIMEOUT_S        مهلت کل فراخوانی تبدیل گفتار (پیش‌فرض 30)
+    UPSTREAM_MAX_RETRIES          تعداد تلاش مجدد روی خطای گذرا (پیش‌فرض 2)
+    UPSTREAM_BACKOFF_BASE_S       پایهٔ backoff نمایی (پیش‌فرض 0.5)
+    UPSTREAM_BREAKER_THRESHOLD    خطای پیاپی تا باز شدن مدار (پیش‌فرض 5)
+    UPSTREAM_BREAKER_COOLDOWN_S   مدت باز ماندن مدار (پیش‌فرض 30)
+    UPSTREAM_HEDGE                1 = فعال‌سازی hedging برای چت (پیش‌فرض 0)
+    UPSTREAM_POOL_SIZE            حداکثر اتصال هم‌زمان در استخر (پیش‌فرض 100)
+"""
+import asyncio
+import atexit
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import aiohttp
+import openai
+
+from .aio import UPSTREAM_MAX_INFLIGHT, limiter
+from .metrics import registry, upstream_errors
+
+log = logging.getLogger(__name__)
+
+openai.api_key = os.getenv("OPENAI_API_KEY")
+if os.getenv("OPENAI_API_BASE"):
+    openai.api_base = os.getenv("OPENAI_API_BASE")
+
+UPSTREAM_CONNECT_TIMEOUT_S = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT_S", 5))
+UPSTREAM_CHAT_TIMEOUT_S = float(os.getenv("UPSTREAM_CHAT_TIMEOUT_S", 60))
+UPSTREAM_STT_TIMEOUT_S = float(os.getenv("UPSTREAM_STT_TIMEOUT_S", 30))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+UPSTREAM_BACKOFF_BASE_S = float(os.getenv("UPSTREAM_BACKOFF_BASE_S", 0.5))
+UPSTREAM_BACKOFF_CAP_S = 8.0
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", 5))
+UPSTREAM_BREAKER_COOLDOWN_S = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN_S", 30))
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0") == "1"
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", max(100, UPSTREAM_MAX_INFLIGHT)))
+
+HEDGE_MIN_SAMPLES = 20
+
+
+class CircuitOpenError(openai.error.ServiceUnavailableError):
+    """Raised without calling upstream while the circuit breaker is open."""
+
+
+# ───────────────────────────── connection pool
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_session() -> aiohttp.ClientSession:
+    """استخر اتصال keep-alive مشترک؛ برای هر loop (و پس از fork) یک‌بار ساخته می‌شود."""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=UPSTREAM_POOL_SIZE, keepalive_timeout=60, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+        _session_loop = loop
+    return _session
+
+
+async def warm() -> None:
+    """ساخت استخر اتصال پیش از اولین درخواست (گرم کردن worker)."""
+    _get_session()
+
+
+def shutdown() -> None:
+    """بستن استخر اتصال (هنگام خروج یا drain پردازه)."""
+    global _session
+    session, _session = _session, None
+    if session is None or session.closed or _session_loop is None or _session_loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(session.close(), _session_loop).result(timeout=2)
+    except Exception as e:
+        log.warning("could not close upstream session cleanly", extra={"error": str(e)})
+
+
+atexit.register(shutdown)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (openai.error.RateLimitError, openai.error.ServiceUnavailableError,
+                        openai.error.APIConnectionError, openai.error.Timeout, openai.error.TryAgain,
+                        asyncio.TimeoutError, aiohttp.ClientError)):
+        return True
+    if isinstance(exc, openai.error.APIError):
+        return exc.http_status is None or exc.http_status >= 500
+    return False
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(exc, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# ───────────────────────────── breaker
+class CircuitBreaker:
+    """closed → (N خطای پیاپی) → open → (پس از cooldown، یک درخواست آزمایشی) → closed."""
+
+    def __init__(self, threshold: int, cooldown_s: float):
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise CircuitOpenError("upstream circuit is open")
+        if state == "half_open":
+            self._probing = True
+
+    def abandon(self) -> None:
+        """فراخوانی بدون نتیجه لغو شد؛ اگر آزمایشی بود، درخواست بعدی آزمایش می‌کند."""
+        self._probing = False
+
+    def record(self, ok: bool) -> None:
+        self._probing = False
+        if ok:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                log.error("upstream circuit opened", extra={"consecutive_failures": self.failures})
+            self.opened_at = time.monotonic()
+
+
+# ───────────────────────────── client
+class UpstreamClient:
+    """Resilient wrapper for one kind of openai coroutine call (chat, stt)."""
+
+    def __init__(self, name: str, timeout_s: float, hedge: bool = False):
+        self.name = name
+        self.timeout_s = timeout_s
+        self.hedge = hedge
+        self.breaker = CircuitBreaker(UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_COOLDOWN_S)
+        self._latencies = deque(maxlen=200)
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "rejected_open": 0, "hedges": 0, "hedge_wins": 0,
+                      "hedges_skipped": 0}
+
+    def p95(self) -> Optional[float]:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    async def _attempt(self, fn: Callable, kwargs: dict):
+        openai.aiosession.set(_get_session())
+        started = time.monotonic()
+        result = await asyncio.wait_for(
+            fn(request_timeout=(UPSTREAM_CONNECT_TIMEOUT_S, self.timeout_s), **kwargs),
+            self.timeout_s + 1,
+        )
+        if not kwargs.get("stream"):  # برای استریم فقط زمان تا اولین بایت است، نه کل پاسخ
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, fn: Callable, kwargs: dict):
+        threshold = self.p95()
+        primary = asyncio.ensure_future(self._attempt(fn, kwargs))
+        if threshold is None:
+            return await primary
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=threshold)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        # درخواست دوم نباید از سقف سراسری فراخوانی‌های هم‌زمان بگذرد
+        if not limiter.try_slot():
+            self.stats["hedges_skipped"] += 1
+            return await primary
+        self.stats["hedges"] += 1
+        backup = asyncio.ensure_future(self._attempt(fn, kwargs))
+        # slot تا پایان واقعی درخواست دوم (حتی پس از لغو) نگه داشته می‌شود
+        backup.add_done_callback(lambda _: limiter.release())
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # درخواست بازنده (یا هر دو، اگر فراخواننده لغو شد) رها نمی‌شود
+            for task in pending:
+                task.cancel()
+
+    async def call(self, fn: Callable, **kwargs):
+        """fn(**kwargs) با مهلت، تلاش مجدد و قطع‌کن مدار؛ استریم‌ها فقط تا برقراری اتصال."""
+        self.stats["calls"] += 1
+        hedge = self.hedge and not kwargs.get("stream")
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                self.stats["rejected_open"] += 1
+                raise
+            try:
+                result = await (self._hedged(fn, kwargs) if hedge else self._attempt(fn, kwargs))
+            except Exception as exc:
+                upstream_errors.inc(client=self.name, error=type(exc).__name__)
+                retryable = _is_retryable(exc)
+                self.breaker.record(ok=not retryable)  # خطای 4xx نشانهٔ خرابی upstream نیست
+                if not retryable or attempt >= UPSTREAM_MAX_RETRIES:
+                    self.stats["failures"] += 1
+                    if isinstance(exc, asyncio.TimeoutError):
+                        raise openai.error.Timeout(f"{self.name} call exceeded {self.timeout_s}s") from exc
+                    if isinstance(exc, aiohttp.ClientError):
+                        raise openai.error.APIConnectionError(f"{self.name} connection failed: {exc}") from exc
+                    raise
+                delay = _retry_after(exc)
+                if delay is None:
+                    delay = random.uniform(0, min(UPSTREAM_BACKOFF_CAP_S, UPSTREAM_BACKOFF_BASE_S * 2 ** attempt))
+                attempt += 1
+                self.stats["retries"] += 1
+                log.warning("upstream attempt failed; retrying", extra={
+                    "client": self.name, "attempt": attempt, "error_class": type(exc).__name__,
+                    "retry_in_s": round(delay, 2)})
+                await asyncio.sleep(min(delay, UPSTREAM_BACKOFF_CAP_S))
+                continue
+            except BaseException:
+                # لغو (بازندهٔ hedge، مهلت aio.run، قطع کلاینت) نه موفقیت است نه خطا
+                self.breaker.abandon()
+                raise
+            self.breaker.record(ok=True)
+            return result
+
+
+chat = UpstreamClient("chat", UPSTREAM_CHAT_TIMEOUT_S, hedge=UPSTREAM_HEDGE)
+stt = UpstreamClient("stt", UPSTREAM_STT_TIMEOUT_S)
+
+
+def _collect_events():
+    for client in (chat, stt):
+        for event, value in client.stats.items():
+            yield "qy_upstream_events_total", {"client": client.name, "event": event}, value
+
+
+def _collect_breakers():
+    for client in (chat, stt):
+        yield "qy_upstream_circuit_open", {"client": client.name}, int(client.breaker.state != "closed")
+
+
+registry.source("qy_upstream_events_total", "counter",
+                "Upstream client events: calls, retries, failures, rejected_open, hedges, hedge_wins, hedges_skipped.", _collect_events)
+registry.source("qy_upstream_circuit_open", "gauge", "1 while the circuit breaker is open or half-open.",
+                _collect_breakers)
@@ -0,0 +1,152 @@
+"""
+serve – اجرای production: gunicorn با workerهای pre-fork (نقطهٔ ورود باینری Nuitka)
+
+    python serve.py              (یا ./serve.bin در ایمیج Docker)
+
+- برنامه یک‌بار در master بارگذاری و گرم می‌شود (import‌های سنگین، پرامپت، نمایهٔ قوانین)
+  و workerها با fork آن را به اشتراک می‌گذارند؛ هر worker پیش از پذیرش درخواست
+  اتصال upstream و استخر decode خودش را گرم می‌کند.
+- SIGTERM / SIGINT: drain — پذیرش متوقف می‌شود و درخواست‌های جاری (از جمله استریم‌ها)
+  تا SERVE_GRACEFUL_TIMEOUT_S فرصت تمام شدن دارند.
+- SIGHUP: راه‌اندازی مجدد تدریجی workerها؛ TTIN / TTOU: افزایش / کاهش تعداد workerها.
+- هر worker پس از SERVE_MAX_REQUESTS درخواست (با jitter) بازیافت می‌شود.
+
+تنظیمات (متغیر محیطی):
+    PORT                        پورت (پیش‌فرض 5000)
+    WEB_CONCURRENCY             تعداد worker (پیش‌فرض تعداد هسته‌ها)
+    SERVE_THREADS               نخ‌های هر worker برای درخواست‌های هم‌زمان و استریم‌ها
+                                (پیش‌فرض UPSTREAM_MAX_INFLIGHT + UPSTREAM_MAX_QUEUE + SERVE_SPARE_THREADS = 336)
+    SERVE_SPARE_THREADS         نخ‌های اضافه برای endpointهای بدون upstream مثل /metrics (پیش‌فرض 16)
+
+هر درخواست چت/صوت در تمام مدت فراخوانی upstream (و استریم SSE تا پایانش) یک نخ را
+نگه می‌دارد (backend.aio)؛ اگر نخ‌ها کمتر از inflight + صف باشند، صف limiter هرگز پر
+نمی‌شود و به جای 503 سریع، درخواست‌ها در backlog اتصال gunicorn منتظر می‌مانند.
+هزینهٔ هر نخ منتظر: صفحه‌های استفاده‌شدهٔ stack (حدود 50 تا 100 کیلوبایت RSS)؛
+۳۳۶ نخ ≈ ۲۰ تا ۳۵ مگابایت برای هر worker.
+    SERVE_MAX_REQUESTS          بازیافت worker پس از این تعداد درخواست؛ 0 = خاموش (پیش‌فرض 2000)
+    SERVE_MAX_REQUESTS_JITTER   بازهٔ تصادفی افزوده تا همهٔ workerها با هم بازیافت نشوند (پیش‌فرض 200)
+    SERVE_GRACEFUL_TIMEOUT_S    مهلت drain (پیش‌فرض 30)
+    SERVE_TIMEOUT_S             worker بی‌پاسخ پس از این مدت kill می‌شود (پیش‌فرض 120)
+    SERVE_KEEPALIVE_S           keep-alive اتصال‌های ورودی (پیش‌فرض 5)
+    AUDIO_DECODE_WORKERS        پیش‌فرض در این حالت: هسته‌ها ÷ تعداد workerهای وب
+"""
+import time
+
+STARTED_AT = time.time()  # پیش از هر import دیگر؛ مبدأ زمان راه‌اندازی سرد
+
+import glob  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import tempfile  # noqa: E402
+
+CPU_COUNT = os.cpu_count() or 1
+_own_metrics_dir = None  # دایرکتوری موقتی که خودمان ساخته‌ایم و هنگام خروج پاک می‌شود
+
+
+def _default_threads() -> int:
+    # همان پیش‌فرض‌های backend.aio؛ import آن پیش از تنظیم WEB_CONCURRENCY زود است
+    inflight = int(os.getenv("UPSTREAM_MAX_INFLIGHT", 64))
+    queue = int(os.getenv("UPSTREAM_MAX_QUEUE", 256))
+    return inflight + queue + int(os.getenv("SERVE_SPARE_THREADS", 16))
+
+
+def _settings() -> dict:
+    workers = int(os.getenv("WEB_CONCURRENCY", CPU_COUNT))
+    return {
+        "bind": f"0.0.0.0:{int(os.getenv('PORT', 5000))}",
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": int(os.getenv("SERVE_THREADS", _default_threads())),
+        "max_requests": int(os.getenv("SERVE_MAX_REQUESTS", 2000)),
+        "max_requests_jitter": int(os.getenv("SERVE_MAX_REQUESTS_JITTER", 200)),
+        "graceful_timeout": int(os.getenv("SERVE_GRACEFUL_TIMEOUT_S", 30)),
+        "timeout": int(os.getenv("SERVE_TIMEOUT_S", 120)),
+        "keepalive": int(os.getenv("SERVE_KEEPALIVE_S", 5)),
+        "preload_app": True,
+        "accesslog": None,  # شمارش درخواست‌ها در /metrics است؛ لاگ دسترسی هزینهٔ اضافه دارد
+        "post_worker_init": _post_worker_init,
+        "worker_exit": _worker_exit,
+        "child_exit": _child_exit,
+        "on_exit": _on_exit,
+    }
+
+
+# ───────────────────────────── gunicorn hooks
+def _post_worker_init(worker) -> None:
+    from app import init_sentry
+    from backend import startup
+    from backend.metrics import registry
+
+    forked_at = time.time()
+    init_sentry()
+    startup.warm_worker(forked_at)
+    registry.start_flusher(os.environ["METRICS_DIR"])
+
+
+def _worker_exit(server, worker) -> None:
+    """drain: منابع پردازه بسته و آخرین وضعیت متریک‌ها نوشته می‌شود."""
+    from backend import upstream
+    from backend.decode_pool import pool
+    from backend.metrics import registry
+
+    upstream.shutdown()
+    pool.shutdown()
+    try:
+        registry.flush(os.environ["METRICS_DIR"])
+    except OSError:
+        pass
+
+
+def _child_exit(server, worker) -> None:
+    from backend.metrics import Registry
+    Registry.mark_process_dead(os.environ["METRICS_DIR"], worker.pid)
+
+
+def _on_exit(server) -> None:
+    if _own_metrics_dir:
+        shutil.rmtree(_own_metrics_dir, ignore_errors=True)
+
+
+# ───────────────────────────── main
+def main() -> None:
+    from gunicorn.app.base import BaseApplication
+
+    settings = _settings()
+    # سقف‌های tenant برای کل سرویس‌اند و هر worker سهم خودش را اعمال می‌کند (backend.tenants)
+    os.environ.setdefault("WEB_CONCURRENCY", str(settings["workers"]))
+    # هر worker وب استخر decode خودش را دارد؛ مجموع پردازه‌ها از تعداد هسته‌ها بیشتر نشود
+    os.environ.setdefault("AUDIO_DECODE_WORKERS", str(max(1, CPU_COUNT // settings["workers"])))
+    global _own_metrics_dir
+    if not os.getenv("METRICS_DIR"):
+        _own_metrics_dir = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="qy-metrics-")
+    metrics_dir = os.environ["METRICS_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(metrics_dir, "*.json")):  # وضعیت اجرای قبلی شمرده نشود
+        os.unlink(stale)
+
+    from app import create_app
+    from backend import startup
+    from backend.aio import UPSTREAM_MAX_INFLIGHT, UPSTREAM_MAX_QUEUE
+
+    if settings["threads"] < UPSTREAM_MAX_INFLIGHT + UPSTREAM_MAX_QUEUE:
+        logging.getLogger(__name__).warning(
+            "SERVE_THREADS below upstream inflight + queue; excess requests wait in the accept backlog, not 503",
+            extra={"threads": settings["threads"], "inflight": UPSTREAM_MAX_INFLIGHT, "queue": UPSTREAM_MAX_QUEUE})
+
+    application = create_app(with_sentry=False)
+    startup.warm_shared(STARTED_AT)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    Server().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import fake_openai  # noqa: E402
+
+# upstream در تست‌ها سرور محلی fake_openai است؛ پیش از import شدن backend تنظیم می‌شود
+FAKE = fake_openai.FakeConfig(chat_latency="fixed:0.05", stt_latency="fixed:0.05", token_delay_s=0.0)
+_server = fake_openai.serve(FAKE, "127.0.0.1", 0)
+
+_workdir = tempfile.mkdtemp(prefix="qy-tests-")
+TENANTS_PATH = os.path.join(_workdir, "tenants.json")
+TENANTS = {
+    "defaults": {"requests_per_min": 6000, "burst": 1000, "tokens_per_min": 10 ** 8, "token_burst": 10 ** 7,
+                 "max_queued": 256},
+    "anonymous": {"requests_per_min": 6000, "burst": 1000},
+    "tenants": {"a.test": {}, "b.test": {}, "tight.test": {"requests_per_min": 6, "burst": 2}},
+}
+with open(TENANTS_PATH, "w") as fh:
+    json.dump(TENANTS, fh)
+
+os.environ.update(
+    OPENAI_API_BASE=f"http://127.0.0.1:{_server.server_port}/v1",
+    OPENAI_API_KEY="sk-test",
+    SENTRY_DSN="",  # بدون گزارش به Sentry
+    LOG_FORMAT="text",
+    LOG_LEVEL="WARNING",
+    ANSWER_CACHE_BACKEND="off",
+    TENANTS_CONFIG=TENANTS_PATH,
+    BATCH_DIR=os.path.join(_workdir, "batches"),
+)
+
+
+@pytest.fixture
+def fake_upstream():
+    FAKE.error_rate = 0.0
+    return FAKE
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import create_app
+    return create_app(with_sentry=False)
+
+
+@pytest.fixture
+def client(app, fake_upstream):
+    return app.test_client()
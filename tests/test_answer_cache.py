@@ -0,0 +1,92 @@
+import pytest
+
+from backend import answer_cache
+from backend.answer_cache import AnswerCache, MemoryBackend
+from backend.normalize import normalize_text
+
+
+@pytest.mark.parametrize("variant", [
+    "مهریه چیست؟",
+    "مهريه چيست",          # ی عربی
+    "مَهریه   چیست ؟!",     # اعراب، فاصلهٔ اضافه، علائم
+    "«مهریه» چیست.",
+])
+def test_spelling_variants_normalize_to_one_form(variant):
+    assert normalize_text(variant) == "مهریه چیست"
+
+
+def test_normalization_of_digits_zwnj_and_arabic_kaf():
+    assert normalize_text("ماده ۱۲۳ قانون مدنی") == "ماده 123 قانون مدنی"
+    assert normalize_text("ماده ١٢ كار") == "ماده 12 کار"
+    assert normalize_text("می‌توانم") == "می توانم"
+    assert normalize_text("  ?!  ") == ""
+
+
+def test_variants_share_one_cache_entry():
+    cache = AnswerCache(MemoryBackend(), ttl_s=60)
+    cache.put("مهریه چیست؟", "fp", "پاسخ")
+    assert cache.get("مهريه  چيست", "fp") == "پاسخ"
+    assert cache.get("نفقه چیست", "fp") is None
+    assert cache.get("؟", "fp") is None  # پرسش تهی کلید ندارد
+    assert cache.stats() == {"hits": 1, "misses": 2, "size": 1}
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", "1", 60)
+    backend.set("b", "2", 60)
+    assert backend.get("a") == "1"  # a تازه‌تر از b می‌شود
+    backend.set("c", "3", 60)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == ("1", None, "3")
+    assert len(backend) == 2
+
+
+def test_memory_backend_expires_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    backend = MemoryBackend()
+    backend.set("k", "v", ttl_s=10)
+    now[0] += 9.9
+    assert backend.get("k") == "v"
+    now[0] += 0.2
+    assert backend.get("k") is None and len(backend) == 0
+
+
+def test_prompt_change_purges_previous_answers():
+    backend = MemoryBackend()
+    cache = AnswerCache(backend, ttl_s=60)
+    cache.get("مهریه", "v1")
+    cache.put("مهریه", "v1", "پاسخ قدیم")
+    cache.put("نفقه", "v1", "پاسخ قدیم")
+    assert cache.get("مهریه", "v2") is None
+    assert len(backend) == 0
+
+
+def test_rolling_deploy_workers_do_not_purge_each_other():
+    shared = MemoryBackend()  # مثل redis مشترک بین workerها
+    old, new = AnswerCache(shared, 60), AnswerCache(shared, 60)
+    old.get("مهریه", "v1")
+    old.put("مهریه", "v1", "پاسخ قدیم")
+
+    new.get("مهریه", "v2")  # نسخهٔ جدید یک بار پاسخ‌های v1 را پاک می‌کند
+    new.put("مهریه", "v2", "پاسخ جدید")
+    assert len(shared) == 1 and old.get("مهریه", "v1") is None
+
+    # worker قدیمی در حال خاموش شدن و worker قدیمیِ تازه‌راه‌اندازی‌شده پاسخ‌های v2 را پاک نمی‌کنند
+    old.put("نفقه", "v1", "پاسخ قدیم")
+    restarted_old = AnswerCache(shared, 60)
+    restarted_old.get("نفقه", "v1")
+    assert new.get("مهریه", "v2") == "پاسخ جدید"
+    # و v1 هم دوباره پاک نمی‌شود
+    another_new = AnswerCache(shared, 60)
+    another_new.get("مهریه", "v2")
+    assert old.get("نفقه", "v1") == "پاسخ قدیم"
+
+
+def test_full_purge_keeps_the_fingerprint_registry():
+    backend = MemoryBackend()
+    cache = AnswerCache(backend, 60)
+    cache.get("مهریه", "v1")
+    cache.put("مهریه", "v1", "پاسخ")
+    assert cache.purge() == 1
+    assert backend.register(AnswerCache.FINGERPRINTS, "v1").keys() == {"v1"}
@@ -0,0 +1,171 @@
+import io
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from backend import audio_codec, audio_handler
+from backend.decode_pool import DecodePool, DecodePoolBusy
+from backend.transcript_cache import TranscriptCache
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+
+
+def _ffmpeg(*args) -> bytes:
+    return subprocess.run(["ffmpeg", "-v", "error", *args], check=True, capture_output=True).stdout
+
+
+@pytest.fixture(scope="module")
+def moov_at_end(tmp_path_factory) -> bytes:
+    # خروجی پیش‌فرض muxer mp4 (بدون +faststart) اطلاعات moov را در انتها می‌نویسد، مثل پیام صوتی iOS
+    path = tmp_path_factory.mktemp("audio") / "voice.m4a"
+    _ffmpeg("-f", "lavfi", "-i", "sine=f=300:d=25", "-c:a", "aac", "-b:a", "128k", str(path))
+    return path.read_bytes()
+
+
+def test_m4a_with_trailing_moov_is_not_decodable_from_pipe(moov_at_end):
+    proc = subprocess.run(["ffmpeg", "-v", "error", "-i", "pipe:0", "-f", "s16le", "pipe:1"],
+                          input=moov_at_end, capture_output=True)
+    assert proc.returncode != 0 or not proc.stdout
+
+
+@pytest.mark.parametrize("filename", ["voice.m4a", "upload.bin"])
+def test_decode_uses_seekable_input(moov_at_end, filename):
+    audio = audio_codec._decode(moov_at_end, filename)
+    assert audio.duration_seconds == pytest.approx(25, abs=0.1)
+    assert audio.frame_rate == audio_codec.STT_SAMPLE_RATE and audio.channels == 1
+
+
+def _wav(seconds: float) -> bytes:
+    return _ffmpeg("-f", "lavfi", "-i", f"sine=f=300:d={seconds}", "-f", "wav", "pipe:1")
+
+
+def _chunks(data: bytes, size: int = 16 * 1024, delay_s: float = 0.0):
+    for start in range(0, len(data), size):
+        if delay_s:
+            time.sleep(delay_s)
+        yield data[start:start + size]
+
+
+def test_decode_stream_returns_audio_digest_and_size():
+    data = _wav(2)
+    audio, digest, received = audio_handler.decode_stream(_chunks(data), "s.wav")
+    assert audio.duration_seconds == pytest.approx(2, abs=0.05)
+    assert digest == TranscriptCache.digest(data) and received == len(data)
+
+
+def test_decode_stream_enforces_overall_deadline():
+    started = time.monotonic()
+    with pytest.raises(audio_handler.StreamDeadlineError):
+        audio_handler.decode_stream(_chunks(_wav(2), size=4096, delay_s=0.2), "slow.wav",
+                                    deadline=time.monotonic() + 0.5)
+    assert time.monotonic() - started < 2
+
+
+def test_decode_stream_counts_against_decode_pool(monkeypatch):
+    pool = DecodePool(workers=1, max_pending=1)
+    monkeypatch.setattr(audio_handler, "decode_pool", pool)
+    with pool.reserve():
+        with pytest.raises(DecodePoolBusy):
+            audio_handler.decode_stream(_chunks(_wav(1)), "s.wav")
+    audio_handler.decode_stream(_chunks(_wav(1)), "s.wav")
+    assert pool.snapshot()["pending"] == 0
+
+
+# ───────────────────────────── VAD
+def _tone(ms: int):
+    from pydub.generators import Sine
+    return Sine(300).to_audio_segment(duration=ms, volume=-12)
+
+
+def _silence(ms: int):
+    from pydub import AudioSegment
+    return AudioSegment.silent(duration=ms, frame_rate=audio_codec.STT_SAMPLE_RATE)
+
+
+def test_vad_trims_edges_and_long_pauses():
+    clip = _silence(1500) + _tone(1000) + _silence(3000) + _tone(1000) + _silence(1500)
+    voiced = audio_codec._trim_silence(clip, "q.wav")
+    pad = audio_codec.VAD_PAD_MS / 1000
+    # دو بخش گفتار، هر کدام با حاشیهٔ pad در دو طرف
+    assert voiced.duration_seconds == pytest.approx(2 + 4 * pad, abs=0.1)
+    assert voiced.frame_rate == audio_codec.STT_SAMPLE_RATE
+
+
+def test_vad_rejects_silent_clip():
+    with pytest.raises(audio_codec.SilentAudioError) as silent:
+        audio_codec._trim_silence(_silence(2000) + _tone(100) + _silence(2000), "empty.wav")
+    assert silent.value.duration_s == pytest.approx(4.1, abs=0.05)
+    assert "empty.wav" in str(silent.value)
+
+
+def _wav_of(segment) -> bytes:
+    buffer = io.BytesIO()
+    segment.export(buffer, format="wav")
+    return buffer.getvalue()
+
+
+def test_silent_upload_is_rejected_without_stt_call(client, fake_upstream):
+    before = fake_upstream.counts["stt"]
+    data = _wav_of(_silence(3000))
+    for _ in range(2):  # دومی از کش متن («بی‌صدا»)
+        resp = client.post("/chatbot/audio", data={"audio": (io.BytesIO(data), "silent.wav")})
+        assert resp.status_code == 400 and "silent.wav" in resp.json["error"]
+    assert fake_upstream.counts["stt"] == before
+
+
+# ───────────────────────────── streaming retries
+def _stream(client, data: bytes, digest: str = None):
+    headers = {"X-Filename": "retry.wav", "X-Domain": "a.test"}
+    if digest:
+        headers["X-Audio-SHA256"] = digest
+    resp = client.post("/chatbot/audio/stream", data=data, headers=headers)
+    body = resp.get_data(as_text=True)
+    assert resp.status_code == 200, body
+    assert "event: transcript" in body
+    return body
+
+
+def test_stream_retry_with_digest_skips_decoding(client, fake_upstream, monkeypatch):
+    data = _wav_of(_tone(1500))
+    digest = TranscriptCache.digest(data)
+    _stream(client, data)
+    calls = fake_upstream.counts["stt"]
+
+    def no_decoding(*args, **kwargs):
+        raise AssertionError("retry of a cached upload was decoded")
+
+    monkeypatch.setattr(audio_handler, "StreamingDecoder", no_decoding)
+    monkeypatch.setattr(audio_handler.decode_pool, "run", no_decoding)
+    _stream(client, data, digest)
+    assert fake_upstream.counts["stt"] == calls
+
+
+def test_stream_with_wrong_digest_decodes_the_buffered_body(client, fake_upstream, monkeypatch):
+    cached = _wav_of(_tone(1200))
+    _stream(client, cached)
+    other = _wav_of(_tone(1700))
+    calls = fake_upstream.counts["stt"]
+
+    def no_streaming_decoder(*args, **kwargs):
+        raise AssertionError("body should be buffered, not decoded while uploading")
+
+    monkeypatch.setattr(audio_handler, "StreamingDecoder", no_streaming_decoder)
+    _stream(client, other, TranscriptCache.digest(cached))
+    assert fake_upstream.counts["stt"] == calls + 1
+
+
+def test_oversize_uploads_are_rejected_before_buffering(client):
+    from app import MAX_REQUEST_BYTES
+
+    body = b"\0" * (MAX_REQUEST_BYTES + 1)
+    resp = client.post("/chatbot/audio", data={"audio": (io.BytesIO(body), "big.wav")})
+    assert resp.status_code == 413 and "کیلوبایت" in resp.json["error"]
+
+    resp = client.post("/chatbot/audio/stream", data=body, headers={"X-Filename": "big.wav"})
+    assert resp.status_code == 413 and resp.json["error"]
+
+    resp = client.post("/chatbot/responses", data=body, content_type="application/json",
+                       headers={"X-Domain": "a.test"})
+    assert resp.status_code == 413 and resp.json["error"]
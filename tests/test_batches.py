@@ -0,0 +1,96 @@
+import json
+
+from backend import batches, tenants
+from backend.aio import RateLimited
+
+
+def _lines(resp):
+    assert resp.status_code == 200, resp.get_data(as_text=True)
+    return [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+
+
+def _create(client, batch_id, questions, domain="a.test"):
+    return client.post("/chatbot/batch", json={"batch_id": batch_id, "questions": questions, "concurrency": 2},
+                       headers={"X-Domain": domain})
+
+
+QUESTIONS = ["مهریه چیست", "نفقه چیست", {"id": "q3", "question": "حضانت با کیست"}, ""]
+
+
+def test_batch_streams_every_item_then_done(client):
+    lines = _lines(_create(client, "full-run", QUESTIONS))
+    assert lines[0] == {"type": "batch", "batch_id": "full-run", "total": 4, "after": 0}
+    results, done = lines[1:-1], lines[-1]
+    assert sorted(line["index"] for line in results) == [0, 1, 2, 3]
+    assert {line["id"] for line in results} == {0, 1, "q3", 3}
+    empty = next(line for line in results if line["index"] == 3)
+    assert empty["type"] == "error" and empty["status"] == 400
+    assert done["type"] == "done" and (done["succeeded"], done["failed"]) == (3, 1)
+    assert "error" not in done
+
+
+def test_resume_by_batch_id_with_after_offset(client):
+    full = _lines(_create(client, "resume-me", QUESTIONS[:3]))[1:]
+
+    resumed = _lines(client.get("/chatbot/batch/resume-me?after=2", headers={"X-Domain": "a.test"}))
+    assert resumed[0]["after"] == 2
+    assert resumed[1:] == full[2:]
+
+    # POST دوباره با همان batch_id همان دسته است؛ پرسش‌های جدید نادیده گرفته می‌شوند
+    again = _lines(_create(client, "resume-me", ["پرسش دیگر"]))
+    assert again[0]["total"] == 3 and again[1:] == full
+
+    everything = _lines(client.get("/chatbot/batch/resume-me?after=99", headers={"X-Domain": "a.test"}))
+    assert len(everything) == 1
+
+
+def test_batch_of_another_tenant_is_not_found(client):
+    _lines(_create(client, "private-batch", QUESTIONS[:1]))
+    assert client.get("/chatbot/batch/private-batch", headers={"X-Domain": "b.test"}).status_code == 404
+    assert _create(client, "private-batch", QUESTIONS[:1], domain="b.test").status_code == 404
+    assert client.get("/chatbot/batch/no-such-batch", headers={"X-Domain": "a.test"}).status_code == 404
+    assert _create(client, "bad id!", QUESTIONS[:1]).status_code == 400
+
+
+def test_runner_failure_writes_a_terminal_done_line(client, monkeypatch):
+    calls = []
+    answer = batches._answer
+
+    async def flaky(item):
+        calls.append(item["index"])
+        if item["index"] == 1:
+            raise OSError("disk full")
+        return await answer(item)
+
+    monkeypatch.setattr(batches, "_answer", flaky)
+    lines = _lines(_create(client, "broken-run", QUESTIONS[:3]))
+    done = lines[-1]
+    assert done["type"] == "done" and done["status"] == 500 and "disk full" in done["error"]
+    assert done["succeeded"] == 2
+    assert sorted(calls) == [0, 1, 2]
+
+    # دستهٔ پایان‌یافته دوباره اجرا نمی‌شود
+    resumed = _lines(client.get("/chatbot/batch/broken-run", headers={"X-Domain": "a.test"}))
+    assert resumed[-1] == done
+    assert sorted(calls) == [0, 1, 2]
+
+
+def test_every_item_is_admitted_against_the_tenant_quota(client, monkeypatch):
+    tenant = tenants.registry.resolve("a.test")
+    admitted = []
+
+    def admit():
+        admitted.append(1)
+        if len(admitted) > 2:  # خود درخواست دسته + یک پرسش
+            raise RateLimited(retry_after=1)
+
+    charged = []
+    monkeypatch.setattr(tenant, "admit", admit)
+    monkeypatch.setattr(tenant, "charge_tokens", charged.append)
+    monkeypatch.setattr(batches, "BATCH_MAX_RETRIES", 0)
+    lines = _lines(_create(client, "quota-run", QUESTIONS))
+    results = lines[1:-1]
+    assert len(admitted) == 4  # پرسش خالی بدون فراخوانی رد می‌شود
+    assert len(charged) == 1 and charged[0] > 0  # توکن پرسش پذیرفته‌شده هم (در Core) کسر می‌شود
+    assert sorted(line.get("status", 200) for line in results) == [200, 400, 429, 429]
+    assert (lines[-1]["succeeded"], lines[-1]["failed"]) == (1, 3)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from backend.decode_pool import DecodePool, DecodePoolBusy
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def pool():
+    pool = DecodePool(workers=1, max_pending=2)
+    yield pool
+    pool.shutdown()
+
+
+def _settle(pool, pending=0, within=5.0):
+    deadline = time.monotonic() + within
+    while pool.snapshot()["pending"] != pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return pool.snapshot()["pending"]
+
+
+def test_runaway_job_is_killed_and_pool_recycled(pool):
+    _run(pool.warm())
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        _run(pool.run(time.sleep, 30, timeout=0.5))
+    assert _settle(pool) == 0
+    # worker گیرکرده کشته شده؛ کار بعدی منتظر پایان sleep(30) نمی‌ماند
+    assert _run(pool.run(sum, [1, 2, 3], timeout=30)) == 6
+    assert time.monotonic() - started < 20
+    assert pool.snapshot()["recycles"] == 1
+
+
+def test_timed_out_job_stays_counted_until_it_finishes(pool):
+    async def scenario():
+        stuck = asyncio.ensure_future(pool.run(time.sleep, 30, timeout=0.5))
+        await asyncio.sleep(0.1)
+        queued = asyncio.ensure_future(pool.run(time.sleep, 0, timeout=0.2))
+        await asyncio.sleep(0.05)
+        # سقف پر است (یکی در حال اجرا، یکی در صف)
+        with pytest.raises(DecodePoolBusy):
+            await pool.run(time.sleep, 0, timeout=1)
+        for job in (stuck, queued):
+            with pytest.raises(asyncio.TimeoutError):
+                await job
+
+    _run(scenario())
+    assert _settle(pool) == 0
+
+
+def test_collateral_job_is_retried_on_fresh_pool():
+    pool = DecodePool(workers=2, max_pending=4)
+    try:
+        async def scenario():
+            await pool.warm()
+            stuck = asyncio.ensure_future(pool.run(time.sleep, 30, timeout=0.5))
+            healthy = asyncio.ensure_future(pool.run(_sleep_then, 1.0, "ok", timeout=20))
+            with pytest.raises(asyncio.TimeoutError):
+                await stuck
+            return await healthy
+
+        assert _run(scenario()) == "ok"
+        assert pool.snapshot()["errors"] == 0
+    finally:
+        pool.shutdown()
+
+
+def _sleep_then(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def _spawn_child(pidfile):
+    child = subprocess.Popen(["sleep", "30"])
+    with open(pidfile, "w") as fh:
+        fh.write(str(child.pid))
+    child.wait()
+
+
+def _alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as fh:
+            return fh.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_recycle_also_kills_the_workers_children(pool, tmp_path):
+    pidfile = str(tmp_path / "child.pid")
+    with pytest.raises(asyncio.TimeoutError):
+        _run(pool.run(_spawn_child, pidfile, timeout=1.0))
+    pid = int(open(pidfile).read())
+    deadline = time.monotonic() + 5
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not _alive(pid)
+
+
+def _heavy_modules():
+    return sorted(name for name in ("backend.core", "backend.statutes", "backend.answer_cache", "openai")
+                  if name in sys.modules)
+
+
+def test_workers_do_not_build_the_web_app(pool):
+    assert _run(pool.run(_heavy_modules, timeout=30)) == []
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from backend import metrics
+from backend.metrics import Registry
+
+
+def _build(requests, latency, queue_depth):
+    registry = Registry()
+    counter = registry.counter("qy_test_requests_total", "Requests.")
+    histogram = registry.histogram("qy_test_seconds", "Latency.", buckets=(0.1, 1.0))
+    counter.inc(requests, endpoint="/chat")
+    histogram.observe(latency, stage="llm")
+    registry.source("qy_test_events_total", "counter", "Events.", lambda: [("qy_test_events_total", {}, requests)])
+    registry.source("qy_test_queue", "gauge", "Queue depth.", lambda: [("qy_test_queue", {}, queue_depth)])
+    return registry
+
+
+def _samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_render_prometheus_text(monkeypatch):
+    monkeypatch.delenv("METRICS_DIR", raising=False)
+    registry = _build(3, 0.5, 7)
+    registry.source("qy_test_label", "gauge", "Escaping.", lambda: [("qy_test_label", {"v": 'a"b\\c\nd'}, 1.5)])
+    text = registry.render()
+
+    assert "# HELP qy_test_requests_total Requests.\n# TYPE qy_test_requests_total counter\n" in text
+    assert "# TYPE qy_test_seconds histogram" in text and "# TYPE qy_test_queue gauge" in text
+    assert _samples(text) == {
+        'qy_test_requests_total{endpoint="/chat"}': "3",
+        'qy_test_seconds_bucket{stage="llm",le="0.1"}': "0",
+        'qy_test_seconds_bucket{stage="llm",le="1"}': "1",
+        'qy_test_seconds_bucket{stage="llm",le="+Inf"}': "1",
+        'qy_test_seconds_sum{stage="llm"}': "0.5",
+        'qy_test_seconds_count{stage="llm"}': "1",
+        "qy_test_events_total": "3",
+        "qy_test_queue": "7",
+        'qy_test_label{v="a\\"b\\\\c\\nd"}': "1.5",
+    }
+
+
+def test_workers_are_merged_and_dead_workers_archived(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path))
+    me, other = _build(3, 0.5, 7), _build(2, 5.0, 4)
+    metrics._write(str(tmp_path / "4242.json"), other.snapshot())
+    pid = os.getpid()
+
+    merged = _samples(me.render())
+    # شمارنده‌ها و هیستوگرام‌ها جمع می‌شوند
+    assert merged['qy_test_requests_total{endpoint="/chat"}'] == "5"
+    assert merged["qy_test_events_total"] == "5"
+    assert merged['qy_test_seconds_bucket{stage="llm",le="1"}'] == "1"
+    assert merged['qy_test_seconds_bucket{stage="llm",le="+Inf"}'] == "2"
+    assert merged['qy_test_seconds_sum{stage="llm"}'] == "5.5"
+    # gaugeها جمع نمی‌شوند؛ هر worker با برچسب pid
+    assert merged['qy_test_queue{pid="4242"}'] == "4"
+    assert merged[f'qy_test_queue{{pid="{pid}"}}'] == "7"
+
+    Registry.mark_process_dead(str(tmp_path), 4242)
+    assert not (tmp_path / "4242.json").exists()
+    after = _samples(me.render())
+    # شمارنده‌های worker مرده از archive می‌آیند و کم نمی‌شوند؛ gaugeش حذف شده است
+    assert after['qy_test_requests_total{endpoint="/chat"}'] == "5"
+    assert after["qy_test_events_total"] == "5"
+    assert after['qy_test_seconds_count{stage="llm"}'] == "2"
+    assert [key for key in after if key.startswith("qy_test_queue")] == [f'qy_test_queue{{pid="{pid}"}}']
+
+
+def test_unreadable_worker_file_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path))
+    (tmp_path / "777.json").write_text("{truncated")
+    assert _samples(_build(1, 0.05, 0).render())['qy_test_requests_total{endpoint="/chat"}'] == "1"
+
+
+@pytest.mark.parametrize("value, text", [(3.0, "3"), (0.25, "0.25"), (float("inf"), "+Inf")])
+def test_value_formatting(value, text):
+    assert metrics._format_value(value) == text
@@ -0,0 +1,55 @@
+import pytest
+
+from backend.routing import CANNED, FAST, FULL, Router
+
+
+@pytest.fixture
+def router():
+    return Router("gpt-4o", "gpt-4o-mini")
+
+
+@pytest.mark.parametrize("question", [
+    "تو کی هستی؟", "شما کیستید", "سلام، تو کی هستی؟", "اسمت چیه؟", "اسم شما چیست",
+    "چه کسی تو را ساخته است؟", "کی شما رو ساخته", "تو رو کی ساخته", "دانوش کیه", "Who are you?",
+])
+def test_identity_questions_get_the_canned_answer(router, question):
+    route = router.route(question)
+    assert (route.tier, route.intent) == (CANNED, "identity")
+    assert route.answer and route.model is None
+
+
+@pytest.mark.parametrize("question", [
+    "این سند جعلی را کی ساخته؟",
+    "وکیل تعیینی شما کیه",
+    "اسم چیست در قانون",
+    "قرارداد را کی ساخته",
+    "شما کی هستید که حکم صادر می‌کنید",
+    "کی ساخته",
+    "اسم چیست",
+])
+def test_legal_or_partial_identity_lookalikes_go_to_the_full_model(router, question):
+    route = router.route(question)
+    assert route.tier == FULL and route.answer is None
+
+
+def test_greeting_is_canned(router):
+    assert router.route("سلام، خسته نباشید").intent == "greeting"
+
+
+@pytest.mark.parametrize("question", ["مهریه چیست؟", "منظور از عقد موقت چیست"])
+def test_short_definitions_use_the_fast_model(router, question):
+    assert router.route(question).tier == FAST
+
+
+@pytest.mark.parametrize("question", [
+    "اگر شوهرم نفقه ندهد چه کنم؟", "مجازات کلاهبرداری چیست؟", "شرایط طلاق توافقی چیست",
+])
+def test_scenarios_and_rulings_use_the_full_model(router, question):
+    assert router.route(question).tier == FULL
+
+
+def test_follow_ups_and_disabled_canned_answers_use_the_full_model():
+    router = Router("gpt-4o", "gpt-4o-mini", canned=False)
+    assert router.route("تو کی هستی؟").tier == FULL
+    history = [{"role": "user", "content": "مهریه"}, {"role": "assistant", "content": "..."}]
+    assert Router("gpt-4o", "gpt-4o-mini").route("مهریه چیست؟", history).intent == "follow_up"
@@ -0,0 +1,63 @@
+import io
+import shutil
+import subprocess
+
+import pytest
+
+from backend import session_store, statutes
+
+
+def _ask(client, domain, session_id, question="حضانت فرزند با کیست"):
+    resp = client.post("/chatbot/responses", json={"question": question, "session_id": session_id},
+                       headers={"X-Domain": domain})
+    assert resp.status_code == 200, resp.json
+    return resp.json
+
+
+def test_history_is_kept_per_session(client):
+    first = _ask(client, "a.test", "s-own")
+    second = _ask(client, "a.test", "s-own", "نفقه چطور؟")
+    assert second["prompt_tokens"] > first["prompt_tokens"]
+    assert second["session_id"] == "s-own"
+
+
+def test_same_session_id_is_isolated_between_tenants(client):
+    baseline = _ask(client, "b.test", "s-fresh", "نفقه چطور؟")["prompt_tokens"]
+    _ask(client, "a.test", "s-shared")
+    # دامنهٔ دیگر با همان شناسه تاریخچهٔ a.test را نمی‌بیند
+    assert _ask(client, "b.test", "s-shared", "نفقه چطور؟")["prompt_tokens"] == baseline
+
+
+def test_statute_retrieval_runs_once_and_only_on_the_model_path(client, monkeypatch):
+    calls = []
+    retrieve = statutes.relevant_articles
+    monkeypatch.setattr(statutes, "relevant_articles", lambda question: calls.append(question) or retrieve(question))
+    assert _ask(client, "a.test", "s-canned", "سلام، خسته نباشید")["prompt_tokens"] > 0
+    assert calls == []
+    _ask(client, "a.test", "s-model", "اگر همسرم نفقه ندهد چه کنم؟")
+    assert calls == ["اگر همسرم نفقه ندهد چه کنم؟"]
+
+
+@pytest.mark.parametrize("path", ["/chatbot/responses", "/chatbot/responses?stream=1"])
+def test_session_store_failure_returns_json_error(client, monkeypatch, path):
+    def broken(*args):
+        raise RuntimeError("store down")
+
+    monkeypatch.setattr(session_store, "history_for", broken)
+    resp = client.post(path, json={"question": "مهریه", "session_id": "s1"}, headers={"X-Domain": "a.test"})
+    assert resp.status_code == 500
+    assert "store down" in resp.json["error"]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+def test_audio_session_store_failure_returns_json_error(client, monkeypatch):
+    wav = subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=f=300:d=1", "-f", "wav", "pipe:1"],
+                         check=True, capture_output=True).stdout
+
+    def broken(*args):
+        raise RuntimeError("store down")
+
+    monkeypatch.setattr(session_store, "history_for", broken)
+    resp = client.post("/chatbot/audio", data={"audio": (io.BytesIO(wav), "q.wav"), "session_id": "s1"})
+    assert resp.status_code == 500
+    assert "store down" in resp.json["error"]
@@ -0,0 +1,76 @@
+import json
+
+from backend import bot
+from backend.aio import UpstreamBusy
+from backend.core import FALLBACK_UPSTREAM, ChatStreamError
+
+# پرسش موردی → همیشه مدل کامل (بدون fallback مدل سریع)
+QUESTION = "اگر همسرم نفقه ندهد چه کنم؟"
+
+
+def _events(resp):
+    assert resp.mimetype == "text/event-stream"
+    events = []
+    for block in resp.get_data(as_text=True).split("\n\n"):
+        if block.strip():
+            name, data = block.split("\n", 1)
+            events.append((name.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def _stream(client, question=QUESTION, **extra):
+    return client.post("/chatbot/responses?stream=1", json={"question": question, **extra},
+                       headers={"X-Domain": "a.test"})
+
+
+def test_stream_sends_deltas_then_done(client, fake_upstream):
+    resp = _stream(client, session_id="sse-1")
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "no-cache" and resp.headers["X-Accel-Buffering"] == "no"
+    events = _events(resp)
+    names = [name for name, _ in events]
+    assert set(names[:-1]) == {"delta"} and names[-1] == "done"
+    assert "".join(data["delta"] for name, data in events[:-1]) == fake_upstream.answer
+    done = events[-1][1]
+    assert done["session_id"] == "sse-1" and done["prompt_tokens"] > 0
+
+
+def test_accept_header_selects_streaming(client):
+    resp = client.post("/chatbot/responses", json={"question": QUESTION},
+                       headers={"X-Domain": "a.test", "Accept": "text/event-stream"})
+    assert _events(resp)[-1][0] == "done"
+
+
+def test_upstream_failure_becomes_an_error_event_not_a_fallback_delta(client, fake_upstream, monkeypatch):
+    # 400 تکرار نمی‌شود و breaker را باز نمی‌کند
+    monkeypatch.setattr(fake_upstream, "error_codes", [400])
+    monkeypatch.setattr(fake_upstream, "error_rate", 1.0)
+    resp = _stream(client, session_id="sse-fail")
+    assert resp.status_code == 200
+    assert _events(resp) == [("error", {"error": FALLBACK_UPSTREAM})]
+
+    # پاسخ ناموفق در تاریخچهٔ جلسه ذخیره نشده است
+    monkeypatch.setattr(fake_upstream, "error_rate", 0.0)
+    first = _events(_stream(client, session_id="sse-fresh"))[-1][1]["prompt_tokens"]
+    assert _events(_stream(client, session_id="sse-fail"))[-1][1]["prompt_tokens"] == first
+
+
+def test_errors_before_the_first_delta_keep_their_http_status(client, monkeypatch):
+    def busy(question, history):
+        raise UpstreamBusy(retry_after=7)
+        yield  # generator
+
+    monkeypatch.setattr(bot, "stream_chat_with_gpt", busy)
+    resp = _stream(client)
+    assert resp.status_code == 503 and resp.headers["Retry-After"] == "7"
+    assert resp.json["error"]
+
+
+def test_failure_after_the_first_delta_ends_with_an_error_event(client, monkeypatch):
+    def broken(question, history):
+        yield "بخش اول"
+        raise ChatStreamError(FALLBACK_UPSTREAM)
+
+    monkeypatch.setattr(bot, "stream_chat_with_gpt", broken)
+    events = _events(_stream(client))
+    assert events == [("delta", {"delta": "بخش اول"}), ("error", {"error": FALLBACK_UPSTREAM})]
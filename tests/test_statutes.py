@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from backend import statutes
+
+CORPUS = [
+    {"law": "قانون مدنی", "article": "190", "text": "برای صحت هر معامله شرایط ذیل اساسی است: قصد طرفین و رضای آن‌ها"},
+    {"law": "قانون مدنی", "article": "1082", "text": "به مجرد عقد، زن مالک مهر می‌شود و می‌تواند هر نوع تصرفی که بخواهد در آن بنماید"},
+    {"law": "قانون مدنی", "article": "1106", "text": "در عقد دائم نفقه زن به عهده شوهر است"},
+    {"law": "قانون صدور چک", "article": "7", "text": "هر کس مبادرت به صدور چک بلامحل نماید به حبس محکوم می‌شود"},
+    {"law": "قانون مجازات اسلامی", "article": "656", "text": "سرقت در موارد زیر موجب حبس است"},
+]
+
+
+@pytest.fixture(scope="module")
+def index_path(tmp_path_factory):
+    root = tmp_path_factory.mktemp("statutes")
+    (root / "corpus.jsonl").write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in CORPUS),
+                                       encoding="utf-8")
+    path = str(root / "statutes.idx")
+    stats = statutes.build_index([str(root)], path)
+    assert stats["articles"] == len(CORPUS)
+    return path
+
+
+@pytest.fixture
+def index(index_path, monkeypatch):
+    index = statutes.StatuteIndex(index_path)
+    monkeypatch.setattr(statutes, "_index", index)
+    monkeypatch.setattr(statutes, "_index_loaded", True)
+    statutes.relevant_articles.cache_clear()
+    yield index
+    statutes.relevant_articles.cache_clear()
+
+
+def test_article_lookup_uses_sorted_table(index):
+    doc_id = index.article("civil", "1106")
+    assert index.describe(doc_id) == ("قانون مدنی", "1106")
+    assert "نفقه" in index.text(doc_id)
+    assert index.article("civil", "9999") is None
+    assert index.article("cheque", "7") is not None
+
+
+def test_search_ranks_matching_articles(index):
+    hits = index.search("نفقه زن در عقد دائم", 2)
+    assert index.describe(hits[0][0]) == ("قانون مدنی", "1106")
+    assert index.search("واژه‌ای که در پیکره نیست", 3) == []
+
+
+def test_lookup_article_answers_without_llm(index):
+    answer = statutes.lookup_article("متن ماده ۱۹۰ قانون مدنی چیست؟")
+    assert answer.startswith("ماده 190 قانون مدنی:")
+    assert statutes.lookup_article("ماده ۱۹۰ قانون مدنی درباره فروش خانه من چه می‌گوید؟") is None
+
+
+def test_relevant_articles_respects_token_budget(index, monkeypatch):
+    assert "ماده 7 قانون صدور چک" in statutes.relevant_articles("مجازات صدور چک بلامحل")
+    monkeypatch.setattr(statutes, "STATUTE_CONTEXT_TOKENS", 1)
+    statutes.relevant_articles.cache_clear()
+    assert statutes.relevant_articles("مجازات صدور چک بلامحل") == ""
+
+
+def test_older_index_format_is_rejected(tmp_path):
+    path = tmp_path / "old.idx"
+    path.write_bytes(b"QYSTAT1\n" + b"\0" * 16)
+    with pytest.raises(ValueError):
+        statutes.StatuteIndex(str(path))
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from backend import aio, tenants
+from backend.aio import RateLimited, UpstreamBusy, UpstreamLimiter, current_tenant
+from backend.tenants import DEFAULT_LIMITS, Tenant, TenantRegistry, TokenBucket
+
+
+# ───────────────────────────── token bucket
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(tenants.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate_per_s=2.0, capacity=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.take() == 0.0
+    now[0] += 100
+    bucket.take(0)
+    assert bucket.level == 3  # سقف capacity
+
+
+def test_oversized_take_costs_one_full_bucket():
+    bucket = TokenBucket(rate_per_s=1.0, capacity=10)
+    assert bucket.take(50) == 0.0
+    assert bucket.take(1) == pytest.approx(1.0, abs=0.01)
+
+
+def test_tenant_rejections_carry_retry_after():
+    tenant = Tenant("t", {**DEFAULT_LIMITS, "requests_per_min": 60, "burst": 1, "tokens_per_min": 600,
+                          "token_burst": 100})
+    tenant.admit()
+    with pytest.raises(RateLimited) as limited:
+        tenant.admit()
+    assert limited.value.retry_after == 1
+    tenant.charge_tokens(100)
+    with pytest.raises(RateLimited) as limited:
+        tenant.charge_tokens(50)
+    assert limited.value.retry_after == 5
+
+
+def test_exhausted_tenant_gets_429_with_retry_after(client):
+    statuses = [client.post("/chatbot/responses", json={"question": "مهریه"}, headers={"X-Domain": "tight.test"})
+                for _ in range(3)]
+    assert [resp.status_code for resp in statuses[:2]] == [200, 200]
+    assert statuses[2].status_code == 429
+    assert int(statuses[2].headers["Retry-After"]) >= 1
+    assert statuses[2].json["error"]
+    # سهمیهٔ یک دامنه به دامنهٔ دیگر ربطی ندارد
+    assert client.post("/chatbot/responses", json={"question": "مهریه"},
+                       headers={"X-Domain": "a.test"}).status_code == 200
+
+
+def test_unknown_domain_is_forbidden(client):
+    resp = client.post("/chatbot/responses", json={"question": "مهریه"}, headers={"X-Domain": "evil.test"})
+    assert resp.status_code == 403
+
+
+# ───────────────────────────── config reload
+def _write(path, config, mtime):
+    with open(path, "w") as fh:
+        json.dump(config, fh)
+    os.utime(path, (mtime, mtime))
+
+
+def test_config_reload_keeps_buckets_and_survives_bad_files(tmp_path):
+    path = str(tmp_path / "tenants.json")
+    _write(path, {"tenants": {"x.test": {"burst": 2, "aliases": ["www.x.test"]}}}, 1000)
+    registry = TenantRegistry(path, reload_s=0)
+    tenant = registry.resolve("WWW.x.test ")
+    assert tenant is registry.resolve("x.test")
+    tenant.admit()
+
+    _write(path, {"tenants": {"x.test": {"burst": 2, "weight": 3}, "y.test": {}}}, 2000)
+    assert registry.resolve("x.test") is tenant and tenant.weight == 3
+    assert registry.resolve("www.x.test") is None and len(registry) == 2
+    tenant.admit()
+    with pytest.raises(RateLimited):
+        tenant.admit()  # سطل با بارگذاری دوباره پر نشده است
+
+    with open(path, "w") as fh:
+        fh.write("{not json")
+    os.utime(path, (3000, 3000))
+    assert registry.resolve("y.test") is not None  # پیکربندی قبلی معتبر می‌ماند
+
+    os.unlink(path)
+    assert registry.resolve("x.test") is None
+
+
+# ───────────────────────────── fair queue
+class _T:
+    def __init__(self, name, weight=1.0, max_queued=100):
+        self.name, self.weight, self.max_queued = name, weight, max_queued
+
+    def reject_queued(self):
+        return RateLimited(retry_after=1)
+
+
+def _drain(limiter, arrivals):
+    """یک slot اشغال است و arrivals به ترتیب در صف می‌روند؛ ترتیب گرفتن slot برگردانده می‌شود."""
+    order = []
+
+    async def one(tenant, label):
+        current_tenant.set(tenant)
+        async with limiter.slot():
+            order.append(label)
+            await asyncio.sleep(0)
+
+    async def main():
+        async with limiter.slot():
+            tasks = []
+            for tenant, label in arrivals:
+                tasks.append(asyncio.create_task(one(tenant, label)))
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return order
+
+
+def test_fair_queue_interleaves_tenants():
+    heavy, light = _T("heavy"), _T("light")
+    arrivals = [(heavy, f"h{i}") for i in range(4)] + [(light, f"l{i}") for i in range(2)]
+    assert _drain(UpstreamLimiter(1, 100), arrivals) == ["h0", "l0", "h1", "l1", "h2", "h3"]
+
+
+def test_fair_queue_honours_weights():
+    big, small = _T("big", weight=2), _T("small")
+    arrivals = [(small, f"s{i}") for i in range(3)] + [(big, f"b{i}") for i in range(4)]
+    assert _drain(UpstreamLimiter(1, 100), arrivals) == ["b0", "s0", "b1", "b2", "s1", "b3", "s2"]
+
+
+def test_queue_limits_per_tenant_and_global():
+    limiter = UpstreamLimiter(1, 3)
+    noisy, other = _T("noisy", max_queued=2), _T("other")
+    errors = []
+
+    async def one(tenant):
+        current_tenant.set(tenant)
+        try:
+            async with limiter.slot():
+                await asyncio.sleep(0)
+        except (RateLimited, UpstreamBusy) as e:
+            errors.append((tenant.name, type(e).__name__))
+
+    async def main():
+        async with limiter.slot():
+            tasks = [asyncio.create_task(one(t)) for t in (noisy, noisy, noisy, other, other)]
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert errors == [("noisy", "RateLimited"), ("other", "UpstreamBusy")]
+    assert limiter.inflight == 0 and limiter.waiting == 0
+
+
+def test_full_upstream_queue_sheds_with_503_and_a_full_tenant_queue_with_429(app, fake_upstream, monkeypatch):
+    monkeypatch.setattr(aio.limiter, "max_inflight", 1)
+    monkeypatch.setattr(aio.limiter, "max_queue", 1)
+    monkeypatch.setattr(fake_upstream, "chat_latency", lambda: 0.5)
+    statuses = []
+
+    def ask(question, domain):
+        resp = app.test_client().post("/chatbot/responses", json={"question": question}, headers={"X-Domain": domain})
+        statuses.append(resp.status_code)
+
+    holder = threading.Thread(target=ask, args=("شرایط طلاق توافقی چیست؟", "a.test"))
+    holder.start()
+    while aio.limiter.inflight < 1:
+        time.sleep(0.01)
+    queued = threading.Thread(target=ask, args=("مجازات کلاهبرداری چیست؟", "b.test"))
+    queued.start()
+    while aio.limiter.waiting < 1:
+        time.sleep(0.01)
+
+    client = app.test_client()
+    busy = client.post("/chatbot/responses", json={"question": "اگر همسرم نفقه ندهد چه کنم؟"},
+                       headers={"X-Domain": "a.test"})
+    assert busy.status_code == 503 and busy.headers["Retry-After"] == str(aio.UPSTREAM_RETRY_AFTER_S)
+    assert busy.json["error"]
+
+    # صف سراسری جا دارد ولی سهم صف این tenant پر است → 429
+    monkeypatch.setattr(aio.limiter, "max_queue", 10)
+    monkeypatch.setattr(tenants.registry.resolve("b.test"), "max_queued", 1)
+    limited = client.post("/chatbot/responses", json={"question": "ارث همسر چقدر است؟"},
+                          headers={"X-Domain": "b.test"})
+    assert limited.status_code == 429 and int(limited.headers["Retry-After"]) >= 1
+
+    holder.join()
+    queued.join()
+    assert statuses == [200, 200]
+    assert aio.limiter.inflight == 0 and aio.limiter.waiting == 0
+
+
+# ───────────────────────────── in-flight dedup
+def test_identical_concurrent_questions_share_one_upstream_call(app, fake_upstream, monkeypatch):
+    monkeypatch.setattr(fake_upstream, "chat_latency", lambda: 0.5)
+    before = fake_upstream.counts["chat"]
+    barrier = threading.Barrier(6)
+    answers = []
+
+    def ask():
+        client = app.test_client()
+        barrier.wait()
+        resp = client.post("/chatbot/responses", json={"question": "شرایط طلاق توافقی چیست؟"},
+                           headers={"X-Domain": "a.test"})
+        answers.append((resp.status_code, resp.json["answer"]))
+
+    threads = [threading.Thread(target=ask) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(answers) == 6 and len(set(answers)) == 1 and answers[0][0] == 200
+    assert fake_upstream.counts["chat"] - before == 1
+
+
+# ───────────────────────────── contextvar
+@pytest.mark.parametrize("path", ["/chatbot/responses", "/chatbot/responses?stream=1"])
+def test_tenant_does_not_leak_into_the_next_request_on_the_thread(client, path):
+    assert current_tenant.get() is None
+    resp = client.post(path, json={"question": "مهریه"}, headers={"X-Domain": "a.test"})
+    assert resp.status_code == 200
+    resp.get_data()
+    resp.close()
+    assert current_tenant.get() is None
+    assert aio.limiter.inflight == 0
@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from backend import aio, upstream
+from backend.upstream import CircuitOpenError, UpstreamClient
+
+
+class Stub:
+    """Scripted chat-completions server: each request pops (status, headers, delay_s) from the script."""
+
+    def __init__(self):
+        self.script = []
+        self.default = (200, {}, 0.0)
+        self.requests = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    number = stub.requests
+                    status, headers, delay = stub.script.pop(0) if stub.script else stub.default
+                time.sleep(delay)
+                if status == 200:
+                    body = {"id": f"c{number}", "object": "chat.completion", "model": "gpt-4o",
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": f"answer {number}"}}],
+                            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+                else:
+                    body = {"error": {"message": f"injected {status}", "type": "server_error"}}
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in {"Content-Type": "application/json", **headers}.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+
+@pytest.fixture(scope="module")
+def stub():
+    stub = Stub()
+    yield stub
+    stub.server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fresh_stub(stub, monkeypatch):
+    stub.script, stub.default, stub.requests = [], (200, {}, 0.0), 0
+    monkeypatch.setattr(upstream, "UPSTREAM_BACKOFF_BASE_S", 0.01)
+
+
+def _call(client, stub):
+    return aio.run(client.call(openai.ChatCompletion.acreate, model="gpt-4o", api_base=stub.base,
+                               messages=[{"role": "user", "content": "سلام"}]))
+
+
+def test_transient_errors_are_retried_with_jittered_backoff(stub, monkeypatch):
+    jitter = []
+
+    def uniform(low, high):
+        jitter.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(upstream.random, "uniform", uniform)
+    stub.script = [(500, {}, 0), (503, {}, 0)]
+    client = UpstreamClient("t", 5)
+    resp = _call(client, stub)
+    assert resp.choices[0].message["content"] == "answer 3"
+    assert client.stats["retries"] == 2 and stub.requests == 3
+    # full jitter: uniform(0, base * 2^attempt)
+    assert jitter == [(0, 0.01), (0, 0.02)]
+
+
+def test_retry_after_header_sets_the_delay(stub, monkeypatch):
+    monkeypatch.setattr(upstream.random, "uniform", lambda *a: pytest.fail("jitter used despite Retry-After"))
+    stub.script = [(429, {"Retry-After": "0.4"}, 0)]
+    started = time.monotonic()
+    _call(UpstreamClient("t", 5), stub)
+    assert time.monotonic() - started >= 0.4
+    assert stub.requests == 2
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.script = [(400, {}, 0)]
+    client = UpstreamClient("t", 5)
+    with pytest.raises(openai.error.InvalidRequestError):
+        _call(client, stub)
+    assert stub.requests == 1 and client.breaker.state == "closed"
+
+
+def test_breaker_opens_then_half_opens_with_a_single_probe(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_MAX_RETRIES", 0)
+    client = UpstreamClient("t", 5)
+    client.breaker.threshold, client.breaker.cooldown_s = 2, 0.3
+    stub.default = (500, {}, 0)
+    for _ in range(2):
+        with pytest.raises(openai.error.APIError):
+            _call(client, stub)
+    assert client.breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        _call(client, stub)
+    assert stub.requests == 2 and client.stats["rejected_open"] == 1
+
+    time.sleep(0.35)
+    assert client.breaker.state == "half_open"
+    stub.default = (200, {}, 0.3)
+    # فقط یک probe مجاز است؛ فراخوانی هم‌زمان دوم رد می‌شود
+    results = {}
+
+    def first():
+        results["probe"] = _call(client, stub)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    time.sleep(0.1)
+    with pytest.raises(CircuitOpenError):
+        _call(client, stub)
+    thread.join()
+    assert results["probe"].choices[0].message["content"]
+    assert client.breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_breaker(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_MAX_RETRIES", 0)
+    client = UpstreamClient("t", 5)
+    client.breaker.threshold, client.breaker.cooldown_s = 1, 0.2
+    stub.default = (500, {}, 0)
+    with pytest.raises(openai.error.APIError):
+        _call(client, stub)
+    time.sleep(0.25)
+    with pytest.raises(openai.error.APIError):
+        _call(client, stub)  # probe
+    assert client.breaker.state == "open"
+
+
+def test_cancelled_probe_does_not_wedge_the_breaker(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_MAX_RETRIES", 0)
+    client = UpstreamClient("t", 5)
+    client.breaker.threshold, client.breaker.cooldown_s = 1, 0.2
+    stub.default = (500, {}, 0)
+    with pytest.raises(openai.error.APIError):
+        _call(client, stub)
+    time.sleep(0.25)
+
+    # probe کند است و فراخواننده زودتر رها می‌کند (مثل قطع کلاینت)
+    stub.default = (200, {}, 0.5)
+    call = client.call(openai.ChatCompletion.acreate, model="gpt-4o", api_base=stub.base,
+                       messages=[{"role": "user", "content": "سلام"}])
+    with pytest.raises(TimeoutError):
+        aio.run(call, timeout=0.1)
+    time.sleep(0.05)  # لغو روی loop پس‌زمینه اجرا شود
+    assert client.breaker.state == "half_open"
+
+    stub.default = (200, {}, 0)
+    assert _call(client, stub).choices[0].message["content"]
+    assert client.breaker.state == "closed"
+
+
+def _primed_hedging_client():
+    client = UpstreamClient("t", 5, hedge=True)
+    client._latencies.extend([0.05] * upstream.HEDGE_MIN_SAMPLES)
+    return client
+
+
+def test_slow_primary_is_hedged_and_backup_wins(stub):
+    stub.script = [(200, {}, 1.5), (200, {}, 0)]
+    client = _primed_hedging_client()
+    started = time.monotonic()
+    resp = _call(client, stub)
+    assert time.monotonic() - started < 1.0
+    assert resp.choices[0].message["content"] == "answer 2"
+    assert client.stats["hedges"] == 1 and client.stats["hedge_wins"] == 1
+    # slot درخواست دوم پس از پایانش پس داده شده است
+    time.sleep(0.1)
+    assert aio.limiter.inflight == 0
+
+
+def test_no_hedge_when_limiter_is_saturated(stub, monkeypatch):
+    monkeypatch.setattr(aio.limiter, "inflight", aio.limiter.max_inflight)
+    stub.script = [(200, {}, 0.3)]
+    client = _primed_hedging_client()
+    resp = _call(client, stub)
+    assert resp.choices[0].message["content"] == "answer 1"
+    assert stub.requests == 1
+    assert client.stats["hedges"] == 0 and client.stats["hedges_skipped"] == 1
@@ -0,0 +1,285 @@
+"""
+bench – تست بار endpointهای چت و صوت در هم‌روندی‌های افزایشی
+
+    python tools/bench.py                                  # همه سناریوها، 1/4/16/64 هم‌روند
+    python tools/bench.py -s chat -c 1,8,32 -n 300 --out before.json
+    python tools/bench.py --chat-latency lognormal:-0.5,0.4 --error-rate 0.05
+    python tools/bench.py --target http://127.0.0.1:5000  # سرور در حال اجرا (OpenAI همان که خودش تنظیم کرده)
+
+به‌طور پیش‌فرض create_app() در همین پردازه روی پورت آزاد اجرا می‌شود و OPENAI_API_BASE
+به سرور جعلی tools/fake_openai.py اشاره می‌کند (کش پاسخ، کش متن صوت و Sentry خاموش‌اند).
+تفکیک مراحل (decode، انتظار صف upstream، stt، llm و ...) از هدر Server-Timing خوانده می‌شود.
+
+خروجی: JSON روی stdout (یا --out)، جدول خلاصه روی stderr.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import statistics
+import struct
+import sys
+import threading
+import time
+import uuid
+import wave
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_openai  # noqa: E402  (هم‌پوشه؛ sys.path[0] همین پوشه است)
+
+SCENARIOS = ("chat", "chat-stream", "audio")
+QUESTIONS = (
+    "شرایط صحت معامله چیست",
+    "مهلت تجدیدنظرخواهی از رای دادگاه چقدر است",
+    "حضانت فرزند پس از طلاق با کیست",
+    "آیا چک بلامحل جرم است",
+)
+
+
+# ───────────────────────────── helpers
+def make_wav(seconds: float, sample_rate: int = 44100) -> bytes:
+    """یک WAV استریو با بوق سینوسی + نویز، شبیه پیام صوتی واقعی از نظر حجم."""
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        sample = int(8000 * math.sin(2 * math.pi * 220 * i / sample_rate) + random.randint(-800, 800))
+        frames += struct.pack("<hh", sample, sample)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """'stt;dur=800.0, llm;dur=512.3' → {"stt": 800.0, "llm": 512.3} (میلی‌ثانیه)."""
+    spans = {}
+    for part in filter(None, (p.strip() for p in (header or "").split(","))):
+        name, _, params = part.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                try:
+                    spans[name.strip()] = float(value)
+                except ValueError:
+                    pass
+    return spans
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(values: List[float]) -> dict:
+    if not values:
+        return {}
+    return {
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+        "mean": round(statistics.fmean(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+# ───────────────────────────── one request
+class Client:
+    """یک requests.Session برای هر نخ (keep-alive، مثل کلاینت واقعی)."""
+
+    def __init__(self, base_url: str, wav: bytes, fallbacks=()):
+        self.base_url = base_url.rstrip("/")
+        self.wav = wav
+        self.fallbacks = set(fallbacks)
+        self._local = threading.local()
+
+    @property
+    def http(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+            self._local.session.headers["X-Domain"] = "localhost"
+        return self._local.session
+
+    def run(self, scenario: str) -> dict:
+        # پرسش یکتا تا کش پاسخ (اگر روی سرور هدف فعال باشد) نتیجه را خراب نکند
+        question = f"{random.choice(QUESTIONS)} ({uuid.uuid4().hex[:8]})"
+        started = time.perf_counter()
+        result = {"status": None, "error": None, "ttfb_ms": None, "stages": {}}
+        try:
+            if scenario == "chat":
+                resp = self.http.post(f"{self.base_url}/chatbot/responses", json={"question": question}, timeout=120)
+                self._check_answer(resp, result)
+            elif scenario == "chat-stream":
+                resp = self.http.post(f"{self.base_url}/chatbot/responses?stream=1",
+                                      json={"question": question}, stream=True, timeout=120)
+                for line in resp.iter_lines():
+                    if result["ttfb_ms"] is None and line.startswith(b"event: delta"):
+                        result["ttfb_ms"] = (time.perf_counter() - started) * 1000
+                    if line.startswith(b"event: error"):
+                        result["error"] = "stream error event"
+                resp.close()
+            else:
+                resp = self.http.post(f"{self.base_url}/chatbot/audio",
+                                      files={"audio": ("voice.wav", self.wav, "audio/wav")}, timeout=120)
+                self._check_answer(resp, result)
+            result["status"] = resp.status_code
+            result["stages"] = parse_server_timing(resp.headers.get("Server-Timing", ""))
+        except requests.RequestException as exc:
+            result["error"] = type(exc).__name__
+        result["latency_ms"] = (time.perf_counter() - started) * 1000
+        return result
+
+    def _check_answer(self, resp: requests.Response, result: dict) -> None:
+        # خطای upstream با 200 و پیام جایگزین برمی‌گردد؛ نباید موفق شمرده شود
+        if resp.status_code == 200 and resp.json().get("answer") in self.fallbacks:
+            result["error"] = "fallback answer"
+
+
+def run_level(client: Client, scenario: str, concurrency: int, total: int) -> dict:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # گرم کردن اتصال‌ها؛ در نتیجه شمرده نمی‌شود
+        list(executor.map(lambda _: client.run(scenario), range(concurrency)))
+        started = time.perf_counter()
+        results = list(executor.map(lambda _: client.run(scenario), range(total)))
+        duration = time.perf_counter() - started
+
+    ok = [r for r in results if r["status"] == 200 and not r["error"]]
+    stages = defaultdict(list)
+    for r in ok:
+        for name, ms in r["stages"].items():
+            stages[name].append(ms)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "status_counts": dict(Counter(str(r["status"]) for r in results)),
+        "errors": dict(Counter(r["error"] for r in results if r["error"])),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 2) if duration else None,
+        "latency_ms": summarize([r["latency_ms"] for r in ok]),
+        "ttfb_ms": summarize([r["ttfb_ms"] for r in ok if r["ttfb_ms"] is not None]),
+        "stages_ms": {name: summarize(values) for name, values in sorted(stages.items())},
+    }
+
+
+# ───────────────────────────── in-process target
+def write_bench_tenants() -> str:
+    """پیکربندی tenant بدون سقف عملی، تا 429 سهمیه‌ها در نتایج بار دیده نشود."""
+    import tempfile
+    unlimited = {"requests_per_min": 10 ** 7, "burst": 10 ** 5, "tokens_per_min": 10 ** 10,
+                 "token_burst": 10 ** 8, "max_queued": 10 ** 5}
+    config = {"defaults": unlimited, "anonymous": unlimited, "tenants": {"localhost": {}}}
+    fd, path = tempfile.mkstemp(prefix="bench-tenants-", suffix=".json")
+    with os.fdopen(fd, "w") as fh:
+        json.dump(config, fh)
+    return path
+
+
+def start_local_app(args: argparse.Namespace):
+    """سرور جعلی OpenAI + create_app() روی پورت آزاد؛ خروجی: (base_url, fake_config)."""
+    fake = fake_openai.config_from_args(args)
+    fake_server = fake_openai.serve(fake)
+    # پیش از import app: upstream و sentry این مقادیر را هنگام import می‌خوانند
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{fake_server.server_port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake-bench")
+    os.environ["ANSWER_CACHE_BACKEND"] = "off"
+    os.environ["TRANSCRIPT_CACHE_BACKEND"] = "off"  # هر درخواست همان WAV را می‌فرستد
+    os.environ["SENTRY_DSN"] = ""
+    os.environ["TENANTS_CONFIG"] = write_bench_tenants()
+
+    import logging
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", fake
+
+
+def internal_stats() -> dict:
+    from backend import upstream
+    from backend.decode_pool import pool
+
+    return {
+        "decode_pool": pool.snapshot(),
+        "upstream": {client.name: dict(client.stats) for client in (upstream.chat, upstream.stt)},
+    }
+
+
+def print_header() -> None:
+    header = f"{'scenario':<12} {'conc':>5} {'ok':>8} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}  stages p50 (ms)"
+    print(header, file=sys.stderr)
+    print("-" * len(header), file=sys.stderr)
+
+
+def print_row(r: dict) -> None:
+    lat = r["latency_ms"] or {}
+    stages = " ".join(f"{name}={s['p50']}" for name, s in r["stages_ms"].items())
+    print(f"{r['scenario']:<12} {r['concurrency']:>5} {r['ok']:>4}/{r['requests']:<3} "
+          f"{r['throughput_rps'] or 0:>8} {lat.get('p50', '-'):>8} {lat.get('p95', '-'):>8} "
+          f"{lat.get('p99', '-'):>8}  {stages}", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the chat and audio endpoints.")
+    parser.add_argument("-s", "--scenarios", default=",".join(SCENARIOS), help=f"comma separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("-c", "--concurrency", default="1,4,16,64", help="comma separated concurrency levels")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="measured requests per level")
+    parser.add_argument("--audio-seconds", type=float, default=5.0, help="length of the generated WAV")
+    parser.add_argument("--target", help="base URL of an already running server (skips the local app and fake)")
+    parser.add_argument("--out", help="write JSON results here instead of stdout")
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    fake = None
+    base_url = args.target
+    if base_url is None:
+        base_url, fake = start_local_app(args)
+    from backend.core import FALLBACK_MESSAGES
+
+    client = Client(base_url, make_wav(args.audio_seconds), FALLBACK_MESSAGES)
+    results = []
+    print_header()
+    for scenario in scenarios:
+        for concurrency in levels:
+            results.append(run_level(client, scenario, concurrency, args.requests))
+            print_row(results[-1])
+
+    report = {
+        "target": args.target or "in-process",
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "target")},
+        "results": results,
+    }
+    if fake is not None:
+        report["fake_openai"] = dict(fake.counts)
+        report["server"] = internal_stats()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
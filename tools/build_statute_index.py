@@ -0,0 +1,28 @@
+"""
+build_statute_index – ساخت آفلاین نمایهٔ قوانین برای backend.statutes
+
+    python tools/build_statute_index.py corpus/ [more.jsonl ...] [-o data/statutes.idx]
+
+هر سطر ورودی: {"law": "قانون مدنی", "article": "190", "text": "..."}
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.statutes import STATUTE_INDEX_PATH, build_index  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the on-disk statute index.")
+    parser.add_argument("sources", nargs="+", help="JSONL files or directories of *.jsonl")
+    parser.add_argument("-o", "--output", default=STATUTE_INDEX_PATH, help="index file to write")
+    args = parser.parse_args()
+
+    stats = build_index(args.sources, args.output)
+    print(f"Wrote {args.output}: {stats['articles']} articles, {stats['terms']} terms, {stats['bytes']} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+fake_openai – سرور محلی جایگزین OpenAI برای تست بار (بدون هزینهٔ API)
+
+    python tools/fake_openai.py --port 8099 --chat-latency lognormal:-0.5,0.4 --error-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8099/v1 python app.py
+
+endpointها:
+    POST /v1/chat/completions       پاسخ JSON یا استریم SSE (stream=true) با usage
+    POST /v1/audio/transcriptions   متن ثابت (response_format=text) یا {"text": ...}
+
+توزیع تأخیر: fixed:S | uniform:A,B | normal:MEAN,SD | lognormal:MU,SIGMA (ثانیه)
+خطای تزریقی: با احتمال --error-rate یکی از --error-codes (مثلاً 429,500,503) برمی‌گردد.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Sequence
+
+FAKE_ANSWER = (
+    "طبق مادهٔ ۱۹۰ قانون مدنی برای صحت هر معامله چهار شرط اساسی لازم است: "
+    "قصد طرفین و رضای آن‌ها، اهلیت طرفین، موضوع معین که مورد معامله باشد و مشروعیت جهت معامله."
+)
+FAKE_TRANSCRIPT = "شرایط صحت معامله در قانون مدنی چیست"
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """'lognormal:-0.5,0.4' → تابعی که هر بار یک تأخیر (ثانیه، نامنفی) برمی‌گرداند."""
+    kind, _, raw = spec.partition(":")
+    params = [float(p) for p in raw.split(",") if p]
+    if kind == "fixed" and len(params) == 1:
+        return lambda: params[0]
+    if kind == "uniform" and len(params) == 2:
+        return lambda: random.uniform(*params)
+    if kind == "normal" and len(params) == 2:
+        return lambda: max(0.0, random.gauss(*params))
+    if kind == "lognormal" and len(params) == 2:
+        return lambda: random.lognormvariate(*params)
+    raise ValueError(f"bad latency spec {spec!r}; expected fixed:S, uniform:A,B, normal:M,SD or lognormal:MU,SIGMA")
+
+
+class FakeConfig:
+    def __init__(self, chat_latency: str = "fixed:0.5", stt_latency: str = "fixed:0.8",
+                 token_delay_s: float = 0.02, error_rate: float = 0.0,
+                 error_codes: Sequence[int] = (429, 500, 503), answer: str = FAKE_ANSWER,
+                 transcript: str = FAKE_TRANSCRIPT):
+        self.chat_latency = parse_latency(chat_latency)
+        self.stt_latency = parse_latency(stt_latency)
+        self.token_delay_s = token_delay_s
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.answer = answer
+        self.transcript = transcript
+        self.counts = {"chat": 0, "stt": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+
+def _rough_tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 3))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive، مثل API واقعی
+    config: FakeConfig
+
+    def log_message(self, fmt, *args):  # خروجی هر درخواست روی stderr لازم نیست
+        pass
+
+    # ---------------------------------------------------------------- helpers
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", headers)
+
+    def _maybe_fail(self) -> bool:
+        cfg = self.config
+        if not cfg.error_codes or random.random() >= cfg.error_rate:
+            return False
+        cfg.count("errors")
+        status = random.choice(cfg.error_codes)
+        kind = "rate_limit_exceeded" if status == 429 else "server_error"
+        headers = {"Retry-After": "1"} if status == 429 else None
+        self._send_json(status, {"error": {"message": f"injected {status}", "type": kind, "code": kind}}, headers)
+        return True
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    # ---------------------------------------------------------------- routes
+    def do_POST(self):
+        if self.path.endswith("/chat/completions"):
+            self._chat()
+        elif self.path.endswith("/audio/transcriptions"):
+            self._transcription()
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def _chat(self) -> None:
+        cfg = self.config
+        cfg.count("chat")
+        request = json.loads(self._read_body() or b"{}")
+        time.sleep(cfg.chat_latency())
+        if self._maybe_fail():
+            return
+
+        model = request.get("model", "gpt-4o")
+        prompt_tokens = sum(_rough_tokens(m.get("content") or "") for m in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": _rough_tokens(cfg.answer),
+                 "total_tokens": prompt_tokens + _rough_tokens(cfg.answer)}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": model}
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": cfg.answer}}],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")  # بدون Content-Length؛ پایان پاسخ = بستن اتصال
+        self.end_headers()
+        words = cfg.answer.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            self._write_event({**base, "object": "chat.completion.chunk",
+                               "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            time.sleep(cfg.token_delay_s)
+        self._write_event({**base, "object": "chat.completion.chunk", "usage": usage,
+                           "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _write_event(self, payload: dict) -> None:
+        self.wfile.write(b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _transcription(self) -> None:
+        cfg = self.config
+        cfg.count("stt")
+        body = self._read_body()
+        time.sleep(cfg.stt_latency())
+        if self._maybe_fail():
+            return
+        if b'name="response_format"\r\n\r\ntext' in body:
+            self._send(200, cfg.transcript.encode("utf-8"), "text/plain; charset=utf-8")
+        else:
+            self._send_json(200, {"text": cfg.transcript})
+
+
+def serve(config: FakeConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """سرور را در یک نخ پس‌زمینه اجرا می‌کند؛ آدرس پایه: http://host:server.server_port/v1"""
+    handler = type("FakeOpenAIHandler", (_Handler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--chat-latency", default="fixed:0.5", help="time to first byte of chat responses")
+    parser.add_argument("--stt-latency", default="fixed:0.8", help="transcription latency")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an injected error")
+    parser.add_argument("--error-codes", default="429,500,503", help="comma separated statuses to inject")
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(
+        chat_latency=args.chat_latency,
+        stt_latency=args.stt_latency,
+        token_delay_s=args.token_delay,
+        error_rate=args.error_rate,
+        error_codes=[int(c) for c in args.error_codes.split(",") if c],
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat and transcription API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(config_from_args(args), args.host, args.port)
+    print(f"Fake OpenAI listening on http://{args.host}:{server.server_port}/v1 (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()